@@ -112,8 +112,17 @@ class VoxelStorageL(StorageClass):
         offsets = value_intern["off"]
         comp_arrs = value_intern["arr"]
         decomp_arrs = []
-        for i in range(len(sh)):
-            decomp_arrs.append(lz4string_listtoarr(comp_arrs[i], dt, sh[i]))
+        if value_intern.get("packed", False):
+            # bit-packed bool masks; "sh" holds the full block shapes
+            for i in range(len(sh)):
+                packed = lz4string_listtoarr(comp_arrs[i], np.uint8)
+                # `count` kwarg of np.unpackbits requires numpy >= 1.17;
+                # slice off the padding bits instead
+                flat = np.unpackbits(packed)[:int(np.prod(sh[i]))]
+                decomp_arrs.append(flat.view(np.bool_).reshape(sh[i]))
+        else:
+            for i in range(len(sh)):
+                decomp_arrs.append(lz4string_listtoarr(comp_arrs[i], dt, sh[i]))
         if self._cache_decomp:
             self._cache_dc[item] = decomp_arrs
         return decomp_arrs, offsets
@@ -133,6 +142,16 @@ class VoxelStorageL(StorageClass):
         assert len(voxel_masks) == len(offsets)
         if self._cache_decomp:
             self._cache_dc[key] = voxel_masks
+        if voxel_masks[0].dtype == np.bool_:
+            # store bool masks bit-packed (1 bit per voxel); requires the
+            # full block shapes for decoding
+            value_intern = {"arr": [arrtolz4string_list(
+                np.packbits(v.reshape(-1))) for v in voxel_masks],
+                            "sh": [tuple(v.shape) for v in voxel_masks],
+                            "dt": voxel_masks[0].dtype.str,
+                            "off": offsets, "packed": True}
+            self._dc_intern[key] = value_intern
+            return
         sh = [v.shape for v in voxel_masks]
         for i in range(len(sh)):
             curr_sh = list(sh[i])
@@ -152,6 +171,16 @@ class VoxelStorageL(StorageClass):
 
         assert dt == voxel_mask.dtype.str
 
+        if value_intern.get("packed", False):
+            # keep the entry's bit-packed layout
+            sh.append(tuple(voxel_mask.shape))
+            value_intern = {"arr": comp_arrs + [arrtolz4string_list(
+                np.packbits(voxel_mask.reshape(-1)))],
+                            "sh": sh, "dt": dt, "off": offsets,
+                            "packed": True}
+            self._dc_intern[key] = value_intern
+            return
+
         curr_sh = list(voxel_mask.shape)
         curr_sh[0] = -1
         sh.append(curr_sh)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# SyConn - Synaptic connectivity inference toolkit
+#
+# Copyright (c) 2016 - now
+# Max Planck Institute of Neurobiology, Martinsried, Germany
+# Authors: Sven Dorkenwald, Philipp Schubert, Joergen Kornfeld
+
+import io
+import mmap
+import os
+import pickle
+import struct
+import sys
+
+import numpy as np
+
+# extracts one job's parameter slice from the consolidated storage file
+# written by QSUB_script; the index holds (job_id, offset, length) rows.
+# The slice is a sequence of tagged frames: b'N' + raw npy array,
+# b'P' + int64 length + pickle/dill payload, or b'R' + 16-byte blake2b
+# digest referencing a deduplicated payload in shared.bin. It is
+# transcoded into the plain pickle stream the QSUB_* worker scripts
+# expect.
+path_storage_file = sys.argv[1]
+path_index_file = sys.argv[2]
+job_id = int(sys.argv[3])
+path_out_file = sys.argv[4]
+
+storage_folder = os.path.dirname(path_storage_file)
+path_shared_file = os.path.join(storage_folder, "shared.bin")
+path_shared_index = os.path.join(storage_folder, "shared_idx.pkl")
+
+index = np.fromfile(path_index_file, dtype=np.int64).reshape(-1, 3)
+row = index[index[:, 0] == job_id][0]
+
+with open(path_storage_file, "rb") as f:
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    buf = io.BytesIO(mm[row[1]:row[1] + row[2]])
+    mm.close()
+
+shared_mm = None
+shared_index = None
+
+with open(path_out_file, "wb") as f_out:
+    while True:
+        tag = buf.read(1)
+        if tag == b'':
+            break
+        if tag == b'N':
+            arr = np.lib.format.read_array(buf, allow_pickle=False)
+            pickle.dump(arr, f_out, protocol=pickle.HIGHEST_PROTOCOL)
+        elif tag == b'R':
+            digest = buf.read(16)
+            if shared_mm is None:
+                with open(path_shared_index, "rb") as f:
+                    shared_index = pickle.load(f)
+                f_shared = open(path_shared_file, "rb")
+                shared_mm = mmap.mmap(f_shared.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            offset, length = shared_index[digest]
+            f_out.write(shared_mm[offset:offset + length])
+        else:
+            length = struct.unpack('<q', buf.read(8))[0]
+            # pickle and dill payloads are copied verbatim; the worker's
+            # pickle.load consumes exactly one object per frame
+            f_out.write(buf.read(length))
+
+if shared_mm is not None:
+    shared_mm.close()
+    f_shared.close()
@@ -50,6 +50,16 @@ backend = "FS"  # File system
 PYOPENGL_PLATFORM = 'egl'  # Rendering: 'egl' or 'osmesa'
 DISABLE_LOCKING = False
 
+# --------- INFERENCE PARAMETERS
+# If True, dense-volume inference casts its input to float16 for models
+# which advertise 'supports_fp16'. Halves memory bandwidth and enables
+# tensor-core throughput on recent GPUs.
+use_fp16_inference = False
+# If True, elektronn3 InferenceModels are run through torch.compile on load
+# (operator fusion, less Python dispatch). Requires a torch version which
+# ships torch.compile; failures fall back to the uncompiled model.
+use_torch_compile = False
+
 # --------- LOGGING
 # 'None' disables logging of SyConn modules (e.g. proc, handler, ...) to files.
 # Logs of executed scripts (syconn/scripts) will be stored at the
@@ -22,6 +22,13 @@ from knossos_utils import KnossosDataset
 import re
 import gc
 import signal
+try:
+    import lz4.frame
+    __lz4frame_avail__ = True
+except ImportError:
+    __lz4frame_avail__ = False
+#: magic bytes identifying an lz4-frame compressed pickle
+LZ4_FRAME_MAGIC = b'\x04"M\x18'
 import networkx as nx
 import contextlib
 import tqdm
@@ -511,7 +518,7 @@ def remove_from_zip(zipfname, *filenames):
         shutil.rmtree(tempdir)
 
 
-def write_obj2pkl(path, objects):
+def write_obj2pkl(path, objects, compress=False):
     """Writes object to pickle file
 
     Parameters
@@ -519,12 +526,19 @@ def write_obj2pkl(path, objects):
     objects : object
     path : str
         destianation
+    compress : bool
+        If True, the pickle stream is wrapped in an lz4 frame
+        (transparently detected by :func:`~load_pkl2obj`).
     """
     # with DelayedInterrupt([signal.SIGTERM, signal.SIGINT]):
     gc.disable()
     if isinstance(path, str):
-        with open(path, 'wb') as output:
-            pkl.dump(objects, output, -1)
+        if compress and __lz4frame_avail__:
+            with lz4.frame.open(path, 'wb') as output:
+                pkl.dump(objects, output, -1)
+        else:
+            with open(path, 'wb') as output:
+                pkl.dump(objects, output, -1)
     else:
         log_handler.warn("Write_obj2pkl takes arguments 'path' (str) and "
                          "'objects' (python object).")
@@ -545,6 +559,13 @@ def load_pkl2obj(path):
     -------
     """
     gc.disable()
+    with open(path, 'rb') as inp:
+        magic = inp.read(len(LZ4_FRAME_MAGIC))
+    if magic == LZ4_FRAME_MAGIC and __lz4frame_avail__:
+        with lz4.frame.open(path, 'rb') as inp:
+            objects = pkl.load(inp)
+        gc.enable()
+        return objects
     try:
         with open(path, 'rb') as inp:
             objects = pkl.load(inp)
@@ -5,7 +5,7 @@
 # Max Planck Institute of Neurobiology, Martinsried, Germany
 # Authors: Philipp Schubert, Joergen Kornfeld
 import numpy as np
-from numba import jit
+from numba import jit, prange
 from scipy import spatial
 from typing import Optional, Union, TYPE_CHECKING
 if TYPE_CHECKING:
@@ -256,10 +256,11 @@ def id2rgb(vertex_id):
     np.array
         RGB values [1, 3].
     """
-    red = vertex_id % 256
-    green = (vertex_id/256) % 256
-    blue = (vertex_id/256/256) % 256
-    colour = np.array([red, green, blue], dtype=np.uint8)
+    # integer shifts and masks; the old float divisions only worked by
+    # virtue of the truncating uint8 cast
+    vertex_id = int(vertex_id)
+    colour = np.array([vertex_id & 0xFF, (vertex_id >> 8) & 0xFF,
+                       (vertex_id >> 16) & 0xFF], dtype=np.uint8)
     return colour.squeeze()
 
 
@@ -281,17 +282,55 @@ def id2rgb_array(id_arr: np.ndarray):
 
     if np.max(id_arr) > 256**3:
         raise ValueError("Overflow in vertex ID array.")
-    if id_arr.ndim == 1:
-        id_arr = id_arr[:, None]
-    elif id_arr.ndim == 2:
+    if id_arr.ndim == 2:
         assert id_arr.shape[1] == 1, "ValueError: unsupported shape"
-    else:
+        id_arr = id_arr[:, 0]
+    elif id_arr.ndim != 1:
         raise ValueError("Unsupported shape")
-    rgb_arr = np.apply_along_axis(id2rgb, 1, id_arr)
+    # one vectorized shift/mask pass instead of a Python id2rgb call per id
+    id_arr = id_arr.astype(np.uint32)
+    rgb_arr = np.empty((len(id_arr), 3), dtype=np.uint8)
+    rgb_arr[:, 0] = id_arr & 0xFF
+    rgb_arr[:, 1] = (id_arr >> 8) & 0xFF
+    rgb_arr[:, 2] = (id_arr >> 16) & 0xFF
     return rgb_arr.squeeze()
 
 
-@jit
+def id2rgb_planes(id_arr: np.ndarray):
+    """
+    Planar variant of :func:`~id2rgb_array`: returns the red, green and
+    blue channels as three separate contiguous uint8 arrays. Each channel
+    is written as one sequential stream instead of 3-byte strided stores
+    into an interleaved buffer; use :func:`~interleave_rgb_planes` for
+    consumers that need the (N, 3) layout.
+
+    Parameters
+    ----------
+    id_arr : np.array
+        ID values [N, 1].
+
+    Returns
+    -------
+    np.array, np.array, np.array
+        R, G and B values per ID, each [N, ].
+    """
+    if np.max(id_arr) > 256**3:
+        raise ValueError("Overflow in vertex ID array.")
+    id_arr = np.asarray(id_arr).reshape(-1).astype(np.uint32, copy=False)
+    return ((id_arr & 0xFF).astype(np.uint8),
+            ((id_arr >> np.uint32(8)) & 0xFF).astype(np.uint8),
+            ((id_arr >> np.uint32(16)) & 0xFF).astype(np.uint8))
+
+
+def interleave_rgb_planes(r: np.ndarray, g: np.ndarray, b: np.ndarray) \
+        -> np.ndarray:
+    """
+    Interleaves planar channels from :func:`~id2rgb_planes` into the
+    (N, 3) layout of :func:`~id2rgb_array`.
+    """
+    return np.stack((r, g, b), axis=-1)
+
+
 def id2rgb_array_contiguous(id_arr: np.ndarray) -> np.ndarray:
     """
     Transforms ID values into the array of RGBs labels based on the assumption
@@ -309,17 +348,19 @@ def id2rgb_array_contiguous(id_arr: np.ndarray) -> np.ndarray:
     np.array
         Unique RGB value for every ID [N, 3].
     """
-    if id_arr.squeeze().ndim > 1:
+    squeezed = np.asarray(id_arr).squeeze()
+    if squeezed.ndim > 1:
         raise ValueError("Unsupported index array shape.")
-    nb_ids = len(id_arr.squeeze())
+    nb_ids = squeezed.size
     if nb_ids >= 256**3:
         raise ValueError("Overflow in vertex ID array.")
-    x1 = np.arange(256).astype(np.uint8)
-    x2 = np.arange(256).astype(np.uint8)
-    x3 = np.arange(256).astype(np.uint8)
-    xx1, xx2, xx3 = np.meshgrid(x1, x2, x3, sparse=False, copy=False)
-    rgb_arr = np.concatenate([xx3.flatten()[:, None], xx1.flatten()[:, None],
-                              xx2.flatten()[:, None]], axis=-1)[:nb_ids]
+    # decompose the flat index arithmetically; the former full 256**3
+    # meshgrid allocated ~50 MB of temporaries regardless of nb_ids
+    idx = np.arange(nb_ids, dtype=np.uint32)
+    rgb_arr = np.empty((nb_ids, 3), dtype=np.uint8)
+    rgb_arr[:, 0] = idx & 0xFF
+    rgb_arr[:, 1] = (idx >> np.uint32(8)) & 0xFF
+    rgb_arr[:, 2] = idx >> np.uint32(16)
     return rgb_arr
 
 
@@ -381,7 +422,6 @@ def rgb2id(rgb: np.ndarray) -> np.ndarray:
     return np.array([vertex_id], dtype=np.uint32)
 
 
-@jit
 def rgb2id_array(rgb_arr: np.ndarray) -> np.ndarray:
     """
     Transforms RGB values into IDs.
@@ -400,22 +440,41 @@ def rgb2id_array(rgb_arr: np.ndarray) -> np.ndarray:
         assert rgb_arr.shape[-1] == 3, "ValueError: unsupported shape"
     else:
         raise ValueError("Unsupported shape")
-    rgb_arr_flat = rgb_arr.flatten().reshape((-1, 3))
-    mask_arr = (rgb_arr_flat[:, 0] == 255) & (rgb_arr_flat[:, 1] == 255) & \
-               (rgb_arr_flat[:, 2] == 255)
-    id_arr = np.zeros((len(rgb_arr_flat)), dtype=np.uint32)
-    for ii in range(len(rgb_arr_flat)):
-        if mask_arr[ii]:
-            continue
-        rgb = rgb_arr_flat[ii]
-        id_arr[ii] = rgb[0] + rgb[1]*256 + rgb[2]*(256**2)
+    if rgb_arr.dtype == np.uint8 and rgb_arr.flags.c_contiguous:
+        # single streaming pass without the three shifted temporaries
+        id_arr = _rgb2id_kernel(rgb_arr.reshape((-1, 3)))
+        return id_arr.reshape(rgb_arr.shape[:-1])
+    rgb_arr_flat = rgb_arr.reshape((-1, 3)).astype(np.uint32, copy=False)
+    # ID = R + 256*G + 65536*B as one weighted channel sum; white pixels
+    # end up at 256**3 - 1, so the background remap needs no extra mask
+    weights = np.array([1, 256, 65536], dtype=np.uint32)
+    id_arr = rgb_arr_flat @ weights
     # convention: The highest index value in index view will correspond to the background
     # background_ix = np.max(id_arr) + 1
     background_ix = 256**3 - 2
-    id_arr[mask_arr] = background_ix
+    id_arr[id_arr == np.uint32(256**3 - 1)] = background_ix
     return id_arr.reshape(rgb_arr.shape[:-1])
 
 
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def _rgb2id_kernel(flat_rgb):
+    """
+    uint8-specialized pass of :func:`~rgb2id_array`; composes the IDs and
+    applies the background convention without allocating shifted
+    temporaries.
+    """
+    out = np.empty(flat_rgb.shape[0], dtype=np.uint32)
+    for i in prange(flat_rgb.shape[0]):
+        r = np.uint32(flat_rgb[i, 0])
+        g = np.uint32(flat_rgb[i, 1])
+        b = np.uint32(flat_rgb[i, 2])
+        if r == 255 and g == 255 and b == 255:
+            out[i] = 256**3 - 2
+        else:
+            out[i] = r | (g << np.uint32(8)) | (b << np.uint32(16))
+    return out
+
+
 @jit
 def rgba2id_array(rgb_arr: np.ndarray) -> np.ndarray:
     """
@@ -4,6 +4,9 @@
 # Copyright (c) 2016 - now
 # Max Planck Institute of Neurobiology, Martinsried, Germany
 # Authors: Philipp Schubert, Joergen Kornfeld
+import functools
+import gc
+import json
 import re
 import numpy as np
 import os
@@ -16,11 +19,12 @@ from typing import Dict, List, Iterable, Union, Optional, Any, TYPE_CHECKING, Tu
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.decomposition import PCA
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from numba import jit
 from knossos_utils.chunky import ChunkDataset, save_dataset
 from knossos_utils import knossosdataset
 knossosdataset._set_noprint(True)
 from knossos_utils.knossosdataset import KnossosDataset
-from sklearn.metrics import log_loss
 from scipy.special import softmax
 from syconn.handler.config import initialize_logging
 from syconn.reps import log_reps
@@ -32,7 +36,7 @@ from ..handler import log_handler
 from syconn.handler import log_main
 from .compression import load_from_h5py, save_to_h5py
 from .basics import read_txt_from_zip, get_filepaths_from_dir,\
-    parse_cc_dict_from_kzip
+    parse_cc_dict_from_kzip, write_obj2pkl, load_pkl2obj
 from .. import global_params
 
 
@@ -65,30 +69,32 @@ def load_gt_from_kzip(zip_fname, kd_p, raw_data_offset=75, verbose=False,
         kd_p = [kd_p]
     bb = parse_movement_area_from_zip(zip_fname)
     offset, size = bb[0], bb[1] - bb[0]
-    raw_data = []
-    label_data = []
-    for curr_p in kd_p:
+
+    def _load_from_kd(curr_p):
         kd = KnossosDataset()
         kd.initialize_from_knossos_path(curr_p)
         scaling = np.array(kd.scale, dtype=np.int)
         if np.isscalar(raw_data_offset):
-            raw_data_offset = np.array(scaling[0] * raw_data_offset / scaling)
+            curr_offset = np.array(scaling[0] * raw_data_offset / scaling)
             if verbose:
-                print('Using scale adapted raw offset:', raw_data_offset)
+                print('Using scale adapted raw offset:', curr_offset)
         elif len(raw_data_offset) != 3:
             raise ValueError("Offset for raw cubes has to have length 3.")
         else:
-            raw_data_offset = np.array(raw_data_offset)
-        raw = kd.from_raw_cubes_to_matrix(size // mag + 2 * raw_data_offset,
-                                          offset // mag - raw_data_offset, nb_threads=2,
+            curr_offset = np.array(raw_data_offset)
+        raw = kd.from_raw_cubes_to_matrix(size // mag + 2 * curr_offset,
+                                          offset // mag - curr_offset, nb_threads=2,
                                           mag=mag, show_progress=False)
-        raw_data.append(raw[None, ])
         label = kd.from_kzip_to_matrix(zip_fname, size // mag, offset // mag, mag=mag,
                                        verbose=False, show_progress=False)
-        label = label
-        label_data.append(label[None, ])
-    raw = np.concatenate(raw_data, axis=0).astype(np.float32)
-    label = np.concatenate(label_data, axis=0)
+        return raw[None, ], label[None, ]
+
+    # the cube loads are I/O bound and release the GIL inside knossos_utils,
+    # so multiple KDs are loaded concurrently
+    with ThreadPoolExecutor(max_workers=len(kd_p)) as tpe:
+        res = list(tpe.map(_load_from_kd, kd_p))
+    raw = np.concatenate([r[0] for r in res], axis=0).astype(np.float32)
+    label = np.concatenate([r[1] for r in res], axis=0)
     try:
         _ = parse_cc_dict_from_kzip(zip_fname)
     except:  # mergelist.txt does not exist
@@ -145,8 +151,10 @@ def predict_kzip(kzip_p, m_path, kd_path, clf_thresh=0.5, mfp_active=False,
         pred, raw = load_from_h5py(dest_path + "/%s_data.h5" % cube_name,
                                    hdf5_names=["pred", "raw"])
     offset = parse_movement_area_from_zip(kzip_p)[0]
+    # uint8 suffices for the binary mask and quarters the bytes pushed
+    # through the cube writer
     overlaycubes2kzip(dest_path + "/%s_pred.k.zip" % cube_name,
-                      (pred >= clf_thresh).astype(np.uint32),
+                      (pred >= clf_thresh).astype(np.uint8),
                       offset, kd_path)
 
 
@@ -246,10 +254,10 @@ def xyz2zxy(vol):
     np.array [M, .., Z, X, Y]
     """
     # assert vol.ndim == 3  # removed for multi-channel support
-    # adapt data to ELEKTRONN conventions (speed-up)
-    vol = vol.swapaxes(-2, -3)  # y x z
-    vol = vol.swapaxes(-3, -1)  # z x y
-    return vol
+    # adapt data to ELEKTRONN conventions (speed-up); a single moveaxis plus
+    # one contiguous copy avoids every downstream consumer re-copying the
+    # strided double-swapaxes view
+    return np.ascontiguousarray(np.moveaxis(vol, (-3, -2, -1), (-2, -1, -3)))
 
 
 def zxy2xyz(vol):
@@ -264,9 +272,7 @@ def zxy2xyz(vol):
     np.array [M, .., X, Y, Z]
     """
     # assert vol.ndim == 3  # removed for multi-channel support
-    vol = vol.swapaxes(-2, -3)  # x z y
-    vol = vol.swapaxes(-2, -1)  # x y z
-    return vol
+    return np.ascontiguousarray(np.moveaxis(vol, (-3, -2, -1), (-1, -3, -2)))
 
 
 def create_h5_from_kzip(zip_fname: str, kd_p: str,
@@ -347,7 +353,7 @@ def create_h5_from_kzip(zip_fname: str, kd_p: str,
 def create_h5_gt_file(fname: str, raw: np.ndarray, label: np.ndarray,
                       foreground_ids: Optional[Iterable[int]] = None,
                       target_labels: Optional[Iterable[int]] = None,
-                      debug: bool = False):
+                      debug: bool = False, verbose: bool = False):
     """
     Create .h5 files for ELEKTRONN input from two arrays.
     Only supports binary labels (0=background, 1=foreground). E.g. for creating
@@ -369,6 +375,8 @@ def create_h5_gt_file(fname: str, raw: np.ndarray, label: np.ndarray,
         be mapped to the corresponding label in `target_labels`.
     debug : bool
         will store labels and raw as uint8 ranging from 0 to 255
+    verbose : bool
+        if True, prints a per-label voxel count summary of the mapped labels
     """
     if target_labels is not None and foreground_ids is None:
         raise ValueError('`target_labels` is set, but `foreground_ids` is None.')
@@ -379,7 +387,12 @@ def create_h5_gt_file(fname: str, raw: np.ndarray, label: np.ndarray,
     raw = xyz2zxy(raw)
     print("Raw:", raw.shape, raw.dtype, raw.min(), raw.max())
     print("Label (after mapping):", label.shape, label.dtype, label.min(), label.max())
-    print("-----------------\nGT Summary:\n%s\n" %str(Counter(label.flatten()).items()))
+    if verbose:
+        # np.bincount is a single C pass over the volume; Counter would box
+        # every voxel into a Python int
+        label_cnt = np.bincount(label.ravel())
+        summary = {ix: int(cnt) for ix, cnt in enumerate(label_cnt) if cnt}
+        print("-----------------\nGT Summary:\n%s\n" % str(summary))
     if not fname[-2:] == "h5":
         fname = fname + ".h5"
     if debug:
@@ -504,28 +517,32 @@ def _pred_dataset(kd_p, kd_pred_p, cd_p, model_p, imposed_patch_size=None,
                   box_coords=np.zeros(3), fit_box_size=True)
 
     ch_dc = cd.chunk_dict
-    print('Total number of chunks for GPU/GPUs:', len(ch_dc.keys()))
+    print('Total number of chunks for GPU/GPUs:', len(ch_dc))
 
+    # dict views are not indexable on Py3; materialize once as an object
+    # array so the job slice below is O(1) and iteration stays cheap
+    chunk_list = np.fromiter(ch_dc.values(), dtype=object, count=len(ch_dc))
     if i is not None and n is not None:
-        chunks = ch_dc.values()[i::n]
+        chunks = chunk_list[i::n]
     else:
-        chunks = ch_dc.values()
+        chunks = chunk_list
     print("Starting prediction of %d chunks in gpu %d\n" % (len(chunks),
                                                             gpu_id))
 
     if not overwrite:
+        todo_chunks = []
         for chunk in chunks:
             try:
                 _ = chunk.load_chunk("pred")[0]
             except Exception as e:
-                chunk_pred(chunk, m)
+                todo_chunks.append(chunk)
     else:
-        for chunk in chunks:
-            try:
-                chunk_pred(chunk, m)
-            except KeyboardInterrupt as e:
-                print("Exiting out from chunk prediction: ", str(e))
-                return
+        todo_chunks = chunks
+    try:
+        chunk_pred_batch(todo_chunks, m)
+    except KeyboardInterrupt as e:
+        print("Exiting out from chunk prediction: ", str(e))
+        return
     save_dataset(cd)
 
     # single gpu processing also exports the cset to kd
@@ -617,8 +634,6 @@ def predict_dense_to_kd(kd_path: str, target_path: str, model_path: str,
         target_kd = knossosdataset.KnossosDataset()
         target_kd.initialize_without_conf(path, kd.boundary, kd.scale,
                                           kd.experiment_name, [2**x for x in range(5)])
-        target_kd = knossosdataset.KnossosDataset()
-        target_kd.initialize_from_knossos_path(path)
     # init QSUB parameters
     multi_params = chunk_ids
     # on avg. two jobs per GPU
@@ -634,6 +649,17 @@ def predict_dense_to_kd(kd_path: str, target_path: str, model_path: str,
     log.info('Finished dense prediction of {} Chunks'.format(len(chunk_ids)))
 
 
+@jit(nopython=True)
+def _add_thresholded(pred_flat, thresh, label, data_flat):
+    """
+    Branchless compose kernel ``data += (pred > thresh) * label`` on flat uint8
+    arrays. LLVM vectorizes the byte compare/and, avoiding NumPy's generic
+    byte loop and the boolean temporary.
+    """
+    for k in range(pred_flat.shape[0]):
+        data_flat[k] += np.uint8(pred_flat[k] > thresh) * label
+
+
 def dense_predictor(args):
     """
     TODO: Threshold mechanism requires refactoring.
@@ -686,18 +712,24 @@ def dense_predictor(args):
                           out_shape=out_shape, overlap_shape=overlap_shape_tiles[::-1],
                           apply_softmax=True)
     predictor.model.ae = False
-    # predict Chunks:
-    for ch_id in chunk_ids:
-        ch = cd.chunk_dict[ch_id]
-        ol = ch.overlap
-        size = np.array(np.array(ch.size) + 2 * np.array(ol),
-                        dtype=np.int)
-        coords = np.array(np.array(ch.coordinates) - np.array(ol),
-                          dtype=np.int)
-        raw = kd.from_raw_cubes_to_matrix(size, coords, mag=mag)
+    # predict Chunks; collect chunk metadata as SoA arrays once instead of
+    # re-creating small arrays per iteration
+    chunks = [cd.chunk_dict[ch_id] for ch_id in chunk_ids]
+    chunk_coords = np.array([ch.coordinates for ch in chunks], dtype=np.int)
+    chunk_sizes = np.array([ch.size for ch in chunks], dtype=np.int)
+    chunk_overlaps = np.array([ch.overlap for ch in chunks], dtype=np.int)
+    # chunk/tile geometry is deterministic per job (all chunks share the same
+    # overlap), so derive the input sizes, load offsets and the crop of the
+    # per-chunk overlap once instead of per chunk
+    ol = chunk_overlaps[0]
+    load_sizes = chunk_sizes + 2 * ol
+    load_offsets = chunk_coords - ol
+    crop_overlap = np.s_[..., ol[0]:-ol[0], ol[1]:-ol[1], ol[2]:-ol[2]]
+    for k, ch in enumerate(chunks):
+        raw = kd.from_raw_cubes_to_matrix(load_sizes[k], load_offsets[k], mag=mag)
         pred = dense_predicton_helper(raw.astype(np.float32) / 255., predictor)
         # slice out the original input volume along XYZ, i.e. the last three axes
-        pred = pred[..., ol[0]:-ol[0], ol[1]:-ol[1], ol[2]:-ol[2]]
+        pred = pred[crop_overlap]
         for j in range(len(target_channels)):
             ids = target_channels[j]
             path = target_kd_path_list[j]
@@ -710,7 +742,8 @@ def dense_predictor(args):
                         t = 255 / 2
                     if t < 1.:
                         t = 255 * t
-                    data += ((pred[i] > t) * n).astype(np.uint8)
+                    _add_thresholded(np.ascontiguousarray(pred[i]).ravel(),
+                                     t, np.uint8(n), data.ravel())
                     n += 1
                 else:
                     data = pred[i]
@@ -734,14 +767,41 @@ def dense_predicton_helper(raw: np.ndarray, predictor: 'Predictor') -> np.ndarra
     """
     # transform raw data
     raw = xyz2zxy(raw)
+    inp = raw[None, None]
+    try:
+        import torch
+        if torch.cuda.is_available():
+            # pinned host memory allows the predictor's H2D copy to run as
+            # async DMA instead of going through a pageable staging buffer
+            inp = torch.from_numpy(np.ascontiguousarray(inp)).pin_memory()
+    except ImportError:
+        pass
     # predict: pred of the form (N, C, [D,], H, W)
-    pred = predictor.predict(raw[None, None])
+    pred = predictor.predict(inp)
     pred = np.array(pred[0]) * 255  # remove N-axis
     pred = pred.astype(np.uint8)
     pred = zxy2xyz(pred)
     return pred
 
 
+@functools.lru_cache(maxsize=4)
+def _load_elektronn2_model(model_p, imposed_patch_size, mfp_active,
+                           imposed_batch_size):
+    """
+    Memoized elektronn2 model load with dropout rates already zeroed.
+    `imposed_patch_size` has to be hashable, i.e. a tuple or None. Repeated
+    predictions with identical settings reuse the GPU-resident graph
+    instead of re-parsing the model file.
+    """
+    from elektronn2.neuromancer.model import modelload
+    m = modelload(model_p, imposed_patch_size=list(imposed_patch_size)
+                  if imposed_patch_size is not None else None,
+                  override_mfp_to_active=mfp_active,
+                  imposed_batch_size=imposed_batch_size)
+    m.dropout_rates = ([0.0, ] * len(m.dropout_rates))
+    return m
+
+
 def to_knossos_dataset(kd_p, kd_pred_p, cd_p, model_p,
                        imposed_patch_size, mfp_active=False):
     """
@@ -759,17 +819,14 @@ def to_knossos_dataset(kd_p, kd_pred_p, cd_p, model_p,
     -------
 
     """
-    from elektronn2.neuromancer.model import modelload
     log_reps.warning('Depracation Warning; "to_knossos_dataset" is deprecated and will be '
                      'replaced by "predict_dense_to_kd" which immediately .')
     kd = KnossosDataset()
     kd.initialize_from_knossos_path(kd_p, fixed_mag=1)
     kd_pred = KnossosDataset()
-    m = modelload(model_p, imposed_patch_size=list(imposed_patch_size)
-    if isinstance(imposed_patch_size, tuple) else imposed_patch_size,
-                  override_mfp_to_active=mfp_active, imposed_batch_size=1)
-    original_do_rates = m.dropout_rates
-    m.dropout_rates = ([0.0, ] * len(original_do_rates))
+    m = _load_elektronn2_model(model_p, tuple(imposed_patch_size)
+                               if imposed_patch_size is not None else None,
+                               mfp_active, 1)
     offset = m.target_node.shape.offsets
     offset = np.array([offset[1], offset[2], offset[0]], dtype=np.int)
     cd = ChunkDataset()
@@ -782,7 +839,7 @@ def to_knossos_dataset(kd_p, kd_pred_p, cd_p, model_p,
 
 
 def prediction_helper(raw, model, override_mfp=True,
-                      imposed_patch_size=None):
+                      imposed_patch_size=None, free_model=False):
     """
     Helper function for predicting raw volumes (range: 0 to 255; uint8).
     Will change X, Y, Z to ELEKTRONN format (Z, X, Y) and returns prediction
@@ -797,6 +854,10 @@ def prediction_helper(raw, model, override_mfp=True,
     override_mfp : bool
     imposed_patch_size : tuple
         in Z, X, Y FORMAT!
+    free_model : bool
+        if True and `model` is a path, drop the memoized model and its GPU
+        graph after the prediction; for single-shot callers which would
+        otherwise keep the graph resident.
 
     Returns
     -------
@@ -804,24 +865,112 @@ def prediction_helper(raw, model, override_mfp=True,
         prediction data [X, Y, Z]
     """
     if type(model) == str:
-        from elektronn2.neuromancer.model import modelload
-        m = modelload(model, imposed_patch_size=list(imposed_patch_size)
-        if isinstance(imposed_patch_size, tuple) else imposed_patch_size,
-                      override_mfp_to_active=override_mfp, imposed_batch_size=1)
-        original_do_rates = m.dropout_rates
-        m.dropout_rates = ([0.0, ] * len(original_do_rates))
+        m = _load_elektronn2_model(model, tuple(imposed_patch_size)
+                                   if imposed_patch_size is not None else None,
+                                   override_mfp, 1)
     else:
         m = model
-    raw = xyz2zxy(raw)
-    if raw.dtype.kind in ('u', 'i'):
-        # convert to float 32 and scale it
-        raw = raw.astype(np.float32) / 255.
-    if not raw.dtype == np.float32:
-        # assume already normalized between 0 and 1
-        raw = raw.astype(np.float32)
-    assert 0 <= np.max(raw) <= 1.0 and 0 <= np.min(raw) <= 1.0
-    pred = m.predict_dense(raw[None,], pad_raw=True)[1]
-    return zxy2xyz(pred)
+    try:
+        raw = xyz2zxy(raw)
+        if raw.dtype.kind in ('u', 'i'):
+            # convert to float 32 and scale it
+            raw = raw.astype(np.float32) / 255.
+        if not raw.dtype == np.float32:
+            # assume already normalized between 0 and 1
+            raw = raw.astype(np.float32)
+        if __debug__:
+            # range check is debug-only ('python -O' skips it); evaluate min
+            # and max once each instead of re-walking the volume per comparison
+            mn, mx = np.min(raw), np.max(raw)
+            assert 0 <= mn and mx <= 1.0
+        if global_params.use_fp16_inference and getattr(m, 'supports_fp16',
+                                                        False):
+            raw = raw.astype(np.float16)
+        pred = m.predict_dense(raw[None,], pad_raw=True)[1]
+        return zxy2xyz(pred.astype(np.float32, copy=False))
+    finally:
+        if free_model and type(model) == str:
+            del m
+            _load_elektronn2_model.cache_clear()
+            gc.collect()
+
+
+# per-worker model handle for 'chunk_pred_parallel'; populated once per
+# process by the pool initializer
+_chunk_pred_model = None
+
+
+def _chunk_pred_init(model_path, gpu_ids):
+    global _chunk_pred_model
+    from multiprocessing import current_process
+    proc_id = current_process()._identity[0] - 1
+    # pin this worker to one GPU before any CUDA context is created
+    os.environ['CUDA_VISIBLE_DEVICES'] = str(gpu_ids[proc_id % len(gpu_ids)])
+    _chunk_pred_model = _load_elektronn2_model(model_path, None, False, 1)
+
+
+def _chunk_pred_worker(ch):
+    chunk_pred(ch, _chunk_pred_model)
+
+
+def chunk_pred_parallel(chunks, model_path, n_gpus=None):
+    """
+    Predicts chunks with one persistent worker process per GPU. Each worker
+    pins itself to a GPU via CUDA_VISIBLE_DEVICES in the pool initializer
+    and keeps the model resident for its lifetime, so N chunks are spread
+    over all GPUs without reloading the model per chunk.
+
+    Parameters
+    ----------
+    chunks : iterable of Chunk
+    model_path : str
+        path to predictive model
+    n_gpus : int
+        number of worker processes/GPUs; defaults to
+        'global_params.NGPUS_PER_NODE'
+    """
+    from multiprocessing import Pool
+    if n_gpus is None:
+        n_gpus = global_params.NGPUS_PER_NODE
+    gpu_ids = list(range(n_gpus))
+    with Pool(processes=n_gpus, initializer=_chunk_pred_init,
+              initargs=(model_path, gpu_ids)) as pool:
+        for _ in pool.imap_unordered(_chunk_pred_worker, chunks, chunksize=4):
+            pass
+
+
+def chunk_pred_batch(chunks, model, debug=False, prefetch=2):
+    """
+    Predicts a sequence of chunks while overlapping chunk I/O with
+    inference: raw cubes of upcoming chunks are prefetched by a small
+    thread pool (the reads release the GIL) and the chunk writes are
+    submitted back to it, so the GPU does not idle between chunks.
+
+    Parameters
+    ----------
+    chunks : iterable of Chunk
+    model : str or model object
+    debug : bool
+    prefetch : int
+        number of chunks loaded ahead of the running prediction
+    """
+    chunks = list(chunks)
+    with ThreadPoolExecutor(max_workers=2) as tpe:
+        raw_futures = [tpe.submit(ch.raw_data) for ch in chunks[:prefetch]]
+        save_futures = []
+        for k, ch in enumerate(chunks):
+            raw = raw_futures[k].result()
+            if k + prefetch < len(chunks):
+                raw_futures.append(tpe.submit(chunks[k + prefetch].raw_data))
+            pred = prediction_helper(raw, model) * 255
+            pred = pred.astype(np.uint8)
+            save_futures.append(tpe.submit(ch.save_chunk, pred, "pred",
+                                           "pred", overwrite=True))
+            if debug:
+                save_futures.append(tpe.submit(ch.save_chunk, raw, "pred",
+                                               "raw", overwrite=False))
+        for f in save_futures:
+            f.result()
 
 
 def chunk_pred(ch, model, debug=False):
@@ -874,6 +1023,23 @@ class NeuralNetworkInterface(object):
         self.model.dropout_rates = ([0.0, ] * len(self.original_do_rates))
 
     def predict_proba(self, x, verbose=False):
+        if isinstance(x, (list, tuple)):
+            # ragged input: group samples of identical shape so every
+            # stacked batch is uniform and padding waste is paid at most
+            # once per shape group; ndarray input is homogeneous already
+            order = sorted(range(len(x)), key=lambda ii: x[ii].shape)
+            inv_order = np.argsort(order)
+            proba_groups = []
+            start = 0
+            while start < len(order):
+                end = start
+                while end < len(order) and \
+                        x[order[end]].shape == x[order[start]].shape:
+                    end += 1
+                batch = np.stack([x[ii] for ii in order[start:end]])
+                proba_groups.append(self.predict_proba(batch, verbose=verbose))
+                start = end
+            return np.concatenate(proba_groups)[inv_order]
         x = x.astype(np.float32)
         if self.normalize_data:
             if self.normalize_func is not None:
@@ -881,64 +1047,159 @@ class NeuralNetworkInterface(object):
             else:
                 x = naive_view_normalization(x)
         bs = self.imposed_batch_size
-        # using floor now and remaining samples are treated later
+        if self.arch == "triplet":
+            x = views2tripletinput(x)
+        n_samples = len(x)
+        # pad once up to a full multiple of the batch size; the padded zero
+        # samples are sliced off below. This removes the remainder special
+        # case and keeps every model call at the imposed batch size.
+        pad = (-n_samples) % bs
+        if pad != 0:
+            x = np.concatenate([x, np.zeros((pad,) + x.shape[1:],
+                                            dtype=np.float32)])
+        # np.empty: every entry is overwritten by the prediction loop below,
+        # so the initial ones-fill was one full-buffer write for nothing
         if self.arch == "rec_view":
-            batches = [np.arange(i * bs, (i + 1) * bs) for i in
-                       range(int(np.floor(x.shape[1] / bs)))]
-            proba = np.ones((x.shape[1], 4, self.nb_labels))
+            proba = np.empty((len(x), 4, self.nb_labels), dtype=np.float32)
         elif self.arch == "triplet":
-            x = views2tripletinput(x)
-            batches = [np.arange(i * bs, (i + 1) * bs) for i in
-                       range(int(np.floor(len(x) / bs)))]
             # nb_labels represents latent space dim.; 3 -> view triplet
-            proba = np.ones((len(x), self.nb_labels, 3))
+            proba = np.empty((len(x), self.nb_labels, 3), dtype=np.float32)
         else:
-            batches = [np.arange(i * bs, (i + 1) * bs) for i in
-                       range(int(np.floor(len(x) / bs)))]
-            proba = np.ones((len(x), self.nb_labels))
+            proba = np.empty((len(x), self.nb_labels), dtype=np.float32)
         if verbose:
-            cnt = 0
             start = time.time()
-            pbar = tqdm.tqdm(total=len(batches), ncols=80, leave=False,
+            pbar = tqdm.tqdm(total=len(x) // bs, ncols=80, leave=False,
                              unit='it', unit_scale=True, dynamic_ncols=False)
-        for b in batches:
+        for b in range(0, len(x), bs):
+            proba[b:b + bs] = self.model.predict(x[b:b + bs])
             if verbose:
-                sys.stdout.write("\r%0.2f" % (float(cnt) / len(batches)))
-                sys.stdout.flush()
-                cnt += 1
                 pbar.update()
-            x_b = x[b]
-            proba[b] = self.model.predict(x_b)[None, ]
-        overhead = len(x) % bs
-        # TODO: add proper axis handling, maybe introduce axistags
-        if overhead != 0:
-            new_x_b = x[-overhead:]
-            if len(new_x_b) < bs:
-                add_shape = list(new_x_b.shape)
-                add_shape[0] = bs - len(new_x_b)
-                new_x_b = np.concatenate((np.zeros((add_shape),
-                                                   dtype=np.float32), new_x_b))
-            proba[-overhead:] = self.model.predict(new_x_b)[-overhead:]
+        proba = proba[:n_samples]
         if verbose:
             end = time.time()
-            sys.stdout.write("\r%0.2f\n" % 1.0)
-            sys.stdout.flush()
             print("Prediction of %d samples took %0.2fs; %0.4fs/sample." %\
-                  (len(x), end-start, (end-start)/len(x)))
+                  (n_samples, end-start, (end-start)/n_samples))
             pbar.close()
         if self.arch == "triplet":
             return proba[..., 0]
         return proba
 
 
-def get_axoness_model():
+def autotune_batch_size(model_path, sample_shape,
+                        candidates=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+                        n_repeats=3, **model_kwargs):
+    """
+    Determines the throughput-optimal ``imposed_batch_size`` for the model at
+    `model_path` by sweeping over `candidates` (stopping at the first
+    out-of-memory error) and timing `n_repeats` predictions each. The result
+    is cached on disk per model path, so the sweep runs only once per
+    working directory.
+
+    Parameters
+    ----------
+    model_path : str
+        path to predictive model
+    sample_shape : tuple
+        shape of a single input sample (without batch axis)
+    candidates : tuple of int
+        batch sizes to probe
+    n_repeats : int
+        number of timed predictions per candidate
+    model_kwargs : dict
+        additional keyword arguments passed to 'NeuralNetworkInterface'
+
+    Returns
+    -------
+    int
+        batch size with the highest measured throughput
+    """
+    cache_p = global_params.config.working_dir + '/models/batch_size_cache.json'
+    key = os.path.abspath(model_path)
+    try:
+        with open(cache_p) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        cache = {}
+    if key in cache:
+        return cache[key]
+    best_bs = candidates[0]
+    best_throughput = 0.
+    for bs in candidates:
+        try:
+            m = NeuralNetworkInterface(model_path, imposed_batch_size=bs,
+                                       **model_kwargs)
+            sample = np.zeros((bs, ) + tuple(sample_shape), dtype=np.float32)
+            _ = m.predict_proba(sample)  # warm-up
+            dts = []
+            for _ in range(n_repeats):
+                start = time.time()
+                _ = m.predict_proba(sample)
+                dts.append(time.time() - start)
+            throughput = bs / np.median(dts)
+        except (RuntimeError, MemoryError):
+            # out of memory; larger candidates will not fit either
+            break
+        if throughput > best_throughput:
+            best_throughput = throughput
+            best_bs = bs
+    cache[key] = best_bs
+    try:
+        os.makedirs(os.path.dirname(cache_p), exist_ok=True)
+        with open(cache_p, 'w') as f:
+            json.dump(cache, f)
+    except IOError as e:
+        log_handler.warning('Could not write batch size cache at {}: '
+                            '{}'.format(cache_p, e))
+    return best_bs
+
+
+# model paths which already ran their warm-up inference in this process
+_warmed_models = set()
+
+
+def _warmup_model(m, sample_shape):
+    """
+    Triggers cuDNN kernel compilation with a single zero-batch prediction.
+    Runs at most once per model path and process; without warm-up the cost
+    is simply paid by the first real prediction.
+    """
+    if m._path in _warmed_models:
+        return
+    _ = m.predict_proba(np.zeros(sample_shape, dtype=np.float32))
+    _warmed_models.add(m._path)
+
+
+def get_axoness_model(autotune_bs=False, warmup=False):
     """
     Retrained with GP dendrites. May 2018.
     """
+    bs = 200 if not autotune_bs else autotune_batch_size(
+        global_params.config.mpath_axoness, (4, 2, 128, 256), nb_labels=3,
+        normalize_data=True)
     m = NeuralNetworkInterface(global_params.config.mpath_axoness,
-                               imposed_batch_size=200,
+                               imposed_batch_size=bs,
                                nb_labels=3, normalize_data=True)
-    _ = m.predict_proba(np.zeros((1, 4, 2, 128, 256)))
+    if warmup:
+        _warmup_model(m, (1, 4, 2, 128, 256))
+    return m
+
+
+def _compile_e3_model(m):
+    """
+    Applies ``torch.compile`` to an elektronn3 InferenceModel when
+    ``global_params.use_torch_compile`` is set. Compilation failures are
+    non-fatal (graph capture depends on torch version and model internals)
+    and fall back to the eager model.
+    """
+    if not global_params.use_torch_compile:
+        return m
+    try:
+        import torch
+        m.model = torch.compile(m.model, mode='reduce-overhead',
+                                fullgraph=False)
+    except Exception as e:
+        log_handler.warning('torch.compile failed for "{}": {}'.format(
+            getattr(m, '_path', '?'), e))
     return m
 
 
@@ -947,14 +1208,18 @@ def get_axoness_model_e3():
     from elektronn3.models.base import InferenceModel
     path = global_params.config.mpath_axoness_e3
     m = InferenceModel(path, normalize_func=naive_view_normalization_new)
-    return m
+    return _compile_e3_model(m)
 
 
-def get_glia_model():
+def get_glia_model(autotune_bs=False, warmup=False):
+    bs = 200 if not autotune_bs else autotune_batch_size(
+        global_params.config.mpath_glia, (1, 2, 128, 256), nb_labels=2,
+        normalize_data=True)
     m = NeuralNetworkInterface(global_params.config.mpath_glia,
-                               imposed_batch_size=200, nb_labels=2,
+                               imposed_batch_size=bs, nb_labels=2,
                                normalize_data=True)
-    _ = m.predict_proba(np.zeros((1, 1, 2, 128, 256)))
+    if warmup:
+        _warmup_model(m, (1, 1, 2, 128, 256))
     return m
 
 
@@ -963,20 +1228,25 @@ def get_glia_model_e3():
     from elektronn3.models.base import InferenceModel
     path = global_params.config.mpath_glia_e3
     m = InferenceModel(path, normalize_func=naive_view_normalization_new)
-    return m
+    return _compile_e3_model(m)
 
 
-def get_celltype_model(init_gpu=None):
+def get_celltype_model(init_gpu=None, autotune_bs=False, warmup=False):
     """
     Retrained on new GT on Jan. 13th, 2019.
     """
+    bs = 2 if not autotune_bs else autotune_batch_size(
+        global_params.config.mpath_celltype, (4, 20, 128, 256), nb_labels=4,
+        normalize_data=True, normalize_func=naive_view_normalization_new,
+        init_gpu=init_gpu)
     # this model was trained with 'naive_view_normalization_new'
     m = NeuralNetworkInterface(global_params.config.mpath_celltype,
-                               imposed_batch_size=2, nb_labels=4,
+                               imposed_batch_size=bs, nb_labels=4,
                                normalize_data=True,
                                normalize_func=naive_view_normalization_new,
                                init_gpu=init_gpu)
-    _ = m.predict_proba(np.zeros((6, 4, 20, 128, 256)))
+    if warmup:
+        _warmup_model(m, (6, 4, 20, 128, 256))
     return m
 
 
@@ -995,7 +1265,7 @@ def get_celltype_model_e3():
         raise ImportError(msg)
     path = global_params.config.mpath_celltype_e3
     m = InferenceModel(path)
-    return m
+    return _compile_e3_model(m)
 
 
 def get_celltype_model_large_e3():
@@ -1013,7 +1283,7 @@ def get_celltype_model_large_e3():
         raise ImportError(msg)
     path = global_params.config.mpath_celltype_large_e3
     m = InferenceModel(path)
-    return m
+    return _compile_e3_model(m)
 
 
 def get_semseg_spiness_model():
@@ -1027,7 +1297,7 @@ def get_semseg_spiness_model():
     path = global_params.config.mpath_spiness
     m = InferenceModel(path)
     m._path = path
-    return m
+    return _compile_e3_model(m)
 
 
 def get_semseg_axon_model():
@@ -1041,7 +1311,7 @@ def get_semseg_axon_model():
     path = global_params.config.mpath_axonsem
     m = InferenceModel(path)
     m._path = path
-    return m
+    return _compile_e3_model(m)
 
 
 def get_tripletnet_model_e3():
@@ -1055,7 +1325,7 @@ def get_tripletnet_model_e3():
         raise ImportError(msg)
     m_path = global_params.config.mpath_tnet
     m = InferenceModel(m_path)
-    return m
+    return _compile_e3_model(m)
 
 
 def get_tripletnet_model_large_e3():
@@ -1069,7 +1339,7 @@ def get_tripletnet_model_large_e3():
         raise ImportError(msg)
     m_path = global_params.config.mpath_tnet_large
     m = InferenceModel(m_path)
-    return m
+    return _compile_e3_model(m)
 
 
 def get_myelin_cnn():
@@ -1088,7 +1358,7 @@ def get_myelin_cnn():
         raise ImportError(msg)
     m_path = global_params.config.mpath_myelin
     m = InferenceModel(m_path)
-    return m
+    return _compile_e3_model(m)
 
 
 def get_knn_tnet_embedding_e3():
@@ -1107,26 +1377,62 @@ def naive_view_normalization(d):
     # perform pseudo-normalization
     # (proper normalization: how to store mean and std for inference?)
     if not (np.min(d) >= 0 and np.max(d) <= 1.0):
-        for ii in range(len(d)):
-            curr_view = d[ii]
-            if 0 <= np.max(curr_view) <= 1.0:
-                curr_view = curr_view - 0.5
-            else:
-                curr_view = curr_view / 255. - 0.5
-            d[ii] = curr_view
+        # one vectorized pass: the per-sample max decides whether a view is
+        # already within [0, 1] or still stored as uint8 range
+        sample_max = d.reshape(len(d), -1).max(axis=1)
+        scale = np.where((sample_max >= 0) & (sample_max <= 1.0),
+                         np.float32(1.), np.float32(1. / 255.))
+        np.multiply(d, scale.reshape((len(d),) + (1,) * (d.ndim - 1)), out=d)
+        np.subtract(d, 0.5, out=d)
     else:
         d = d - 0.5
     return d
 
 
 def naive_view_normalization_new(d):
-    return d.astype(np.float32) / 255. - 0.5
+    # fused scale-and-shift into one preallocated output: a single pass
+    # instead of astype copy + divide + subtract
+    out = np.empty(d.shape, dtype=np.float32)
+    np.multiply(d, np.float32(1. / 255.), out=out, casting='unsafe')
+    out -= np.float32(0.5)
+    return out
+
+
+def _load_cached_estimator(cache_p, input_fnames):
+    """
+    Loads the pickled estimator at `cache_p` if it exists and is newer than
+    all files in `input_fnames`, otherwise returns None.
+    """
+    if not os.path.isfile(cache_p):
+        return None
+    cache_mtime = os.path.getmtime(cache_p)
+    if any(os.path.getmtime(fname) > cache_mtime for fname in input_fnames):
+        return None
+    return load_pkl2obj(cache_p)
+
+
+def _concat_npy_files(fnames, dtype):
+    """
+    Concatenates .npy files along axis 0 into one preallocated array.
+    Each file is opened memory-mapped and copied sequentially into its
+    pre-sized slice, keeping peak memory at the size of the result
+    instead of result + all inputs.
+    """
+    mmaps = [np.load(fname, mmap_mode='r') for fname in fnames]
+    total = sum(len(m) for m in mmaps)
+    out = np.empty((total, ) + mmaps[0].shape[1:], dtype=dtype)
+    start = 0
+    for m in mmaps:
+        out[start:start + len(m)] = m
+        start += len(m)
+    return out
 
 
 def knn_clf_tnet_embedding(fold, fit_all=False):
     """
     Currently it assumes embedding for GT views has been created already in 'fold'
-    and put into l_train_%d.npy / l_valid_%d.npy files.
+    and put into l_train_%d.npy / l_valid_%d.npy files. Fitted classifiers are
+    cached inside 'fold' and reused as long as no input file is newer.
 
     Parameters
     ----------
@@ -1141,39 +1447,39 @@ def knn_clf_tnet_embedding(fold, fit_all=False):
         fold, fname_includes=["l_axoness_train"], ending=".npy")
     valid_fnames = get_filepaths_from_dir(
         fold, fname_includes=["l_axoness_valid"], ending=".npy")
-
-    train_d = []
-    train_l = []
-    valid_d = []
-    valid_l = []
-    for tf in train_fnames:
-        train_l.append(np.load(tf))
-        tf = tf.replace("l_axoness_train", "ls_axoness_train")
-        train_d.append(np.load(tf))
-    for tf in valid_fnames:
-        valid_l.append(np.load(tf))
-        tf = tf.replace("l_axoness_valid", "ls_axoness_valid")
-        valid_d.append(np.load(tf))
-
-    train_d = np.concatenate(train_d).astype(dtype=np.float32)
-    train_l = np.concatenate(train_l).astype(dtype=np.uint16)
-    valid_d = np.concatenate(valid_d).astype(dtype=np.float32)
-    valid_l = np.concatenate(valid_l).astype(dtype=np.uint16)
-
-    nbrs = KNeighborsClassifier(n_neighbors=5, algorithm='auto',
-                                n_jobs=16, weights='uniform')
+    data_fnames = [tf.replace("l_axoness_", "ls_axoness_") for tf in
+                   train_fnames + valid_fnames]
+    cache_p = os.path.join(fold, "knn5_fitall{}.pkl".format(fit_all))
+    nbrs = _load_cached_estimator(
+        cache_p, train_fnames + valid_fnames + data_fnames)
+    if nbrs is not None:
+        return nbrs
+
+    train_l = _concat_npy_files(train_fnames, np.uint16)
+    train_d = _concat_npy_files(data_fnames[:len(train_fnames)], np.float32)
+    valid_l = _concat_npy_files(valid_fnames, np.uint16)
+    valid_d = _concat_npy_files(data_fnames[len(train_fnames):], np.float32)
+
+    # brute force + euclidean on contiguous float32 dispatches the pairwise
+    # distances into BLAS, which beats tree traversal for the high-dim
+    # tnet embeddings; 'auto' would fall back to it anyway, but implicitly
+    nbrs = KNeighborsClassifier(n_neighbors=5, algorithm='brute',
+                                metric='euclidean', n_jobs=-1,
+                                weights='uniform')
     if fit_all:
         nbrs.fit(np.concatenate([train_d, valid_d]),
                  np.concatenate([train_l, valid_l]).ravel())
     else:
         nbrs.fit(train_d, train_l.ravel())
+    write_obj2pkl(cache_p, nbrs)
     return nbrs
 
 
 def pca_tnet_embedding(fold, n_components=3, fit_all=False):
     """
     Currently it assumes embedding for GT views has been created already in 'fold'
-    and put into l_train_%d.npy / l_valid_%d.npy files.
+    and put into l_train_%d.npy / l_valid_%d.npy files. Fitted estimators are
+    cached inside 'fold' and reused as long as no input file is newer.
 
     Parameters
     ----------
@@ -1189,39 +1495,37 @@ def pca_tnet_embedding(fold, n_components=3, fit_all=False):
         fold, fname_includes=["l_axoness_train"], ending=".npy")
     valid_fnames = get_filepaths_from_dir(
         fold, fname_includes=["l_axoness_valid"], ending=".npy")
-
-    train_d = []
-    train_l = []
-    valid_d = []
-    valid_l = []
-    for tf in train_fnames:
-        train_l.append(np.load(tf))
-        tf = tf.replace("l_axoness_train", "ls_axoness_train")
-        train_d.append(np.load(tf))
-    for tf in valid_fnames:
-        valid_l.append(np.load(tf))
-        tf = tf.replace("l_axoness_valid", "ls_axoness_valid")
-        valid_d.append(np.load(tf))
-
-    train_d = np.concatenate(train_d).astype(dtype=np.float32)
-    train_l = np.concatenate(train_l).astype(dtype=np.uint16)
-    valid_d = np.concatenate(valid_d).astype(dtype=np.float32)
-    valid_l = np.concatenate(valid_l).astype(dtype=np.uint16)
+    data_fnames = [tf.replace("l_axoness_", "ls_axoness_") for tf in
+                   train_fnames + valid_fnames]
+    cache_p = os.path.join(fold, "pca{}_fitall{}.pkl".format(
+        n_components, fit_all))
+    pca = _load_cached_estimator(
+        cache_p, train_fnames + valid_fnames + data_fnames)
+    if pca is not None:
+        return pca
+
+    train_l = _concat_npy_files(train_fnames, np.uint16)
+    train_d = _concat_npy_files(data_fnames[:len(train_fnames)], np.float32)
+    valid_l = _concat_npy_files(valid_fnames, np.uint16)
+    valid_d = _concat_npy_files(data_fnames[len(train_fnames):], np.float32)
 
     pca = PCA(n_components, whiten=True, random_state=0)
     if fit_all:
         pca.fit(np.concatenate([train_d, valid_d]))
     else:
         pca.fit(train_d)
+    write_obj2pkl(cache_p, pca)
     return pca
 
 
 def views2tripletinput(views):
-    views = views[:, :, :1]  # use first view only
-    out_d = np.concatenate([views,
-                            np.ones_like(views),
-                            np.ones_like(views)], axis=2)
-    return out_d.astype(np.float32)
+    # use first view only; fill the two auxiliary views directly in one
+    # preallocated buffer instead of concatenating three temporaries
+    out_d = np.empty(views.shape[:2] + (3,) + views.shape[3:],
+                     dtype=np.float32)
+    out_d[:, :, :1] = views[:, :, :1]
+    out_d[:, :, 1:] = 1.
+    return out_d
 
 
 def certainty_estimate(inp: np.ndarray, is_logit: bool = False) -> float:
@@ -1247,13 +1551,47 @@ def certainty_estimate(inp: np.ndarray, is_logit: bool = False) -> float:
         proba = softmax(inp, axis=1)
     else:
         proba = inp
-    proba = np.sum(proba, axis=0)
-    # sort. Ideally, result should be one-hot vector
-    proba = np.sort(proba)[::-1] / np.sum(proba)
-    if np.max(proba) == 1:
-        return 1
-    y_true = np.zeros_like(proba)
-    y_true[0] = 1
-    loss = log_loss(y_true, proba)
-    loss_worst = log_loss(y_true, np.ones_like(y_true) / len(y_true))
-    return 1 - loss / loss_worst
+    return _certainty_kernel(np.ascontiguousarray(proba, dtype=np.float64))
+
+
+@jit(nopython=True)
+def _certainty_kernel(proba):
+    """
+    Fused kernel for :func:`certainty_estimate`. `sklearn.metrics.log_loss`
+    on a one-hot target treats every class entry as an independent binary
+    sample, i.e. ``loss = -(log(p_max) + sum_{j!=max} log(1 - p_j)) / C``
+    and the worst outcome (uniform probabilities) is
+    ``loss_worst = -(log(1/C) + (C-1) * log(1 - 1/C)) / C``. All terms only
+    depend on the per-class evidence sums, so the sort and the two
+    `log_loss` calls collapse into a single pass over the input; the
+    ``1/C`` normalization cancels in the ratio.
+    """
+    n, n_classes = proba.shape
+    eps = 1e-15
+    sums = np.zeros(n_classes)
+    total = 0.
+    max_ix = 0
+    for j in range(n_classes):
+        s = 0.
+        for i in range(n):
+            s += proba[i, j]
+        sums[j] = s
+        total += s
+        if s > sums[max_ix]:
+            max_ix = j
+    if sums[max_ix] >= total:
+        return 1.
+    loss = 0.
+    for j in range(n_classes):
+        p = sums[j] / total
+        if p < eps:
+            p = eps
+        elif p > 1. - eps:
+            p = 1. - eps
+        if j == max_ix:
+            loss -= np.log(p)
+        else:
+            loss -= np.log(1. - p)
+    p_even = 1. / n_classes
+    loss_worst = -np.log(p_even) - (n_classes - 1) * np.log(1. - p_even)
+    return 1. - loss / loss_worst
@@ -4,26 +4,33 @@
 # Copyright (c) 2016 - now
 # Max-Planck-Institute of Neurobiology, Munich, Germany
 # Authors: Philipp Schubert, Sven Dorkenwald, Jörgen Kornfeld
+import ctypes
 import dill  # supports pickling of lambda expressions
 try:
     import cPickle as pkl
 except ImportError:
     import pickle as pkl
+import functools
 import getpass
 import glob
+import hashlib
 import numpy as np
 import os
 import io
 import re
+import secrets
+import select
 import shutil
-import string
+import struct
 import subprocess
+import tempfile
+import threading
 import tqdm
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import cpu_count
 
-from ..handler.basics import temp_seed
 from ..handler.config import initialize_logging
 from .. import global_params
 from .mp_utils import start_multiprocess_imap
@@ -32,17 +39,17 @@ from . import log_mp
 BATCH_PROC_SYSTEM = global_params.BATCH_PROC_SYSTEM
 
 
-def batchjob_enabled():
-    # disable QSUB/SLURM for example_run.py
-    if global_params.config.working_dir is None or 'example_cube' in \
-            global_params.config.working_dir:
-        return False
-    if BATCH_PROC_SYSTEM is None:
-        return False
+@functools.lru_cache(maxsize=1)
+def _batchjob_system_available(batch_system):
+    """
+    Probes once whether the configured submission system responds; the
+    result is memoized so nested pipeline calls do not fork a qstat/squeue
+    process on every entry.
+    """
     try:
-        if BATCH_PROC_SYSTEM == 'QSUB':
+        if batch_system == 'QSUB':
             cmd_check = 'qstat'
-        elif BATCH_PROC_SYSTEM == 'SLURM':
+        elif batch_system == 'SLURM':
             cmd_check = 'squeue'
         else:
             raise NotImplementedError
@@ -51,15 +58,144 @@ def batchjob_enabled():
                                   stdout=devnull, stderr=devnull)
     except subprocess.CalledProcessError as e:
         print("BatchJobSystem '{}' specified but failed with error '{}' not found,"
-              " switching to single node multiprocessing.".format(BATCH_PROC_SYSTEM, e))
+              " switching to single node multiprocessing.".format(batch_system, e))
         return False
     return True
 
 
+def batchjob_enabled():
+    # disable QSUB/SLURM for example_run.py; the working dir checks are
+    # cheap and stay outside the memoized probe
+    if global_params.config.working_dir is None or 'example_cube' in \
+            global_params.config.working_dir:
+        return False
+    if BATCH_PROC_SYSTEM is None:
+        return False
+    return _batchjob_system_available(BATCH_PROC_SYSTEM)
+
+
 path_to_scripts_default = global_params.batchjob_script_folder
 username = getpass.getuser()
 python_path_global = sys.executable
 
+# types the stdlib pickle handles without dill's class introspection
+_SAFE_FOR_PICKLE = (int, float, complex, str, bytes, bool, type(None),
+                    np.ndarray, np.generic)
+
+
+def _is_plain(obj):
+    """
+    True for plain data trees (scalars, strings, numpy arrays and
+    list/tuple/set/dict containers thereof); only exotic objects such as
+    lambdas, closures or local classes actually require dill.
+    """
+    if isinstance(obj, _SAFE_FOR_PICKLE):
+        return True
+    if isinstance(obj, (list, tuple, set)):
+        return all(_is_plain(el) for el in obj)
+    if isinstance(obj, dict):
+        return all(_is_plain(k) and _is_plain(v) for k, v in obj.items())
+    return False
+
+
+def _async_rmtree(path):
+    """
+    Renames `path` out of the way (atomic on the same file system) and
+    unlinks it in a daemon thread; the caller only pays for the rename
+    while the actual tree walk overlaps with submission and compute.
+    """
+    trash_path = '{}.trash.{}'.format(path.rstrip('/'), os.getpid())
+    try:
+        os.rename(path, trash_path)
+    except OSError:
+        trash_path = path
+    threading.Thread(target=shutil.rmtree, args=(trash_path,),
+                     kwargs={'ignore_errors': True}, daemon=True).start()
+
+
+_trash_cleaner_started = False
+
+
+def _clean_stale_trash(root):
+    """
+    Removes '.trash.' folders in `root` which are older than one hour,
+    i.e. left behind by crashed runs; dispatched at most once per process
+    in a daemon thread.
+    """
+    global _trash_cleaner_started
+    if _trash_cleaner_started or not os.path.isdir(root):
+        return
+    _trash_cleaner_started = True
+
+    def _worker():
+        cutoff = time.time() - 3600
+        try:
+            for entry in os.scandir(root):
+                if '.trash.' in entry.name and entry.is_dir() and \
+                        entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            pass
+
+    threading.Thread(target=_worker, daemon=True).start()
+
+
+# frame tags of the consolidated storage format; arrays skip pickle and
+# go to disk as raw npy frames, large repeated payloads are stored once
+# in a shared file and referenced by content hash (see extract_params.py
+# for the read side)
+_TAG_ARRAY = b'N'
+_TAG_PICKLE = b'P'
+_TAG_REF = b'R'
+# payloads above this size are deduplicated; blake2b runs at a few GB/s,
+# so hashing is free compared to the NFS writes it saves
+_DEDUP_MIN_SIZE = 64 * 1024
+
+
+# inotify masks from linux/inotify.h; workers either close their output
+# file in place (IN_CLOSE_WRITE) or move it into the folder (IN_MOVED_TO)
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_INOTIFY_HDR = struct.calcsize('iIII')
+
+
+def _inotify_watch(path):
+    """
+    Sets up an inotify watch for finished output files within `path`.
+    Returns the inotify file descriptor or None if inotify is unavailable
+    (non-Linux platforms).
+    """
+    try:
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK)
+        if fd < 0:
+            return None
+        wd = libc.inotify_add_watch(fd, path.encode(),
+                                    _IN_CLOSE_WRITE | _IN_MOVED_TO)
+        if wd < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+def _count_inotify_pkl_events(data):
+    """
+    Number of '.pkl' file events in a raw inotify event stream as read
+    from the watch descriptor.
+    """
+    nb_events = 0
+    offset = 0
+    while offset + _INOTIFY_HDR <= len(data):
+        _, _, _, length = struct.unpack_from('iIII', data, offset)
+        name = data[offset + _INOTIFY_HDR:
+                    offset + _INOTIFY_HDR + length].rstrip(b'\x00')
+        if name.endswith(b'.pkl'):
+            nb_events += 1
+        offset += _INOTIFY_HDR + length
+    return nb_events
+
 
 def QSUB_script(params, name, queue=None, pe=None, n_cores=1, priority=0,
                 additional_flags='', suffix="", job_name="default",
@@ -168,16 +304,18 @@ def QSUB_script(params, name, queue=None, pe=None, n_cores=1, priority=0,
     job_folder = "{}/{}_folder{}/".format(global_params.config.qsub_work_folder,
                                           name, suffix)
     if os.path.exists(job_folder):
-        shutil.rmtree(job_folder, ignore_errors=True)
+        # one rename up front; the unlink walk runs in the background
+        _async_rmtree(job_folder)
+    _clean_stale_trash(global_params.config.qsub_work_folder)
     if log is None:
         log_batchjob = initialize_logging("{}".format(name + suffix),
                                           log_dir=job_folder)
     else:
         log_batchjob = log
     if n_max_co_processes is None:
-        n_max_co_processes = np.min([global_params.NCORE_TOTAL // n_cores,
-                                     len(params)])
-    n_max_co_processes = np.max([n_max_co_processes, 1])
+        n_max_co_processes = min(global_params.NCORE_TOTAL // n_cores,
+                                 len(params))
+    n_max_co_processes = max(n_max_co_processes, 1)
     log_batchjob.info('Started BatchJob script "{}" with {} tasks using {}'
                       ' parallel jobs, each using {} core(s).'.format(
         name, len(params), n_max_co_processes, n_cores))
@@ -193,12 +331,11 @@ def QSUB_script(params, name, queue=None, pe=None, n_cores=1, priority=0,
         else:
             additional_flags = sge_additional_flags
     if job_name == "default":
-        with temp_seed(hash(time.time()) % (2 ** 32 - 1)):
-            letters = string.ascii_lowercase
-            job_name = "".join([letters[l] for l in
-                                np.random.randint(0, len(letters), 10 if
-                                BATCH_PROC_SYSTEM == 'QSUB' else 8)])
-            log_batchjob.info("Random job_name created: %s" % job_name)
+        # one getrandom(2) call; also avoids re-seeding the global numpy
+        # RNG, which used to leak out of this function via temp_seed
+        job_name = secrets.token_hex(
+            5 if BATCH_PROC_SYSTEM == 'QSUB' else 4)
+        log_batchjob.info("Random job_name created: %s" % job_name)
     else:
         log_batchjob.warning("WARNING: running multiple jobs via qsub is only supported "
                              "with non-default job_names")
@@ -213,8 +350,16 @@ def QSUB_script(params, name, queue=None, pe=None, n_cores=1, priority=0,
         path_to_scripts = path_to_scripts_default
 
     path_to_script = path_to_scripts + "/QSUB_%s.py" % name
+    # sh files are only read at submission time (sbatch/qsub spool the
+    # script content), so they can live on node-local storage where every
+    # open/write/chmod costs microseconds instead of an NFS round-trip.
+    # storage/, log/, err/ and out/ stay in the shared job_folder since
+    # compute nodes need cross-node access to them.
+    local_job_folder = tempfile.mkdtemp(
+        prefix='{}{}_'.format(name, suffix),
+        dir=os.environ.get('SYCONN_LOCAL_TMP', tempfile.gettempdir()))
     path_to_storage = "%s/storage/" % job_folder
-    path_to_sh = "%s/sh/" % job_folder
+    path_to_sh = "%s/sh/" % local_job_folder
     path_to_log = "%s/log/" % job_folder
     path_to_err = "%s/err/" % job_folder
     path_to_out = "%s/out/" % job_folder
@@ -256,71 +401,221 @@ def QSUB_script(params, name, queue=None, pe=None, n_cores=1, priority=0,
     n_jobs_finished = 0
     last_diff_rp = 0
     sleep_time = 5
-    for i_job in range(len(params)):
-        if params_orig_id is not None:
-            job_id = params_orig_id[i_job]
-        else:
-            job_id = i_job
-        this_storage_path = path_to_storage + "job_%d.pkl" % job_id
-        this_sh_path = path_to_sh + "job_%d.sh" % job_id
-        this_out_path = path_to_out + "job_%d.pkl" % job_id
-        job_log_path = path_to_log + "job_%d.log" % job_id
-        job_err_path = path_to_err + "job_%d.log" % job_id
-
-        with open(this_sh_path, "w") as f:
-            f.write("#!/bin/bash -l\n")
-            f.write('export syconn_wd="{4}"\n{0} {1} {2} {3}'.format(
-                python_path, path_to_script, this_storage_path,
-                this_out_path, global_params.config.working_dir))
-
-        with open(this_storage_path, "wb") as f:
-            for param in params[i_job]:
-                if use_dill:
-                    dill.dump(param, f)
-                else:
-                    pkl.dump(param, f)
-
-        os.chmod(this_sh_path, 0o744)
-        if BATCH_PROC_SYSTEM == 'QSUB':
-            if pe is not None:
-                sge_queue_option = "-pe %s %d" % (pe, n_cores)
-            elif queue is not None:
-                sge_queue_option = "-q %s" % queue
+    if params_orig_id is not None:
+        job_ids = [int(ix) for ix in params_orig_id]
+    else:
+        job_ids = list(range(len(params)))
+    def _serialize_job(i_job):
+        buf = io.BytesIO()
+        for param in params[i_job]:
+            if isinstance(param, np.ndarray) and param.dtype != object:
+                # raw npy frame: a memcpy of the array buffer without
+                # pickle's object framing; extract_params.py transcodes
+                # it back into the pickle stream the workers expect
+                buf.write(_TAG_ARRAY)
+                np.lib.format.write_array(buf, param, allow_pickle=False)
+                continue
+            # highest protocol: smaller files and much faster
+            # (de)serialization; the load side auto-detects it
+            if not use_dill:
+                payload = pkl.dumps(param, protocol=pkl.HIGHEST_PROTOCOL)
+            elif _is_plain(param):
+                # plain data dumps several times faster through the
+                # stdlib pickle even when dill was requested
+                try:
+                    payload = pkl.dumps(param,
+                                        protocol=pkl.HIGHEST_PROTOCOL)
+                except TypeError:
+                    payload = dill.dumps(param,
+                                         protocol=pkl.HIGHEST_PROTOCOL)
             else:
-                raise Exception("No queue or parallel environment defined")
+                payload = dill.dumps(param, protocol=pkl.HIGHEST_PROTOCOL)
+            if len(payload) >= _DEDUP_MIN_SIZE:
+                # the same large object (dataset handles, config dicts)
+                # is often part of every params[i]; store its bytes once
+                # and reference them by content hash
+                digest = hashlib.blake2b(payload,
+                                         digest_size=16).digest()
+                shared_payloads.setdefault(digest, payload)
+                buf.write(_TAG_REF)
+                buf.write(digest)
+                continue
+            buf.write(_TAG_PICKLE)
+            buf.write(struct.pack('<q', len(payload)))
+            buf.write(payload)
+        return buf.getbuffer()
+
+    # all parameter sets go into one consolidated storage file plus an
+    # int64 (job_id, offset, length) index; thousands of per-job pkl files
+    # in a single directory make every subsequent listing and open() pay
+    # for it, and one sequential write beats N open/write/close round-trips
+    # on a shared file system. Each job extracts its slice on the node via
+    # extract_params.py before the actual worker script runs.
+    storage_path = path_to_storage + "storage.pkl"
+    index_path = path_to_storage + "offsets.bin"
+    shared_path = path_to_storage + "shared.bin"
+    shared_index_path = path_to_storage + "shared_idx.pkl"
+    extract_script = path_to_scripts_default + "/extract_params.py"
+    shared_payloads = {}
+    buffers = [_serialize_job(i_job) for i_job in range(len(params))]
+    storage_index = np.zeros((len(params), 3), dtype=np.int64)
+    offset = 0
+    for i_job, buf in enumerate(buffers):
+        storage_index[i_job] = job_ids[i_job], offset, len(buf)
+        offset += len(buf)
+    with open(storage_path, "wb") as f:
+        f.writelines(buffers)
+    if len(shared_payloads) > 0:
+        shared_index = {}
+        offset = 0
+        with open(shared_path, "wb") as f:
+            for digest, payload in shared_payloads.items():
+                shared_index[digest] = (offset, len(payload))
+                f.write(payload)
+                offset += len(payload)
+        with open(shared_index_path, "wb") as f:
+            pkl.dump(shared_index, f, protocol=pkl.HIGHEST_PROTOCOL)
+        del shared_payloads
+    storage_index.tofile(index_path)
+    del buffers
+
+    if BATCH_PROC_SYSTEM == 'SLURM':
+        # one array submission instead of one sbatch fork + scheduler RPC
+        # per task; the scheduler handles the fan-out and the concurrency
+        # cap itself via '%'. A single 'srun --multi-prog' config would
+        # also avoid per-task scripts, but it cannot throttle concurrency,
+        # resubmit sparse id sets after failures or route per-task logs
+        # the way '--array' with %a placeholders does
+        if n_cores > 1:
+            additional_flags += " -n%d" % n_cores
+        # TODO: remove
+        additional_flags += ' --time=0-12'
+        if priority is not None and priority != 0:
+            log_batchjob.warning('Priorities are not supported with SLURM.')
+        array_sh_path = path_to_sh + "array.sh"
+        array_sh = (
+            '#!/bin/bash -l\n'
+            'export syconn_wd="{wd}"\n'
+            'TMP_STORAGE="${{TMPDIR:-/tmp}}/{job_name}_'
+            '${{SLURM_ARRAY_TASK_ID}}.pkl"\n'
+            '{py} {extract} {storage} {index} ${{SLURM_ARRAY_TASK_ID}} '
+            '"$TMP_STORAGE"\n'
+            '{py} {script} "$TMP_STORAGE" '
+            '{out}job_${{SLURM_ARRAY_TASK_ID}}.pkl\n'
+            'rm -f "$TMP_STORAGE"\n'.format(
+                wd=global_params.config.working_dir, job_name=job_name,
+                py=python_path, extract=extract_script,
+                storage=storage_path, index=index_path,
+                script=path_to_script, out=path_to_out))
+        # single write with the executable bit set via the open mode
+        fd = os.open(array_sh_path,
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o744)
+        os.write(fd, array_sh.encode())
+        os.close(fd)
+        if job_ids == list(range(job_ids[0], job_ids[0] + len(job_ids))):
+            array_spec = "{}-{}".format(job_ids[0], job_ids[-1])
+        else:
+            array_spec = ",".join(str(ix) for ix in job_ids)
+        cmd_exec = "sbatch --array={0}%{1} {2} --output={3} --error={4}" \
+                   " --job-name={5} {6}".format(
+            array_spec, int(n_max_co_processes), additional_flags,
+            path_to_log + "job_%a.log", path_to_err + "job_%a.log",
+            job_name, array_sh_path)
+        start = time.time()
+        subprocess.call(cmd_exec, shell=True)
+        dtime_sub += time.time() - start
+    elif BATCH_PROC_SYSTEM == 'QSUB':
+        if pe is not None:
+            sge_queue_option = "-pe %s %d" % (pe, n_cores)
+        elif queue is not None:
+            sge_queue_option = "-q %s" % queue
+        else:
+            raise Exception("No queue or parallel environment defined")
+        # only the job id varies between the scripts; format the constant
+        # parts once and write each file with a single syscall, the open
+        # mode already carries the executable bit (no extra chmod)
+        sh_template = (
+            '#!/bin/bash -l\n'
+            'export syconn_wd="{wd}"\n'
+            # four braces: the shell's ${TMPDIR:-/tmp} has to survive both
+            # format passes (constant parts here, job_id in the loop)
+            'TMP_STORAGE="${{{{TMPDIR:-/tmp}}}}/{job_name}_{{job_id}}.pkl"\n'
+            '{py} {extract} {storage} {index} {{job_id}} "$TMP_STORAGE"\n'
+            '{py} {script} "$TMP_STORAGE" {out}job_{{job_id}}.pkl\n'
+            'rm -f "$TMP_STORAGE"\n'.format(
+                wd=global_params.config.working_dir, job_name=job_name,
+                py=python_path, extract=extract_script,
+                storage=storage_path, index=index_path,
+                script=path_to_script, out=path_to_out))
+        for job_id in job_ids:
+            this_sh_path = path_to_sh + "job_%d.sh" % job_id
+            job_log_path = path_to_log + "job_%d.log" % job_id
+            job_err_path = path_to_err + "job_%d.log" % job_id
+            fd = os.open(this_sh_path,
+                         os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o744)
+            os.write(fd, sh_template.format(job_id=job_id).encode())
+            os.close(fd)
             cmd_exec = "qsub {0} -o {1} -e {2} -N {3} -p {4} {5} {6}".format(
                 sge_queue_option, job_log_path, job_err_path, job_name,
                 priority, additional_flags, this_sh_path)
             subprocess.call(cmd_exec, shell=True)
-        elif BATCH_PROC_SYSTEM == 'SLURM':
-            if n_cores > 1:
-                additional_flags += " -n%d" % n_cores
-            # TODO: remove
-            additional_flags += ' --time=0-12'
-            cmd_exec = "sbatch {0} --output={1} --error={2}" \
-                       " --job-name={3} {4}".format(
-                additional_flags, job_log_path, job_err_path,
-                job_name, this_sh_path)
-            if priority is not None and priority != 0:
-                log_batchjob.warning('Priorities are not supported with SLURM.')
-            start = time.time()
-            subprocess.call(cmd_exec, shell=True)
-            dtime_sub += time.time() - start
-        else:
-            raise NotImplementedError
-        time.sleep(0.05)
+            time.sleep(0.05)
+    else:
+        raise NotImplementedError
 
     log_batchjob.info("All jobs are submitted: %s" % name)
+    # ids of jobs with an output file; kept across poll iterations so each
+    # poll only pays for the directory listing, not re-parsing known files
+    finished_ids = set()
+    # progress is driven reactively by inotify events on the output folder
+    # where available; the directory is then never re-listed inside the
+    # loop (final reconciliation below still uses a single scandir)
+    inotify_fd = _inotify_watch(path_to_out)
+    last_rp_check = 0.
     while True:
-        nb_rp = number_of_running_processes(job_name)
-        # check actually running files
-        if nb_rp == 0:
-            break
-        n_jobs_done = len(glob.glob(path_to_out + "*.pkl"))
-        diff = n_jobs_done - n_jobs_finished
-        pbar.update(diff)
-        n_jobs_finished = n_jobs_done
-        time.sleep(sleep_time)
+        if inotify_fd is not None:
+            readable = select.select([inotify_fd], [], [], sleep_time)[0]
+            nb_new = 0
+            if readable:
+                try:
+                    nb_new = _count_inotify_pkl_events(
+                        os.read(inotify_fd, 65536))
+                except BlockingIOError:
+                    pass
+            pbar.update(nb_new)
+            if nb_new > 0:
+                sleep_time = 5
+                # outputs are still arriving; query the scheduler at most
+                # once a minute in that case
+                if time.time() - last_rp_check < 60:
+                    continue
+            else:
+                # back off while nothing changes; long jobs do not finish
+                # faster from frequent polls, and every poll is an RPC
+                sleep_time = min(sleep_time * 2, 30)
+            nb_rp = number_of_running_processes(job_name)
+            last_rp_check = time.time()
+            if nb_rp == 0:
+                break
+        else:
+            nb_rp = number_of_running_processes(job_name)
+            # check actually running files
+            if nb_rp == 0:
+                break
+            # os.scandir skips glob's fnmatch pass and extra stat calls
+            new_ids = {int(e.name[4:-4]) for e in os.scandir(path_to_out)
+                       if e.name.endswith('.pkl')} - finished_ids
+            pbar.update(len(new_ids))
+            finished_ids |= new_ids
+            # back off while nothing changes; long jobs do not finish faster
+            # from frequent polls, and every poll is a scheduler RPC
+            if len(new_ids) == 0:
+                sleep_time = min(sleep_time * 2, 30)
+            else:
+                sleep_time = 5
+            time.sleep(sleep_time)
+    if inotify_fd is not None:
+        os.close(inotify_fd)
     pbar.close()
     log_batchjob.info("All batch jobs have finished after {:.2f} s ({:.2f} "
                       "s submission): {}".format(time.time()-start_all, dtime_sub, name))
@@ -342,24 +637,34 @@ def QSUB_script(params, name, queue=None, pe=None, n_cores=1, priority=0,
             this_sh_path)
         subprocess.call(cmd_exec, shell=True)
 
-    out_files = glob.glob(path_to_out + "*.pkl")
+    # sh files are spooled by the scheduler at submission; if this is not
+    # reached due to an exception the /tmp cleaner takes care of the leak
+    shutil.rmtree(local_job_folder, ignore_errors=True)
+
+    finished_ids |= {int(e.name[4:-4]) for e in os.scandir(path_to_out)
+                     if e.name.endswith('.pkl')}
     # only stop if first iteration and script was not resumed (params_orig_id is None)
-    if len(out_files) == 0 and iteration == 1 and params_orig_id is None and not allow_resubm_all_fail:
+    if len(finished_ids) == 0 and iteration == 1 and params_orig_id is None and not allow_resubm_all_fail:
         msg = 'All submitted jobs have failed. Re-submission will not be initiated.' \
               ' Please check your submitted code.'
         log_batchjob.error(msg)
         raise Exception(msg)
-    if len(out_files) < len(params):
-        log_batchjob.error("%d jobs appear to have failed." % (len(params) - len(out_files)))
-        checklist = np.zeros(len(params), dtype=np.bool)
+    if len(finished_ids) < len(params):
+        log_batchjob.error("%d jobs appear to have failed." % (len(params) - len(finished_ids)))
+        checklist = np.zeros(len(params), dtype=bool)
         if iteration == 1:
             params_orig_id = np.arange(len(params))
-        for p in out_files:
-            job_id = int(re.findall("[\d]+", p)[-1])
-            index = np.nonzero(params_orig_id == job_id)[0]  # still an array, "[0]" only gives
-            # us the first dimension
-            assert len(index) == 1  # must be one hit and one only
-            checklist[index[0]] = True
+        # one sort + searchsorted in C instead of a full equality scan over
+        # params_orig_id per finished job
+        done_ids = np.fromiter(finished_ids, dtype=np.int64,
+                               count=len(finished_ids))
+        order = np.argsort(params_orig_id)
+        sorted_ids = params_orig_id[order]
+        pos = np.searchsorted(sorted_ids, done_ids)
+        # every output file must map to exactly one submitted job id
+        assert np.all(pos < len(sorted_ids)) and \
+            np.array_equal(sorted_ids[pos], done_ids)
+        checklist[order[pos]] = True
 
         missed_params = [params[ii] for ii in range(len(params)) if not checklist[ii]]
         orig_job_ids = params_orig_id[~checklist]
@@ -375,7 +680,7 @@ def QSUB_script(params, name, queue=None, pe=None, n_cores=1, priority=0,
         # TODO: activate again
         # n_cores = np.max([np.min([global_params.NCORES_PER_NODE, float(n_max_co_processes) //
         #                           len(missed_params)]), n_cores])
-        n_cores = np.min([n_cores, global_params.NCORES_PER_NODE])
+        n_cores = min(n_cores, global_params.NCORES_PER_NODE)
         n_cores = int(n_cores)
         # remove existing memory and cpus-per-task flags:
         if '--mem=' in additional_flags:
@@ -398,7 +703,8 @@ def QSUB_script(params, name, queue=None, pe=None, n_cores=1, priority=0,
             n_max_co_processes=n_max_co_processes,  n_cores=n_cores,
             params_orig_id=orig_job_ids, use_dill=use_dill)
     if remove_jobfolder:
-        shutil.rmtree(job_folder)
+        # fire-and-forget; the return value does not depend on the cleanup
+        _async_rmtree(job_folder)
     return path_to_out
 
 
@@ -468,10 +774,12 @@ def resume_QSUB_script(params, name, queue=None, pe=None, n_cores=1, priority=0,
     if len(out_files) < len(params):
         log_batchjob.error("%d jobs appear to have failed. Restarting."
                            "" % (len(params) - len(out_files)))
-        checklist = np.zeros(len(params), dtype=np.bool)
+        checklist = np.zeros(len(params), dtype=bool)
 
         for p in out_files:
-            checklist[int(re.findall("[\d]+", p)[-1])] = True
+            # file names are 'job_<id>.pkl'; a slice beats a regex scan
+            # over the whole path
+            checklist[int(os.path.basename(p)[4:-4])] = True
 
         missed_params = [params[ii] for ii in range(len(params)) if not checklist[ii]]
         orig_job_ids = np.arange(len(params))[~checklist]
@@ -517,13 +825,13 @@ def batchjob_fallback(params, name, n_cores=1, suffix="",
     job_folder = "{}/{}_folder{}/".format(global_params.config.qsub_work_folder,
                                           name, suffix)
     if os.path.exists(job_folder):
-        shutil.rmtree(job_folder, ignore_errors=True)
+        _async_rmtree(job_folder)
     log_batchjob = initialize_logging("{}".format(name + suffix),
                                       log_dir=job_folder)
     n_max_co_processes = cpu_count()
-    n_max_co_processes = np.min([cpu_count() // n_cores, n_max_co_processes])
-    n_max_co_processes = np.min([n_max_co_processes, len(params)])
-    n_max_co_processes = np.max([n_max_co_processes, 1])
+    n_max_co_processes = min(cpu_count() // n_cores, n_max_co_processes)
+    n_max_co_processes = min(n_max_co_processes, len(params))
+    n_max_co_processes = max(n_max_co_processes, 1)
     log_batchjob.debug('Started BatchJobFallback script "{}" with {} tasks using {}'
                        ' parallel jobs, each using {} core(s).'.format(
         name, len(params), n_max_co_processes, n_cores))
@@ -535,8 +843,13 @@ def batchjob_fallback(params, name, n_cores=1, suffix="",
         path_to_scripts = path_to_scripts_default
 
     path_to_script = path_to_scripts + "/QSUB_%s.py" % name
-    path_to_storage = "%s/storage/" % job_folder
-    path_to_sh = "%s/sh/" % job_folder
+    # all workers run on this node, so sh/ and storage/ can live on local
+    # storage (typically /tmp on SSD) instead of the shared qsub_work_folder
+    local_job_folder = tempfile.mkdtemp(
+        prefix='{}{}_'.format(name, suffix),
+        dir=os.environ.get('SYCONN_LOCAL_TMP', tempfile.gettempdir()))
+    path_to_storage = "%s/storage/" % local_job_folder
+    path_to_sh = "%s/sh/" % local_job_folder
     path_to_log = "%s/log/" % job_folder
     path_to_err = "%s/err/" % job_folder
     path_to_out = "%s/out/" % job_folder
@@ -552,27 +865,37 @@ def batchjob_fallback(params, name, n_cores=1, suffix="",
     if not os.path.exists(path_to_out):
         os.makedirs(path_to_out)
 
-    multi_params = []
-    for i_job in range(len(params)):
-        job_id = i_job
+    # the sh content only varies by job id; format the constant parts once
+    sh_template = '#!/bin/bash -l\nexport syconn_wd="{3}"\n{0} {1} ' \
+                  '{2}job_{{0}}.pkl {4}job_{{0}}.pkl'.format(
+        python_path, path_to_script, path_to_storage,
+        global_params.config.working_dir, path_to_out)
+
+    def _prepare_job(job_id):
         this_storage_path = path_to_storage + "job_%d.pkl" % job_id
         this_sh_path = path_to_sh + "job_%d.sh" % job_id
-        this_out_path = path_to_out + "job_%d.pkl" % job_id
-        with open(this_sh_path, "w") as f:
-            f.write('#!/bin/bash -l\n')
-            f.write('export syconn_wd="{4}"\n{0} {1} {2} {3}'.format(
-                python_path, path_to_script, this_storage_path,
-                this_out_path, global_params.config.working_dir))
+        # single write per file; the open mode carries the executable bit
+        fd = os.open(this_sh_path,
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o744)
+        os.write(fd, sh_template.format(job_id).encode())
+        os.close(fd)
         with open(this_storage_path, "wb") as f:
-            for param in params[i_job]:
-                pkl.dump(param, f)
-        os.chmod(this_sh_path, 0o744)
-
-        cmd_exec = "sh {}".format(this_sh_path)
-        multi_params.append(cmd_exec)
-    out_str = start_multiprocess_imap(fallback_exec, multi_params, debug=False,
-                                      nb_cpus=n_max_co_processes,
-                                      show_progress=show_progress)
+            for param in params[job_id]:
+                pkl.dump(param, f, protocol=pkl.HIGHEST_PROTOCOL)
+        # the scripts are executable; no 'sh' wrapper process needed
+        return [this_sh_path]
+
+    try:
+        # file preparation is I/O bound; run it through a thread pool so the
+        # open/write/chmod syscalls overlap
+        with ThreadPoolExecutor(max_workers=cpu_count()) as tpe:
+            multi_params = list(tpe.map(_prepare_job, range(len(params))))
+        out_str = start_multiprocess_imap(fallback_exec, multi_params,
+                                          debug=False,
+                                          nb_cpus=n_max_co_processes,
+                                          show_progress=show_progress)
+    finally:
+        shutil.rmtree(local_job_folder, ignore_errors=True)
     if len("".join(out_str)) > 0:
         log_batchjob.error('Errors occurred during "{}".:\n{}'.format(name, out_str))
     out_files = glob.glob(path_to_out + "*.pkl")
@@ -581,16 +904,19 @@ def batchjob_fallback(params, name, n_cores=1, suffix="",
             out_files), len(params)))
     if len("".join(out_str)) == 0:
         if remove_jobfolder:
-            shutil.rmtree(job_folder, ignore_errors=True)
+            _async_rmtree(job_folder)
     log_batchjob.debug('Finished "{}" after {:.2f}s.'.format(name, time.time() - start))
     return path_to_out
 
 
 def fallback_exec(cmd_exec):
     """
-    Helper function to execute commands using subprocess.
+    Helper function to execute commands using subprocess. `cmd_exec` is
+    an argument list; without ``shell=True`` CPython launches it via
+    posix_spawn, which skips forking (and copying the page tables of)
+    this potentially huge parent process and the extra /bin/sh.
     """
-    ps = subprocess.Popen(cmd_exec, shell=True, stdout=subprocess.PIPE,
+    ps = subprocess.Popen(cmd_exec, stdout=subprocess.PIPE,
                           stderr=subprocess.PIPE)
     out, err = ps.communicate()
     out_str = ""
@@ -630,19 +956,20 @@ def number_of_running_processes(job_name):
         number of running jobs
 
     """
-    if BATCH_PROC_SYSTEM == 'QSUB':
-        cmd_stat = "qstat -u %s" % username
-    elif BATCH_PROC_SYSTEM == 'SLURM':
-        cmd_stat = "squeue -u %s" % username
+    if BATCH_PROC_SYSTEM == 'SLURM':
+        # let SLURM filter server-side; '%i' yields one tiny id line per
+        # matching job, so counting newlines in the raw bytes suffices
+        cmd_stat = ["squeue", "-u", username, "--noheader",
+                    "--name", job_name[:8], "-o", "%i"]
+        proc = subprocess.run(cmd_stat, stdout=subprocess.PIPE)
+        return proc.stdout.count(b"\n")
+    elif BATCH_PROC_SYSTEM == 'QSUB':
+        cmd_stat = ["qstat", "-u", username, "-r"]
     else:
         raise NotImplementedError
-    process = subprocess.Popen(cmd_stat, shell=True,
-                               stdout=subprocess.PIPE)
-    nb_lines = 0
-    for line in io.TextIOWrapper(process.stdout, encoding="utf-8"):
-        if job_name[:10 if BATCH_PROC_SYSTEM == 'QSUB' else 8] in line:
-            nb_lines += 1
-    return nb_lines
+    proc = subprocess.run(cmd_stat, stdout=subprocess.PIPE)
+    name_b = job_name[:10].encode()
+    return sum(name_b in line for line in proc.stdout.splitlines())
 
 
 def delete_jobs_by_name(job_name):
@@ -659,27 +986,17 @@ def delete_jobs_by_name(job_name):
 
     """
     if BATCH_PROC_SYSTEM == 'QSUB':
-        cmd_stat = "qstat -u %s" % username
-    elif BATCH_PROC_SYSTEM == 'SLURM':
-        cmd_stat = "squeue -u %s" % username
-    else:
-        raise NotImplementedError
-    process = subprocess.Popen(cmd_stat, shell=True,
-                               stdout=subprocess.PIPE)
-    job_ids = []
-    for line in iter(process.stdout.readline, ''):
-        curr_line = str(line)
-        if job_name[:10] in curr_line:
-            job_ids.append(re.findall("[\d]+", curr_line)[0])
-
-    if BATCH_PROC_SYSTEM == 'QSUB':
-        cmd_del = "qdel "
-        for job_id in job_ids:
-            cmd_del += job_id + ", "
-        command = cmd_del[:-2]
-
-        subprocess.Popen(command, shell=True,
-                         stdout=subprocess.PIPE)
+        # one communicate() over the raw bytes instead of a Python
+        # per-line loop; iter(stdout.readline, '') never terminated on
+        # the bytes stream anyway (sentinel would have to be b'')
+        out = subprocess.check_output(["qstat", "-u", username])
+        job_ids = [m.decode() for m in re.findall(
+            rb"^\s*(\d+)[^\n]*" + re.escape(job_name[:10].encode()),
+            out, re.MULTILINE)]
+        if len(job_ids) > 0:
+            # one batched qdel call; the previous per-id '", "' join was
+            # not a valid qdel argument list
+            subprocess.Popen(["qdel"] + job_ids, stdout=subprocess.PIPE)
     elif BATCH_PROC_SYSTEM == 'SLURM':
         cmd_del = "scancel -n {}".format(job_name)
         subprocess.Popen(cmd_del, shell=True,
@@ -12,12 +12,42 @@ except ImportError:
 from multiprocessing import cpu_count
 from concurrent.futures import ProcessPoolExecutor, as_completed, ThreadPoolExecutor
 import multiprocessing.pool
+import os
 import time
 import tqdm
 from . import log_mp
 
 MyPool = multiprocessing.Pool
 
+_GLOBAL_POOL = None
+_GLOBAL_POOL_SIZE = 0
+
+
+def _get_pool(nb_cpus):
+    """
+    Lazily initialized process pool shared across `start_multiprocess*`
+    calls; avoids paying pool startup and fork cost for every dispatch of
+    a batch pipeline. The pool is re-created whenever a different worker
+    count is requested, so callers that deliberately throttle `nb_cpus`
+    keep their concurrency limit. The worker count can be capped globally
+    via the 'SYCONN_NUM_WORKERS' environment variable.
+
+    Note: worker processes fork at pool creation, so module-level state
+    changed afterwards (e.g. ``global_params.wd``) is only picked up once
+    a pool with a different size is requested.
+    """
+    global _GLOBAL_POOL, _GLOBAL_POOL_SIZE
+    env_max = os.environ.get('SYCONN_NUM_WORKERS')
+    if env_max is not None:
+        nb_cpus = min(nb_cpus, int(env_max))
+    if _GLOBAL_POOL is None or _GLOBAL_POOL_SIZE != nb_cpus:
+        if _GLOBAL_POOL is not None:
+            _GLOBAL_POOL.close()
+            _GLOBAL_POOL.join()
+        _GLOBAL_POOL = MyPool(nb_cpus)
+        _GLOBAL_POOL_SIZE = nb_cpus
+    return _GLOBAL_POOL
+
 
 def parallel_process(array, function, n_jobs, use_kwargs=False, front_num=0):
     """From http://danshiebler.com/2016-09-14-parallel-progress-bar/
@@ -103,10 +133,7 @@ def start_multiprocess(func, params, debug=False, verbose=False, nb_cpus=None):
 
     start = time.time()
     if nb_cpus > 1:
-        pool = MyPool(nb_cpus)
-        result = pool.map(func, params)
-        pool.close()
-        pool.join()
+        result = _get_pool(nb_cpus).map(func, params)
     else:
         result = list(map(func, params))
 
@@ -156,8 +183,7 @@ def start_multiprocess_imap(func, params, debug=False, verbose=False,
         if show_progress:
             result = parallel_process(params, func, nb_cpus)
         else:
-            with MyPool(nb_cpus) as pool:
-                result = list(pool.map(func, params))
+            result = list(_get_pool(nb_cpus).map(func, params))
     else:
         if show_progress:
             pbar = tqdm.tqdm(total=len(params), ncols=80, leave=False,
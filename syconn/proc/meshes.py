@@ -5,10 +5,9 @@
 # Max Planck Institute of Neurobiology, Martinsried, Germany
 # Authors: Sven Dorkenwald, Philipp Schubert, Joergen Kornfeld
 
-import itertools
 import numpy as np
 from collections import Counter
-from numba import jit
+from numba import jit, prange
 from scipy import spatial, ndimage
 from skimage import measure
 from sklearn.decomposition import PCA
@@ -17,29 +16,17 @@ from plyfile import PlyData, PlyElement
 from scipy.ndimage.morphology import binary_closing, binary_dilation
 import tqdm
 import time
-try:
-    import vtki
-    __vtk_avail__ = True
-except ImportError:
-    __vtk_avail__ = False
+import os
+import zipfile
 
 from skimage.measure import mesh_surface_area
 from ..proc import log_proc
-from ..handler.basics import write_data2kzip, data2kzip
+from ..handler.basics import write_data2kzip, data2kzip, remove_from_zip
 from .image import apply_pca
 from ..backend.storage import AttributeDict, MeshStorage, VoxelStorage
 from ..global_params import MESH_DOWNSAMPLING, MESH_CLOSING, MESH_MIN_OBJ_VX
 from .. import global_params
 from ..mp.mp_utils import start_multiprocess_obj, start_multiprocess_imap
-try:
-    # set matplotlib backend to offscreen
-    import matplotlib
-    matplotlib.use('agg')
-    from vigra.filters import boundaryDistanceTransform, gaussianSmoothing
-except ImportError as e:
-    boundaryDistanceTransform, gaussianSmoothing = None, None
-    log_proc.error('ImportError. Could not import VIGRA. '
-                   'Mesh generation will not be possible. {}'.format(e))
 try:
     import openmesh
 except ImportError as e:
@@ -55,7 +42,9 @@ except ImportError:
 
 
 __all__ = ['MeshObject', 'get_object_mesh', 'merge_meshes', 'triangulation',
+           'decimate_mesh_mc',
            'get_random_centered_coords', 'write_mesh2kzip', 'write_meshes2kzip',
+           'write_mesh2kzip_stream',
            'compartmentalize_mesh', 'mesh_chunk', 'mesh_creator_sso', 'merge_meshes_incl_norm',
            'mesh_area_calc', 'mesh2obj_file']
 
@@ -64,11 +53,10 @@ class MeshObject(object):
     def __init__(self, object_type, indices, vertices, normals=None,
                  color=None, bounding_box=None):
         self.object_type = object_type
-        if vertices.ndim == 2 and vertices.shape[1] == 3:
-            self.vertices = vertices.flatten()
-        else:
-            # assume flat array
-            self.vertices = np.array(vertices, dtype=np.float)
+        # native storage is (N, 3), normalized in float32 and kept as
+        # float16; `vertices_flat` exposes a flat view at the OpenGL
+        # boundary. Flat inputs are reshaped.
+        self.vertices = np.array(vertices, dtype=np.float32).reshape(-1, 3)
         if indices.ndim == 2 and indices.shape[1] == 3:
             self.indices = indices.flatten().astype(np.uint)
         else:
@@ -86,14 +74,21 @@ class MeshObject(object):
             self.max_dist = bounding_box[1]
         self.center = self.center.astype(np.float)
         self.max_dist = self.max_dist.astype(np.float)
-        vert_resh = np.array(self.vertices).reshape((len(self.vertices) // 3, 3))
-        vert_resh -= np.array(self.center, dtype=self.vertices.dtype)
-        vert_resh = vert_resh / np.array(self.max_dist)
-        self.vertices = vert_resh.reshape(len(self.vertices))
+        # normalize in place; the old subtract-copy-divide sequence moved
+        # the vertex buffer three times
+        np.subtract(self.vertices,
+                    np.array(self.center, dtype=self.vertices.dtype),
+                    out=self.vertices)
+        np.multiply(self.vertices, 1. / np.array(self.max_dist),
+                    out=self.vertices)
+        # after centering to [-1, 1] half precision suffices (dequantized
+        # via `max_dist`/`center` in `vertices_scaled`); halves the bytes
+        # every later scan moves
+        self.vertices = self.vertices.astype(np.float16)
         if normals is not None and len(normals) == 0:
             normals = None
-        if normals is not None and normals.ndim == 2:
-            normals = normals.reshape(len(normals)*3)
+        if normals is not None:
+            normals = np.asarray(normals).reshape(-1, 3)
         self._normals = normals
         self._ext_color = color
         self._colors = None
@@ -102,9 +97,9 @@ class MeshObject(object):
     @property
     def colors(self):
         if self._ext_color is None:
-            self._colors = np.ones(len(self.vertices) // 3 * 4) * 0.5
+            self._colors = np.ones(len(self.vertices) * 4) * 0.5
         elif np.isscalar(self._ext_color):
-            self._colors = np.array(len(self.vertices) // 3 * [self._ext_color]).flatten()
+            self._colors = np.array(len(self.vertices) * [self._ext_color]).flatten()
         else:
             if np.ndim(self._ext_color) >= 2:
                 self._ext_color = self._ext_color.squeeze()
@@ -115,15 +110,21 @@ class MeshObject(object):
                     "Rendering requires RGBA 'color' shape of (X, 4). Please" \
                     "add alpha channel."
                 self._ext_color = self._ext_color.flatten()
-            assert len(self._ext_color)/4 == len(self.vertices)/3, \
-                "len(ext_color)/4 must be equal to len(vertices)/3."
+            assert len(self._ext_color) / 4 == len(self.vertices), \
+                "len(ext_color)/4 must be equal to len(vertices)."
             self._colors = self._ext_color
         return self._colors
 
     @property
     def vert_resh(self):
-        vert_resh = np.array(self.vertices).reshape(-1, 3)
-        return vert_resh
+        return self.vertices
+
+    @property
+    def vertices_flat(self):
+        """
+        Flat view of the vertices for the OpenGL boundary; no copy.
+        """
+        return self.vertices.ravel()
 
     @property
     def normals(self):
@@ -139,7 +140,14 @@ class MeshObject(object):
 
     @property
     def normals_resh(self):
-        return self.normals.reshape(-1, 3)
+        return self.normals
+
+    @property
+    def normals_flat(self):
+        """
+        Flat view of the normals for the OpenGL boundary; no copy.
+        """
+        return self.normals.ravel()
 
     def transform_external_coords(self, coords):
         """
@@ -156,7 +164,7 @@ class MeshObject(object):
         if len(coords) == 0:
             return coords
         coords = np.array(coords, dtype=np.float)
-        coords = coords - self.center
+        coords -= self.center
         coords /= self.max_dist
         return coords
 
@@ -176,9 +184,9 @@ class MeshObject(object):
         """
         if self.pca is None:
             self.pca = PCA(n_components=3, whiten=False, random_state=0)
-            self.pca.fit(self.vert_resh)
+            self.pca.fit(self.vertices)
         self.vertices = self.pca.transform(
-            self.vert_resh).reshape(len(self.vertices))
+            self.vertices).astype(np.float16)
 
     def renormalize_vertices(self, bounding_box=None):
         """
@@ -196,14 +204,17 @@ class MeshObject(object):
         self.center, self.max_dist = bounding_box
         self.center = self.center.astype(np.float)
         self.max_dist = self.max_dist.astype(np.float)
-        vert_resh = np.array(self.vertices).reshape(len(self.vertices) // 3, 3)
-        vert_resh -= self.center
-        vert_resh /= self.max_dist
-        self.vertices = vert_resh.reshape(len(self.vertices))
+        np.subtract(self.vertices,
+                    np.array(self.center, dtype=self.vertices.dtype),
+                    out=self.vertices)
+        np.multiply(self.vertices, 1. / np.array(self.max_dist),
+                    out=self.vertices)
 
     @property
     def vertices_scaled(self):
-        return (self.vert_resh * self.max_dist + self.center).flatten()
+        # dequantize to float32 before leaving normalized space
+        return (self.vertices.astype(np.float32) * self.max_dist
+                + self.center).flatten()
 
 
 def triangulation_wrapper(pts, downsampling=(1, 1, 1), n_closings=0, single_cc=False,
@@ -214,6 +225,70 @@ def triangulation_wrapper(pts, downsampling=(1, 1, 1), n_closings=0, single_cc=F
     return
 
 
+def _dense_marching_cubes(volume, n_closings, single_cc, force_single_cc,
+                          gradient_direction):
+    """
+    Runs closing, signed distance transform, smoothing and marching cubes
+    on a dense volume. Used by `triangulation` for the full bounding box and
+    for the per-component sub-volumes of the sparse path.
+
+    Parameters
+    ----------
+    volume : np.array
+        Dense binary volume.
+    n_closings : int
+    single_cc : bool
+    force_single_cc : bool
+    gradient_direction : str
+
+    Returns
+    -------
+    array, array, array, array
+        vertices [N, 3], indices [M, 3], normals [N, 3] and the offset shift
+        caused by padding in the `force_single_cc` loop
+    """
+    offset_shift = np.zeros(3, dtype=np.int)
+    if n_closings > 0:
+        volume = binary_closing(volume, iterations=n_closings).astype(np.float32)
+        if force_single_cc:
+            n_dilations = 0
+            while True:
+                labeled, nb_cc = ndimage.label(volume)
+                # log_proc.debug('Forcing single CC, additional dilations {}, num'
+                #                'ber connected components: {}'
+                #                ''.format(n_dilations, nb_cc))
+                if nb_cc == 1:  # does not count background
+                    break
+                # pad volume to maintain margin at boundary and correct offset
+                volume = np.pad(volume, [(1, 1), (1, 1), (1, 1)],
+                                mode='constant', constant_values=0)
+                offset_shift -= 1
+                volume = binary_dilation(volume, iterations=1).astype(
+                    np.float32)
+                n_dilations += 1
+    else:
+        volume = volume.astype(np.float32)
+    if single_cc:
+        labeled, nb_cc = ndimage.label(volume)
+        cnt = Counter(labeled[labeled != 0])
+        l, occ = cnt.most_common(1)[0]
+        volume = np.array(labeled == l, dtype=np.float32)
+    # signed distance: positive outside, negative inside, equivalent to the
+    # previous vigra boundary distance transform after its sign flip; the
+    # separable Gaussian replaces vigra.gaussianSmoothing
+    dt = ndimage.distance_transform_edt(1 - volume) - \
+        ndimage.distance_transform_edt(volume)
+    volume = ndimage.gaussian_filter(dt, 1, mode='nearest')
+    if np.sum(volume < 0) == 0 or np.sum(volume > 0) == 0:  # less smoothing
+        volume = ndimage.gaussian_filter(dt, 0.5, mode='nearest')
+    try:
+        verts, ind, norm, _ = measure.marching_cubes_lewiner(
+            volume, 0, gradient_direction=gradient_direction)
+    except Exception as e:
+        raise ValueError(e)
+    return verts, ind, norm, offset_shift
+
+
 def triangulation(pts, downsampling=(1, 1, 1), n_closings=0, single_cc=False,
                   decimate_mesh=0, gradient_direction='descent',
                   force_single_cc=False):
@@ -249,9 +324,6 @@ def triangulation(pts, downsampling=(1, 1, 1), n_closings=0, single_cc=False,
         indices [M, 3], vertices [N, 3], normals [N, 3]
 
     """
-    if boundaryDistanceTransform is None:
-        raise ImportError('"boundaryDistanceTransform" could not be imported from VIGRA. '
-                          'Please install vigra, see SyConn documentation.')
     assert type(downsampling) == tuple, "Downsampling has to be of type 'tuple'"
     assert (pts.ndim == 2 and pts.shape[1] == 3) or pts.ndim == 3, \
         "Point cloud used for mesh generation has wrong shape."
@@ -268,71 +340,69 @@ def triangulation(pts, downsampling=(1, 1, 1), n_closings=0, single_cc=False,
         margin = n_closings + 5
         pts += margin
         bb = np.max(pts, axis=0) + margin
-        volume = np.zeros(bb, dtype=np.float32)
-        volume[pts[:, 0], pts[:, 1], pts[:, 2]] = 1
+        if single_cc or force_single_cc:
+            # these flags act on the global connectivity and require the
+            # full bounding box
+            # uint8 until the float cast in `_dense_marching_cubes`; a single
+            # flat index array replaces the three-array fancy assignment
+            volume = np.zeros(bb, dtype=np.uint8)
+            flat_idx = np.ravel_multi_index(
+                (pts[:, 0], pts[:, 1], pts[:, 2]), volume.shape)
+            volume.reshape(-1)[flat_idx] = 1
+            verts, ind, norm, offset_shift = _dense_marching_cubes(
+                volume, n_closings, single_cc, force_single_cc,
+                gradient_direction)
+            offset += offset_shift
+        else:
+            # sparse path: distance transform, smoothing and marching cubes
+            # only run inside the tight sub-boxes of spatially isolated
+            # components instead of the full, mostly empty bounding box.
+            # A coarse occupancy grid (4x downsampled) is dilated so that
+            # voxels interacting through closings and smoothing stay within
+            # one component.
+            coarse = np.zeros(bb // 4 + 1, dtype=bool)
+            coarse[pts[:, 0] // 4, pts[:, 1] // 4, pts[:, 2] // 4] = True
+            coarse = binary_dilation(coarse, iterations=n_closings + 2)
+            labeled, nb_cc = ndimage.label(coarse)
+            pt_labels = labeled[pts[:, 0] // 4, pts[:, 1] // 4, pts[:, 2] // 4]
+            ind_lst = []
+            vert_lst = []
+            norm_lst = []
+            for cc_ix, sl in enumerate(ndimage.find_objects(labeled), 1):
+                lo = np.maximum(np.array([s.start for s in sl]) * 4 - margin, 0)
+                hi = np.minimum(np.array([s.stop for s in sl]) * 4 + margin, bb)
+                sub_pts = pts[pt_labels == cc_ix] - lo.astype(pts.dtype)
+                volume = np.zeros(hi - lo, dtype=np.uint8)
+                flat_idx = np.ravel_multi_index(
+                    (sub_pts[:, 0], sub_pts[:, 1], sub_pts[:, 2]),
+                    volume.shape)
+                volume.reshape(-1)[flat_idx] = 1
+                verts, ind, norm, _ = _dense_marching_cubes(
+                    volume, n_closings, False, False, gradient_direction)
+                vert_lst.append((verts + lo).flatten())
+                ind_lst.append(ind.flatten())
+                norm_lst.append(norm.flatten())
+            ind, verts = merge_meshes(ind_lst, vert_lst)
+            ind = ind.reshape(-1, 3)
+            verts = verts.reshape(-1, 3)
+            norm = np.concatenate(norm_lst).reshape(-1, 3)
     else:
         volume = pts
         if np.any(np.array(downsampling) != 1):
             ndimage.zoom(volume, downsampling, order=0)
         offset = np.array([0, 0, 0])
-    if n_closings > 0:
-        volume = binary_closing(volume, iterations=n_closings).astype(np.float32)
-        if force_single_cc:
-            n_dilations = 0
-            while True:
-                labeled, nb_cc = ndimage.label(volume)
-                # log_proc.debug('Forcing single CC, additional dilations {}, num'
-                #                'ber connected components: {}'
-                #                ''.format(n_dilations, nb_cc))
-                if nb_cc == 1:  # does not count background
-                    break
-                # pad volume to maintain margin at boundary and correct offset
-                volume = np.pad(volume, [(1, 1), (1, 1), (1, 1)],
-                                mode='constant', constant_values=0)
-                offset -= 1
-                volume = binary_dilation(volume, iterations=1).astype(
-                    np.float32)
-                n_dilations += 1
-    else:
-        volume = volume.astype(np.float32)
-    if single_cc:
-        labeled, nb_cc = ndimage.label(volume)
-        cnt = Counter(labeled[labeled != 0])
-        l, occ = cnt.most_common(1)[0]
-        volume = np.array(labeled == l, dtype=np.float32)
-    # InterpixelBoundary, OuterBoundary, InnerBoundary
-    dt = boundaryDistanceTransform(volume, boundary="InterpixelBoundary")
-    dt[volume == 1] *= -1
-    volume = gaussianSmoothing(dt, 1)
-    if np.sum(volume < 0) == 0 or np.sum(volume > 0) == 0:  # less smoothing
-        volume = gaussianSmoothing(dt, 0.5)
-    try:
-        verts, ind, norm, _ = measure.marching_cubes_lewiner(
-            volume, 0, gradient_direction=gradient_direction)
-    except Exception as e:
-        raise ValueError(e)
+        verts, ind, norm, _ = _dense_marching_cubes(
+            volume, n_closings, single_cc, force_single_cc,
+            gradient_direction)
     if pts.ndim == 2:  # account for [5, 5, 5] offset
         verts -= margin
     verts = np.array(verts) * downsampling + offset
     if decimate_mesh > 0:
-        if not __vtk_avail__:
-            msg = "vtki not installed. Please install vtki.'" \
-                  "pip install vtki'."
-            log_proc.error(msg)
-            raise ImportError(msg)
-        # log_proc.warning("'triangulation': Currently mesh-sparsification"
-        #                  " may not preserve volume.")
-        # add number of vertices in front of every face (required by vtki)
-        ind = np.concatenate([np.ones((len(ind), 1)).astype(np.int64) * 3, ind],
-                             axis=1)
-        mesh = vtki.PolyData(verts, ind.flatten())
-        mesh.decimate(decimate_mesh, volume_preservation=True)
-        # remove face sizes again
-        ind = mesh.faces.reshape((-1, 4))[:, 1:]
-        verts = mesh.points
-        mo = MeshObject("", ind, verts)
-        # compute normals
-        norm = mo.normals.reshape((-1, 3))
+        # Multiple-Choice decimation: random edge sampling with quadric
+        # error instead of the former VTK priority-queue path and its
+        # point-copy round trip
+        ind, verts = decimate_mesh_mc(verts, ind, decimate_mesh)
+        norm = unit_normal(verts, ind)
     return np.array(ind, dtype=np.int), verts, norm
 
 
@@ -470,9 +540,15 @@ def calc_rot_matrices_helper(args):
     rot_matrices = np.zeros((len(coords), 16))
     edge_lengths = np.array([edge_length] * 3)
     vertices = vertices.astype(np.float32)
+    # one batched KD-tree query collects the candidates of all boxes at
+    # once instead of scanning every vertex per box; the circumscribing
+    # sphere radius guarantees no box inlier is missed
+    tree = spatial.cKDTree(vertices)
+    radius = 0.5 * np.linalg.norm(edge_lengths)
+    cand_lists = tree.query_ball_point(coords, radius)
     for ii, c in enumerate(coords):
-        bounding_box = np.array([c, edge_lengths], dtype=np.float32)
-        inlier = np.array(vertices[in_bounding_box(vertices, bounding_box)])
+        cand = vertices[cand_lists[ii]]
+        inlier = cand[np.all(np.abs(cand - c) < edge_lengths / 2, axis=1)]
         rot_matrices[ii] = get_rotmatrix_from_points(inlier)
     return rot_matrices
 
@@ -493,11 +569,21 @@ def get_rotmatrix_from_points(points):
     if len(points) <= 2:
         return np.zeros((16))
     new_center = np.mean(points, axis=0)
-    points -= new_center
-    pca = PCA(n_components=3, random_state=0)
-    pca.fit(points)
+    points = points - new_center
+    # the principal axes of 3D points are the eigenvectors of their 3x3
+    # covariance matrix; np.linalg.eigh on that replaces the per-box
+    # sklearn PCA construction, input validation and SVD
+    cov = points.T @ points
+    _, eig_vec = np.linalg.eigh(cov)
+    components = eig_vec[:, ::-1].T  # descending eigenvalues
+    # deterministic orientation: flip each axis so its largest absolute
+    # entry is positive (mirrors sklearn's svd_flip convention)
+    signs = np.sign(components[np.arange(3),
+                               np.argmax(np.abs(components), axis=1)])
+    signs[signs == 0] = 1
+    components *= signs[:, None]
     rot_mat = np.zeros((4, 4))
-    rot_mat[:3, :3] = pca.components_
+    rot_mat[:3, :3] = components
     rot_mat[3, 3] = 1
     rot_mat = rot_mat.flatten('F')
     return rot_mat
@@ -530,10 +616,14 @@ def flag_empty_spaces(coords, vertices, edge_length):
         vertices = vertices[::8]
     empty_spaces = np.zeros((len(coords))).astype(np.bool)
     edge_lengths = np.array([edge_length] * 3)
+    # batched candidate lookup as in `calc_rot_matrices_helper`
+    tree = spatial.cKDTree(vertices)
+    radius = 0.5 * np.linalg.norm(edge_lengths)
+    cand_lists = tree.query_ball_point(coords, radius)
     for ii, c in enumerate(coords):
-        bounding_box = (c, edge_lengths)
-        inlier = np.array(vertices[in_bounding_box(vertices, bounding_box)])
-        if len(inlier) == 0:
+        cand = vertices[cand_lists[ii]]
+        if len(cand) == 0 or not np.any(
+                np.all(np.abs(cand - c) < edge_lengths / 2, axis=1)):
             empty_spaces[ii] = True
     return empty_spaces
 
@@ -561,15 +651,6 @@ def get_bounding_box(coordinates):
     return mean, max_dist
 
 
-@jit
-def get_avg_normal(normals, indices, nbvert):
-    normals_avg = np.zeros((nbvert, 3), np.float)
-    for n in range(len(indices)):
-        ix = indices[n]
-        normals_avg[ix] += normals[n]
-    return normals_avg
-
-
 def unit_normal(vertices, indices):
     """
     Calculates normals per face (averaging corresponding vertex normals) and
@@ -577,34 +658,186 @@ def unit_normal(vertices, indices):
 
     Parameters
     ----------
-    vertices : np.array [N x 1]
-        Flattend vertices
-    indices : np.array [M x 1]
-        Flattend indices
+    vertices : np.array [N x 3]
+        Vertices; flat arrays are reshaped
+    indices : np.array [M x 3]
+        Indices; flat arrays are reshaped
 
     Returns
     -------
-    np.array [N x 1]
+    np.array [N x 3]
         Unit face normals per vertex
     """
-    vertices = np.array(vertices, dtype=np.float)
-    nbvert = len(vertices) // 3
-    # get coordinate list
-    vert_lst = vertices.reshape(nbvert, 3)[indices]
-    # get traingles from coordinates
-    triangles = vert_lst.reshape(len(vert_lst) // 3, 3, 3)
-    # calculate normals of triangles
-    v = triangles[:, 1] - triangles[:, 0]
-    w = triangles[:, 2] - triangles[:, 0]
-    normals = np.cross(v, w)
-    norm = np.linalg.norm(normals, axis=1)
-    normals[norm != 0, :] = normals[norm != 0, :] / norm[norm != 0, None]
-    # repeat normal, s.t. len(normals) == len(vertices), i.e. every vertex nows
-    # its normal (multiple normals because one vertex is part of multiple triangles
-    normals = np.array(list(itertools.chain.from_iterable(itertools.repeat(x, 3) for x in normals)))
-    # average normal for every vertex
-    normals_avg = get_avg_normal(normals, indices, nbvert)
-    return -normals_avg.astype(np.float32).reshape(nbvert*3)
+    vertices = np.asarray(vertices, dtype=np.float).reshape(-1, 3)
+    ind_resh = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+    normals_avg = _unit_normal_kernel(ind_resh, vertices, len(vertices))
+    # normalize per vertex — despite its name this function used to return
+    # the raw accumulated sum — and fuse the sign flip into the same pass
+    norm = np.linalg.norm(normals_avg, axis=1, keepdims=True)
+    np.divide(normals_avg, norm + 1e-12, out=normals_avg)
+    np.negative(normals_avg, out=normals_avg)
+    return normals_avg.astype(np.float32)
+
+
+@jit(nopython=True, parallel=True, fastmath=True, cache=True)
+def _unit_normal_kernel(ind_resh, vertices, nbvert):
+    """
+    Fused per-face pass for `unit_normal`: edge differences, cross product
+    and normalization stream the face array once in parallel; the
+    accumulation onto the vertices runs serially to stay deterministic.
+    """
+    nbfaces = len(ind_resh)
+    face_norm = np.empty((nbfaces, 3), dtype=np.float64)
+    for i in prange(nbfaces):
+        a, b, c = ind_resh[i, 0], ind_resh[i, 1], ind_resh[i, 2]
+        vx = vertices[b, 0] - vertices[a, 0]
+        vy = vertices[b, 1] - vertices[a, 1]
+        vz = vertices[b, 2] - vertices[a, 2]
+        wx = vertices[c, 0] - vertices[a, 0]
+        wy = vertices[c, 1] - vertices[a, 1]
+        wz = vertices[c, 2] - vertices[a, 2]
+        nx = vy * wz - vz * wy
+        ny = vz * wx - vx * wz
+        nz = vx * wy - vy * wx
+        length = np.sqrt(nx * nx + ny * ny + nz * nz)
+        if length > 0:
+            nx /= length
+            ny /= length
+            nz /= length
+        face_norm[i, 0] = nx
+        face_norm[i, 1] = ny
+        face_norm[i, 2] = nz
+    normals_avg = np.zeros((nbvert, 3), dtype=np.float64)
+    for i in range(nbfaces):
+        for k in range(3):
+            vid = ind_resh[i, k]
+            normals_avg[vid, 0] += face_norm[i, 0]
+            normals_avg[vid, 1] += face_norm[i, 1]
+            normals_avg[vid, 2] += face_norm[i, 2]
+    return normals_avg
+
+
+def decimate_mesh_mc(vertices, faces, fraction, n_choices=8, seed=0):
+    """
+    Multiple-Choice mesh decimation (Wu & Kobbelt): repeatedly samples a
+    small set of random edges, evaluates their quadric error and collapses
+    the cheapest to the edge midpoint. Needs no global priority queue and
+    no VTK conversion.
+
+    Parameters
+    ----------
+    vertices : np.array [N x 3]
+    faces : np.array [M x 3]
+    fraction : float
+        Fraction of vertices to remove, e.g. 0.1 removes 10%.
+    n_choices : int
+        Number of random edges evaluated per collapse.
+    seed : int
+
+    Returns
+    -------
+    np.array [M' x 3], np.array [N' x 3]
+        decimated faces and vertices
+    """
+    verts = np.array(vertices, dtype=np.float64).reshape(-1, 3)
+    faces = np.array(faces, dtype=np.int64).reshape(-1, 3)
+    n_collapse = int(len(verts) * fraction)
+    if n_collapse <= 0 or len(faces) == 0:
+        return faces, verts
+    parent = _mc_decimation_kernel(verts, faces, n_collapse, n_choices, seed)
+    # resolve the collapse chains, drop degenerate faces and compact the
+    # surviving vertices
+    roots = parent.copy()
+    while True:
+        nxt = parent[roots]
+        if np.array_equal(nxt, roots):
+            break
+        roots = nxt
+    faces = roots[faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & \
+           (faces[:, 0] != faces[:, 2])
+    faces = faces[keep]
+    unique_ixs, faces = np.unique(faces, return_inverse=True)
+    return faces.reshape(-1, 3), verts[unique_ixs]
+
+
+@jit(nopython=True, cache=True)
+def _mc_decimation_kernel(verts, faces, n_collapse, n_choices, seed):
+    """
+    Collapse loop of `decimate_mesh_mc`; mutates `verts` (midpoint
+    placement) and returns the vertex parent table describing the
+    collapses.
+    """
+    np.random.seed(seed)
+    nv = len(verts)
+    nf = len(faces)
+    # per-vertex error quadrics from the face planes
+    quad = np.zeros((nv, 4, 4))
+    p = np.empty(4)
+    for i in range(nf):
+        a, b, c = faces[i, 0], faces[i, 1], faces[i, 2]
+        vx = verts[b, 0] - verts[a, 0]
+        vy = verts[b, 1] - verts[a, 1]
+        vz = verts[b, 2] - verts[a, 2]
+        wx = verts[c, 0] - verts[a, 0]
+        wy = verts[c, 1] - verts[a, 1]
+        wz = verts[c, 2] - verts[a, 2]
+        nx = vy * wz - vz * wy
+        ny = vz * wx - vx * wz
+        nz = vx * wy - vy * wx
+        length = np.sqrt(nx * nx + ny * ny + nz * nz)
+        if length == 0:
+            continue
+        nx /= length
+        ny /= length
+        nz /= length
+        p[0] = nx
+        p[1] = ny
+        p[2] = nz
+        p[3] = -(nx * verts[a, 0] + ny * verts[a, 1] + nz * verts[a, 2])
+        K = np.outer(p, p)
+        quad[a] += K
+        quad[b] += K
+        quad[c] += K
+    parent = np.arange(nv)
+    removed = 0
+    attempts = 0
+    max_attempts = n_collapse * 50
+    v_h = np.empty(4)
+    while removed < n_collapse and attempts < max_attempts:
+        attempts += 1
+        best_cost = np.inf
+        best_a = -1
+        best_b = -1
+        for t in range(n_choices):
+            fi = np.random.randint(nf)
+            e = np.random.randint(3)
+            va = faces[fi, e]
+            vb = faces[fi, (e + 1) % 3]
+            while parent[va] != va:
+                va = parent[va]
+            while parent[vb] != vb:
+                vb = parent[vb]
+            if va == vb:
+                continue
+            v_h[0] = 0.5 * (verts[va, 0] + verts[vb, 0])
+            v_h[1] = 0.5 * (verts[va, 1] + verts[vb, 1])
+            v_h[2] = 0.5 * (verts[va, 2] + verts[vb, 2])
+            v_h[3] = 1.
+            cost = v_h @ (quad[va] + quad[vb]) @ v_h
+            if cost < best_cost:
+                best_cost = cost
+                best_a = va
+                best_b = vb
+        if best_a == -1:
+            continue
+        verts[best_a, 0] = 0.5 * (verts[best_a, 0] + verts[best_b, 0])
+        verts[best_a, 1] = 0.5 * (verts[best_a, 1] + verts[best_b, 1])
+        verts[best_a, 2] = 0.5 * (verts[best_a, 2] + verts[best_b, 2])
+        quad[best_a] += quad[best_b]
+        parent[best_b] = best_a
+        removed += 1
+    return parent
 
 
 def get_random_centered_coords(pts, nb, r):
@@ -651,12 +884,20 @@ def merge_meshes(ind_lst, vert_lst, nb_simplices=3):
     """
     assert len(vert_lst) == len(ind_lst), "Length of indices list differs" \
                                           "from vertices list."
-    all_ind = np.zeros((0, ), dtype=np.uint)
-    all_vert = np.zeros((0, ))
+    # pre-size the merged arrays once; growing them with concatenate per
+    # mesh re-copies the whole running buffer every iteration
+    vert_offsets = np.zeros(len(vert_lst) + 1, dtype=np.int64)
+    ind_offsets = np.zeros(len(ind_lst) + 1, dtype=np.int64)
+    np.cumsum([len(vert) for vert in vert_lst], out=vert_offsets[1:])
+    np.cumsum([len(ind) for ind in ind_lst], out=ind_offsets[1:])
+    # uint64 with integer floor division throughout; a true division here
+    # would silently upcast the whole index array to float64
+    all_ind = np.empty(ind_offsets[-1], dtype=np.uint64)
+    all_vert = np.empty(vert_offsets[-1])
     for i in range(len(vert_lst)):
-        all_ind = np.concatenate([all_ind, ind_lst[i] +
-                                  len(all_vert)//nb_simplices])
-        all_vert = np.concatenate([all_vert, vert_lst[i]])
+        all_ind[ind_offsets[i]:ind_offsets[i + 1]] = \
+            ind_lst[i] + vert_offsets[i] // nb_simplices
+        all_vert[vert_offsets[i]:vert_offsets[i + 1]] = vert_lst[i]
     return all_ind, all_vert
 
 
@@ -683,7 +924,7 @@ def merge_meshes_incl_norm(ind_lst, vert_lst, norm_lst, nb_simplices=3):
                                           "from vertices list."
 
     if len(vert_lst) == 0:
-        return [np.zeros((0,), dtype=np.uint), np.zeros((0,)), np.zeros((0,))]
+        return [np.zeros((0,), dtype=np.uint64), np.zeros((0,)), np.zeros((0,))]
     else:
         all_vert = np.concatenate(vert_lst)
 
@@ -691,11 +932,13 @@ def merge_meshes_incl_norm(ind_lst, vert_lst, norm_lst, nb_simplices=3):
         all_norm = np.zeros((0,))
     else:
         all_norm = np.concatenate(norm_lst)
-    # store index and vertex offset of every partial mesh
-    vert_offset = np.cumsum([0, ] + [len(verts) // nb_simplices for verts in vert_lst]).astype(
-        np.uint)
+    # store index and vertex offset of every partial mesh; keep the index
+    # array uint64 — adding a uint offset to e.g. int32 input would either
+    # raise or upcast
+    vert_offset = np.cumsum([0, ] + [len(verts) // nb_simplices
+                                     for verts in vert_lst]).astype(np.uint64)
     ind_ixs = np.cumsum([0, ] + [len(inds) for inds in ind_lst])
-    all_ind = np.concatenate(ind_lst)
+    all_ind = np.concatenate(ind_lst).astype(np.uint64, copy=False)
     for i in range(0, len(vert_lst)):
         start_ix, end_ix = ind_ixs[i], ind_ixs[i+1]
         all_ind[start_ix:end_ix] += vert_offset[i]
@@ -706,6 +949,36 @@ def mesh_loader(so):
     return so.mesh
 
 
+def mesh_loader_shm(so):
+    """
+    Loads the mesh of a SegmentationObject into shared-memory blocks and
+    returns only their descriptors. The worker thereby moves the arrays
+    once into shared memory instead of pickling them through the result
+    pipe; the parent re-attaches zero-copy views via
+    `np.ndarray(shape, dtype, buffer=SharedMemory(name).buf)`.
+
+    Parameters
+    ----------
+    so : SegmentationObject
+
+    Returns
+    -------
+    list of tuple
+        (name, shape, dtype) of the shared-memory block of every mesh array
+    """
+    from multiprocessing import shared_memory
+    descr = []
+    for arr in so.mesh:
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(arr.nbytes, 1))
+        shm_arr = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+        shm_arr[...] = arr
+        descr.append((shm.name, arr.shape, arr.dtype))
+        shm.close()
+    return descr
+
+
 def merge_someshes(sos, nb_simplices=3, nb_cpus=1, color_vals=None,
                   cmap=None, alpha=1.0):
     """
@@ -728,28 +1001,72 @@ def merge_someshes(sos, nb_simplices=3, nb_cpus=1, color_vals=None,
     np.array, np.array [, np.array]
         indices, vertices (scaled) [,colors]
     """
-    all_ind = np.zeros((0, ), dtype=np.uint)
-    all_vert = np.zeros((0, ))
-    all_norm = np.zeros((0, ))
-    colors = np.zeros((0, ))
+    shm_blocks = []
     if nb_cpus > 1:
-        log_proc.debug('`merge_someshes` is not working with `n_cpus > 1`:'
-                       ' `cant pickle _thread.RLock objects`')
-        nb_cpus = 1
-    meshes = start_multiprocess_imap(mesh_loader, sos, nb_cpus=nb_cpus,
-                                     show_progress=False)
+        # workers write the arrays into shared memory and send back only
+        # (name, shape, dtype) descriptors; the parent attaches zero-copy
+        # views instead of unpickling the arrays from the result pipe
+        try:
+            # requires Python >= 3.8; older interpreters fall back to the
+            # single-process path below
+            from multiprocessing import shared_memory
+            descr_lst = start_multiprocess_imap(
+                mesh_loader_shm, sos, nb_cpus=nb_cpus, show_progress=False)
+        except Exception as e:
+            log_proc.debug('Parallel mesh loading in `merge_someshes` failed'
+                           ' ({}). Falling back to a single process.'
+                           ''.format(e))
+            descr_lst = None
+        if descr_lst is not None:
+            meshes = []
+            for descr in descr_lst:
+                mesh = []
+                for name, shape, dtype in descr:
+                    shm = shared_memory.SharedMemory(name=name)
+                    shm_blocks.append(shm)
+                    mesh.append(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+                meshes.append(mesh)
+        else:
+            nb_cpus = 1
+    if nb_cpus == 1:
+        meshes = start_multiprocess_imap(mesh_loader, sos, nb_cpus=nb_cpus,
+                                         show_progress=False)
     if color_vals is not None and cmap is not None:
         color_vals = color_factory(color_vals, cmap, alpha=alpha)
-    for i in range(len(meshes)):
-        ind, vert, norm = meshes[i]
-        assert len(vert) == len(norm) or len(norm) == 0, "Length of normals " \
-                                                         "and vertices differ."
-        all_ind = np.concatenate([all_ind, ind + len(all_vert)//nb_simplices])
-        all_vert = np.concatenate([all_vert, vert])
-        all_norm = np.concatenate([all_norm, norm])
-        if color_vals is not None:
-            curr_color = np.array([color_vals[i]]*len(vert))
-            colors = np.concatenate([colors, curr_color])
+    try:
+        # pre-size the merged arrays once instead of re-copying the running
+        # buffers with concatenate for every mesh
+        vert_sizes = np.array([len(m[1]) for m in meshes], dtype=np.int64)
+        vert_offsets = np.zeros(len(meshes) + 1, dtype=np.int64)
+        ind_offsets = np.zeros(len(meshes) + 1, dtype=np.int64)
+        norm_offsets = np.zeros(len(meshes) + 1, dtype=np.int64)
+        np.cumsum(vert_sizes, out=vert_offsets[1:])
+        np.cumsum([len(m[0]) for m in meshes], out=ind_offsets[1:])
+        np.cumsum([len(m[2]) for m in meshes], out=norm_offsets[1:])
+        all_ind = np.empty(ind_offsets[-1], dtype=np.uint64)
+        # float32 matches the on-disk mesh precision; float16 is not an
+        # option here since these are scaled (nm) coordinates beyond the
+        # f16 range
+        all_vert = np.empty(vert_offsets[-1], dtype=np.float32)
+        all_norm = np.empty(norm_offsets[-1], dtype=np.float32)
+        colors = np.zeros((0, ))
+        for i in range(len(meshes)):
+            ind, vert, norm = meshes[i]
+            assert len(vert) == len(norm) or len(norm) == 0, \
+                "Length of normals and vertices differ."
+            all_ind[ind_offsets[i]:ind_offsets[i + 1]] = \
+                ind + vert_offsets[i] // nb_simplices
+            all_vert[vert_offsets[i]:vert_offsets[i + 1]] = vert
+            all_norm[norm_offsets[i]:norm_offsets[i + 1]] = norm
+    finally:
+        # always release the attached blocks, otherwise an error in the
+        # merge loop leaks the segments in /dev/shm
+        for shm in shm_blocks:
+            shm.close()
+            shm.unlink()
+    if color_vals is not None:
+        # one repeat over all meshes replaces the per-mesh list expansion
+        colors = np.repeat(np.asarray(color_vals), vert_sizes, axis=0)
     assert len(all_vert) == len(all_norm) or len(all_norm) == 0, \
         "Length of combined normals and vertices differ."
     if color_vals is not None:
@@ -805,18 +1122,23 @@ def make_ply_string(dest_path, indices, vertices, rgba_color):
                       "min/max of data: {}, {}".format(rgba_color.min(),
                                                        rgba_color.max()))
         rgba_color = np.array(rgba_color, dtype=np.uint8)
-    # ply file requires 1D object arrays,
-    vertices = np.concatenate([vertices.astype(np.object),
-                               rgba_color.astype(np.object)], axis=1)
-    vertices = np.array([tuple(el) for el in vertices],
-                        dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4'),
-                               ('red', 'u1'), ('green', 'u1'), ('blue', 'u1'),
-                               ('alpha', 'u1')])
-    # ply file requires 1D object arrays.
-    indices = np.array([tuple([el], ) for el in indices],
-                       dtype=[('vertex_indices', 'i4', (3,))])
-    PlyData([PlyElement.describe(vertices, 'vertex'),
-             PlyElement.describe(indices, 'face')]).write(dest_path)
+    # fill the structured arrays column-wise; going through per-row Python
+    # tuples and object arrays copies every element individually
+    vertex_buf = np.empty(len(vertices),
+                          dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4'),
+                                 ('red', 'u1'), ('green', 'u1'),
+                                 ('blue', 'u1'), ('alpha', 'u1')])
+    vertex_buf['x'] = vertices[:, 0]
+    vertex_buf['y'] = vertices[:, 1]
+    vertex_buf['z'] = vertices[:, 2]
+    vertex_buf['red'] = rgba_color[:, 0]
+    vertex_buf['green'] = rgba_color[:, 1]
+    vertex_buf['blue'] = rgba_color[:, 2]
+    vertex_buf['alpha'] = rgba_color[:, 3]
+    face_buf = np.empty(len(indices), dtype=[('vertex_indices', 'i4', (3,))])
+    face_buf['vertex_indices'] = indices
+    PlyData([PlyElement.describe(vertex_buf, 'vertex'),
+             PlyElement.describe(face_buf, 'face')]).write(dest_path)
 
 
 def make_ply_string_wocolor(dest_path, indices, vertices):
@@ -841,10 +1163,16 @@ def make_ply_string_wocolor(dest_path, indices, vertices):
         indices = np.array(indices, dtype=np.int).reshape((-1, 3))
     if not vertices.ndim == 2:
         vertices = np.array(vertices, dtype=np.float32).reshape((-1, 3))
-    vertices = np.array([tuple(el) for el in vertices], dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4')])
-    indices = np.array([tuple([el], ) for el in indices],dtype=[('vertex_indices', 'i4', (3,))])
-    PlyData([PlyElement.describe(vertices, 'vertex'),
-             PlyElement.describe(indices, 'face')]).write(dest_path)
+    # column-wise fill instead of a Python tuple per row
+    vertex_buf = np.empty(len(vertices),
+                          dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4')])
+    vertex_buf['x'] = vertices[:, 0]
+    vertex_buf['y'] = vertices[:, 1]
+    vertex_buf['z'] = vertices[:, 2]
+    face_buf = np.empty(len(indices), dtype=[('vertex_indices', 'i4', (3,))])
+    face_buf['vertex_indices'] = indices
+    PlyData([PlyElement.describe(vertex_buf, 'vertex'),
+             PlyElement.describe(face_buf, 'face')]).write(dest_path)
 
 
 def write_mesh2kzip(k_path, ind, vert, norm, color, ply_fname,
@@ -867,6 +1195,10 @@ def write_mesh2kzip(k_path, ind, vert, norm, color, ply_fname,
         log_proc.warn("'write_mesh2kzip' called with empty vertex array. Did not"
                       " write data to kzip. `ply_fname`. {}".format(ply_fname))
         return
+    if not force_overwrite:
+        # stream the PLY straight into the zip entry; no temporary file
+        write_mesh2kzip_stream(k_path, ind, vert, norm, color, ply_fname)
+        return
     tmp_dest_p = '{}_{}'.format(k_path, ply_fname)
     if color is not None:
         make_ply_string(tmp_dest_p, ind, vert.astype(np.float32), color)
@@ -876,6 +1208,35 @@ def write_mesh2kzip(k_path, ind, vert, norm, color, ply_fname,
                     force_overwrite=force_overwrite)
 
 
+def write_mesh2kzip_stream(k_path, ind, vert, norm, color, ply_fname):
+    """
+    Streams the binary PLY of a mesh directly into a zip entry opened with
+    `ZipFile.open(..., 'w')`. Neither a temporary file nor the whole PLY
+    byte string is materialized; an existing entry of the same name is
+    removed first, like the `data2kzip` append path does.
+
+    Parameters
+    ----------
+    k_path : str
+        path to zip
+    ind : np.array
+    vert : np.array
+    norm : np.array
+    color : tuple or np.array
+        rgba between 0 and 255
+    ply_fname : str
+    """
+    if os.path.isfile(k_path):
+        remove_from_zip(k_path, ply_fname)
+    with zipfile.ZipFile(k_path, 'a', zipfile.ZIP_DEFLATED,
+                         allowZip64=True) as zf:
+        with zf.open(ply_fname, 'w', force_zip64=True) as fh:
+            if color is not None:
+                make_ply_string(fh, ind, vert.astype(np.float32), color)
+            else:
+                make_ply_string_wocolor(fh, ind, vert.astype(np.float32))
+
+
 def write_meshes2kzip(k_path, inds, verts, norms, colors, ply_fnames,
                       force_overwrite=True, verbose=True):
     """
@@ -974,27 +1335,26 @@ def compartmentalize_mesh(ssv, pred_key_appendix=""):
     vert = vert.reshape(-1, 3)
     norm = ssv.mesh[2].reshape(-1, 3)
     ind_comp = ind_comp.reshape(-1, 3)
-    ind_comp_maj = np.zeros((len(ind)), dtype=np.uint8)
-    for ii in range(len(ind)):
-        triangle = ind_comp[ii]
-        cnt = Counter(triangle)
-        ax, n = cnt.most_common(1)[0]
-        if n == 1:
-            ax = -1
-        ind_comp_maj[ii] = ax
+    # majority label of three entries in closed form: any value occurring
+    # at least twice wins, otherwise -1 — no Counter object per triangle
+    eq01 = ind_comp[:, 0] == ind_comp[:, 1]
+    eq02 = ind_comp[:, 0] == ind_comp[:, 2]
+    eq12 = ind_comp[:, 1] == ind_comp[:, 2]
+    ind_comp_maj = np.where(eq01 | eq02, ind_comp[:, 0],
+                            np.where(eq12, ind_comp[:, 1],
+                                     -1)).astype(np.uint8)
     comp_meshes = {}
     for ii, comp_type in enumerate(["axon", "dendrite", "soma"]):
         comp_ind = ind[ind_comp_maj == ii].flatten()
-        unique_comp_ind = np.unique(comp_ind)
+        # np.unique with return_inverse yields the remapped indices
+        # directly; no Python dict lookup per index reference
+        unique_comp_ind, comp_ind = np.unique(comp_ind, return_inverse=True)
+        comp_ind = comp_ind.astype(np.uint)
         comp_vert = vert[unique_comp_ind].flatten()
         if len(ssv.mesh[2]) != 0:
             comp_norm = norm[unique_comp_ind].flatten()
         else:
             comp_norm = ssv.mesh[2]
-        remap_dict = {}
-        for i in range(len(unique_comp_ind)):
-            remap_dict[unique_comp_ind[i]] = i
-        comp_ind = np.array([remap_dict[i] for i in comp_ind], dtype=np.uint)
         comp_meshes[comp_type] = [comp_ind, comp_vert, comp_norm]
     return comp_meshes
 
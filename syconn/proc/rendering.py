@@ -477,10 +477,10 @@ def multi_view_sso(sso, colors=None, obj_to_render=('sv',),
             continue
         m = MeshObject(object_type, curr_ind, curr_vert, curr_norm,
                              colors[object_type], sv_mesh.bounding_box)
-        norm = np.concatenate([norm, m.normals])
+        norm = np.concatenate([norm, m.normals_flat])
         col = np.concatenate([col, m.colors])
         ind.append(m.indices)
-        vert.append(m.vertices)
+        vert.append(m.vertices_flat)
     ind, vert = merge_meshes(ind, vert)
     init_object(ind, vert, norm, col, ws)
 
@@ -569,13 +569,13 @@ def multi_view_mesh_coords(mesh, coords, rot_matrices, edge_lengths, alpha=None,
     # center data
     assert isinstance(edge_lengths, np.ndarray)
     assert nb_simplices in [3, 4]
-    vertices = mesh.vertices
+    vertices = mesh.vertices_flat
     indices = mesh.indices
     colors = mesh.colors
     if mesh._normals is None:
         normals = np.zeros(len(vertices))
     else:
-        normals = mesh.normals
+        normals = mesh.normals_flat
     edge_lengths = edge_lengths / mesh.max_dist
     # default color
     if colors is not None and not depth_map:
@@ -685,7 +685,7 @@ def render_mesh(mo, **kwargs):
     """
     if "physical_scale" in kwargs.keys():
         kwargs["physical_scale"] = kwargs["physical_scale"] / mo.max_dist
-    mo_views = multi_view_mesh(mo.indices, mo.vertices, mo.normals,
+    mo_views = multi_view_mesh(mo.indices, mo.vertices_flat, mo.normals_flat,
                             colors=mo.colors, **kwargs)
     return mo_views
 
@@ -9,9 +9,9 @@ try:
 except ImportError:
     import pickle as pkl
 from typing import Iterable, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import glob
 import numpy as np
-from collections import Counter
 
 from .. import global_params
 from . import log_proc
@@ -21,6 +21,7 @@ from ..mp import mp_utils as sm
 from ..reps.super_segmentation import SuperSegmentationObject, \
     SuperSegmentationDataset
 from ..reps import segmentation, super_segmentation
+from ..reps.super_segmentation_dataset import _get_worker_ssd
 from ..proc.meshes import mesh_creator_sso
 
 
@@ -71,30 +72,43 @@ def _aggregate_segmentation_object_mappings_thread(args):
     obj_types = args[4]
     ssd_type = args[5]
 
-    ssd = super_segmentation.SuperSegmentationDataset(working_dir, version,
-                                                      ssd_type=ssd_type,
-                                                      version_dict=version_dict)
-    ssd.load_mapping_dict()
+    ssd = _get_worker_ssd(working_dir, version, version_dict,
+                          ssd_type=ssd_type)
+    if ssd._mapping_dict is None:
+        ssd.load_mapping_dict()
 
     for ssv_id in ssv_obj_ids:
         ssv = ssd.get_super_segmentation_object(ssv_id, True)
-        mappings = dict((obj_type, Counter()) for obj_type in obj_types)
+        mappings = dict((obj_type, ([], [])) for obj_type in obj_types)
+
+        # one pickle read per supervoxel; overlap the small random reads
+        svs = list(ssv.svs)
+        with ThreadPoolExecutor(max_workers=16) as tpe:
+            list(tpe.map(lambda sv: sv.load_attr_dict(), svs))
 
-        for sv in ssv.svs:
-            sv.load_attr_dict()
+        for sv in svs:
             for obj_type in obj_types:
                 if "mapping_%s_ids" % obj_type in sv.attr_dict:
-                    keys = sv.attr_dict["mapping_%s_ids" % obj_type]
-                    values = sv.attr_dict["mapping_%s_ratios" % obj_type]
-                    mappings[obj_type] += Counter(dict(zip(keys, values)))
+                    key_lst, value_lst = mappings[obj_type]
+                    key_lst.append(np.asarray(
+                        sv.attr_dict["mapping_%s_ids" % obj_type]))
+                    value_lst.append(np.asarray(
+                        sv.attr_dict["mapping_%s_ratios" % obj_type]))
 
         ssv.load_attr_dict()
         for obj_type in obj_types:
-            if obj_type in mappings:
-                ssv.attr_dict["mapping_%s_ids" % obj_type] = \
-                    list(mappings[obj_type].keys())
-                ssv.attr_dict["mapping_%s_ratios" % obj_type] = \
-                    list(mappings[obj_type].values())
+            key_lst, value_lst = mappings[obj_type]
+            if len(key_lst) > 0:
+                # C-level reduction instead of per-SV Counter merges
+                keys = np.concatenate(key_lst)
+                values = np.concatenate(value_lst)
+                unique_keys, inv = np.unique(keys, return_inverse=True)
+                summed_ratios = np.bincount(inv, weights=values)
+            else:
+                unique_keys = np.zeros(0, dtype=np.int64)
+                summed_ratios = np.zeros(0)
+            ssv.attr_dict["mapping_%s_ids" % obj_type] = unique_keys
+            ssv.attr_dict["mapping_%s_ratios" % obj_type] = summed_ratios
 
         ssv.save_attr_dict()
 
@@ -140,10 +154,10 @@ def _apply_mapping_decisions_thread(args):
     obj_types = args[4]
     ssd_type = args[5]
 
-    ssd = super_segmentation.SuperSegmentationDataset(working_dir, version,
-                                                      ssd_type=ssd_type,
-                                                      version_dict=version_dict)
-    ssd.load_mapping_dict()
+    ssd = _get_worker_ssd(working_dir, version, version_dict,
+                          ssd_type=ssd_type)
+    if ssd._mapping_dict is None:
+        ssd.load_mapping_dict()
 
     for ssv_id in ssv_obj_ids:
         ssv = ssd.get_super_segmentation_object(ssv_id, True)
@@ -5,8 +5,10 @@
 # Max-Planck-Institute of Neurobiology, Munich, Germany
 # Authors: Philipp Schubert, Joergen Kornfeld
 
-import glob
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from numba import jit
 from scipy import ndimage
 import os
 from typing import TYPE_CHECKING, Dict, Optional, Tuple, List, Union
@@ -16,7 +18,7 @@ if TYPE_CHECKING:
 
 from ..backend.storage import AttributeDict, CompressedStorage, MeshStorage,\
     VoxelStorage, SkeletonStorage, VoxelStorageDyn
-from ..handler.basics import chunkify
+from ..handler.basics import chunkify, load_pkl2obj, write_obj2pkl
 from ..mp.mp_utils import start_multiprocess_imap
 from . import log_reps
 from .. import global_params
@@ -39,13 +41,15 @@ def glia_pred_so(so: 'SegmentationObject', thresh: float, pred_key_appendix: str
     if not pred_key in so.attr_dict:
         so.load_attr_dict()
     try:
-        preds = np.array(so.attr_dict[pred_key][:, 1] > thresh, dtype=np.int)
-        pred = np.mean(so.attr_dict[pred_key][:, 1]) > thresh
+        probas = so.attr_dict[pred_key][:, 1]
     except KeyError:
         raise KeyError('Could not find glia proba key `{}` in so,attr_dict (keys: {})'.format(
             pred_key, so.attr_dict.keys()))
-    if pred == 0:
+    # mean check decides the common negative case without materializing
+    # the per-view votes
+    if not np.mean(probas) > thresh:
         return 0
+    preds = probas > thresh
     glia_votes = np.sum(preds)
     if glia_votes > int(len(preds) * 0.7):
         return 1
@@ -61,9 +65,21 @@ def acquire_obj_ids(sd: 'SegmentationDataset'):
     if os.path.exists(sd.path_ids):
         sd._ids = np.load(sd.path_ids)
     else:
-        paths = glob.glob(sd.so_storage_path + "/*/*/*/") + \
-                glob.glob(sd.so_storage_path + "/*/*/") + \
-                glob.glob(sd.so_storage_path + "/*/")
+        # scandir returns dirent type info in one syscall per entry,
+        # unlike glob which stats every candidate path
+        paths = []
+        stack = [(sd.so_storage_path, 0)]
+        while len(stack) > 0:
+            curr_dir, depth = stack.pop()
+            try:
+                with os.scandir(curr_dir) as dir_it:
+                    for entry in dir_it:
+                        if entry.is_dir():
+                            paths.append(entry.path + "/")
+                            if depth < 2:
+                                stack.append((entry.path, depth + 1))
+            except OSError:
+                pass
         sd._ids = []
         for path in paths:
             if os.path.exists(path + "voxel.pkl"):
@@ -79,6 +95,16 @@ def acquire_obj_ids(sd: 'SegmentationDataset'):
         np.save(sd.path_ids, sd._ids)
 
 
+@functools.lru_cache(maxsize=128)
+def _cached_voxel_storage(path: str) -> VoxelStorage:
+    """
+    Read-only ``VoxelStorage`` shared across back-to-back ``load_voxel*``
+    calls on the same object; avoids re-deserializing the same pickle.
+    Invalidated via ``_cached_voxel_storage.cache_clear()`` after writes.
+    """
+    return VoxelStorage(path, read_only=True, disable_locking=True)
+
+
 def save_voxels(so: 'SegmentationObject', bin_arr: np.ndarray,
                 offset: np.ndarray, overwrite: bool = False):
     """
@@ -104,6 +130,7 @@ def save_voxels(so: 'SegmentationObject', bin_arr: np.ndarray,
         voxel_dc[so.id] = [bin_arr], [offset]
 
     voxel_dc.push(so.voxel_path)
+    _cached_voxel_storage.cache_clear()
 
 
 def load_voxels(so: 'SegmentationObject',
@@ -125,8 +152,7 @@ def load_voxels(so: 'SegmentationObject',
         3D binary mask array, 0: background, 1: supervoxel locations.
     """
     if voxel_dc is None:
-        voxel_dc = VoxelStorage(so.voxel_path, read_only=True,
-                                disable_locking=True)
+        voxel_dc = _cached_voxel_storage(so.voxel_path)
 
     so._size = 0
     if so.id not in voxel_dc:
@@ -135,25 +161,22 @@ def load_voxels(so: 'SegmentationObject',
         return -1
 
     bin_arrs, block_offsets = voxel_dc[so.id]
-    block_extents = []
-    for i_bin_arr in range(len(bin_arrs)):
-        block_extents.append(np.array(bin_arrs[i_bin_arr].shape) +
-                             block_offsets[i_bin_arr])
-
-    block_offsets = np.array(block_offsets, dtype=np.int)
-    block_extents = np.array(block_extents, dtype=np.int)
+    # one batched min/max over all blocks instead of per-block array
+    # construction in a Python loop
+    block_shapes = np.array([b.shape for b in bin_arrs], dtype=np.int32)
+    block_offsets = np.array(block_offsets, dtype=np.int32)
+    block_extents = block_offsets + block_shapes
 
     so._bounding_box = np.array([block_offsets.min(axis=0),
                                  block_extents.max(axis=0)])
     voxels = np.zeros(so.bounding_box[1] - so.bounding_box[0],
-                      dtype=np.bool)
+                      dtype=np.bool_)
 
+    so._size = int(sum(b.sum() for b in bin_arrs))
     for i_bin_arr in range(len(bin_arrs)):
         box = [block_offsets[i_bin_arr] - so.bounding_box[0],
                block_extents[i_bin_arr] - so.bounding_box[0]]
 
-        so._size += np.sum(bin_arrs[i_bin_arr])
-
         voxels[box[0][0]: box[1][0],
                box[0][1]: box[1][1],
                box[0][2]: box[1][2]][bin_arrs[i_bin_arr]] = True
@@ -184,23 +207,48 @@ def load_voxel_list(so):
         2D array of coordinates to all voxels in SegmentationObject.
     """
     if so._voxels is not None:
-        voxel_list = np.transpose(np.nonzero(so.voxels)) + so.bounding_box[0]
+        voxel_list = np.argwhere(so.voxels) + so.bounding_box[0]
     else:
-        voxel_dc = VoxelStorage(so.voxel_path, read_only=True, disable_locking=True)
+        voxel_dc = _cached_voxel_storage(so.voxel_path)
         bin_arrs, block_offsets = voxel_dc[so.id]
 
         voxel_list = []
         for i_bin_arr in range(len(bin_arrs)):
-            block_voxels = np.transpose(np.nonzero(bin_arrs[i_bin_arr]))
+            block_voxels = np.argwhere(bin_arrs[i_bin_arr])
             block_voxels += block_offsets[i_bin_arr]
             voxel_list.append(block_voxels)
         voxel_list = np.concatenate(voxel_list)
     return voxel_list
 
 
+@jit(nopython=True, cache=True)
+def _downsample_nonzero(voxels, s0, s1, s2, off0, off1, off2):
+    """
+    Single streaming pass over the dense voxel volume emitting the offset
+    coordinates of every set voxel on the downsampling grid; avoids the
+    strided-view nonzero of the naive implementation.
+    """
+    cnt = 0
+    for i in range(0, voxels.shape[0], s0):
+        for j in range(0, voxels.shape[1], s1):
+            for k in range(0, voxels.shape[2], s2):
+                if voxels[i, j, k]:
+                    cnt += 1
+    out = np.empty((cnt, 3), dtype=np.int32)
+    cnt = 0
+    for i in range(0, voxels.shape[0], s0):
+        for j in range(0, voxels.shape[1], s1):
+            for k in range(0, voxels.shape[2], s2):
+                if voxels[i, j, k]:
+                    out[cnt, 0] = i + off0
+                    out[cnt, 1] = j + off1
+                    out[cnt, 2] = k + off2
+                    cnt += 1
+    return out
+
+
 def load_voxel_list_downsampled(so, downsampling=(2, 2, 1)):
     """
-    TODO: refactor, probably more efficient implementation possible.
 
     Parameters
     ----------
@@ -211,15 +259,17 @@ def load_voxel_list_downsampled(so, downsampling=(2, 2, 1)):
     -------
 
     """
-    downsampling = np.array(downsampling)
-    dvoxels = so.load_voxels_downsampled(downsampling)
-    voxel_list = np.array(np.transpose(np.nonzero(dvoxels)), dtype=np.int32)
-    voxel_list = voxel_list * downsampling + np.array(so.bounding_box[0])
-    return voxel_list
+    voxels = so.voxels
+    if isinstance(voxels, int):
+        return []
+    offset = so.bounding_box[0]
+    return _downsample_nonzero(voxels, int(downsampling[0]),
+                               int(downsampling[1]), int(downsampling[2]),
+                               int(offset[0]), int(offset[1]), int(offset[2]))
 
 
 def load_voxel_list_downsampled_adapt(so, downsampling=(2, 2, 1)):
-    downsampling = np.array(downsampling, dtype=np.int)
+    downsampling = np.array(downsampling, dtype=np.int32)
     dvoxels = so.load_voxels_downsampled(downsampling)
 
     if len(dvoxels) == 0:
@@ -233,7 +283,7 @@ def load_voxel_list_downsampled_adapt(so, downsampling=(2, 2, 1)):
         downsampling[downsampling < 1] = 1
         dvoxels = so.load_voxels_downsampled(downsampling)
 
-    voxel_list = np.array(np.transpose(np.nonzero(dvoxels)), dtype=np.int32)
+    voxel_list = np.argwhere(dvoxels).astype(np.int32, copy=False)
     voxel_list = voxel_list * downsampling + np.array(so.bounding_box[0])
 
     return voxel_list
@@ -271,11 +321,11 @@ def load_mesh(so: 'SegmentationObject', recompute: bool = False)\
             msg = "\n%s\nException occured when loading mesh.pkl of SO (%s)"\
                   "with id %d.".format(e, so.type, so.id)
             log_reps.error(msg)
-            return np.zeros((0, )).astype(np.int), np.zeros((0, )), np.zeros((0, ))
+            return np.zeros((0, )).astype(np.int32), np.zeros((0, )), np.zeros((0, ))
     else:
         if so.type == "sv" and not global_params.config.allow_mesh_gen_cells:
             log_reps.error("Mesh of SV %d not found.\n" % so.id)
-            return np.zeros((0,)).astype(np.int), np.zeros((0,)), np.zeros((0, ))
+            return np.zeros((0,)).astype(np.int32), np.zeros((0,)), np.zeros((0, ))
         indices, vertices, normals = so._mesh_from_scratch()
         col = np.zeros(0, dtype=np.uint8)
         try:
@@ -283,10 +333,10 @@ def load_mesh(so: 'SegmentationObject', recompute: bool = False)\
         except Exception as e:
             log_reps.error("Mesh of %s %d could not be saved:\n%s\n".format(
                 so.type, so.id, e))
-    vertices = np.array(vertices, dtype=np.int)
-    indices = np.array(indices, dtype=np.int)
-    normals = np.array(normals, dtype=np.float32)
-    col = np.array(col, dtype=np.uint8)
+    vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+    indices = np.ascontiguousarray(indices, dtype=np.int32)
+    normals = np.ascontiguousarray(normals, dtype=np.float32)
+    col = np.ascontiguousarray(col, dtype=np.uint8)
     return indices, vertices, normals
 
 
@@ -314,8 +364,8 @@ def load_skeleton(so: 'SegmentationObject', recompute: bool = False) \
         except Exception as e:
             log_reps.error("\n{}\nException occured when loading skeletons.pkl"
                            " of SO ({}) with id {}.".format(e, so.type, so.id))
-            return np.zeros((0, )).astype(np.int), np.zeros((0, )), \
-                   np.zeros((0, )).astype(np.int)
+            return np.zeros((0, )).astype(np.int32), np.zeros((0, )), \
+                   np.zeros((0, )).astype(np.int32)
     else:
         msg = "Skeleton of SV {} (size: {}) not found.\n".format(so.id, so.size)
         if so.type == "sv":
@@ -323,12 +373,12 @@ def load_skeleton(so: 'SegmentationObject', recompute: bool = False) \
                 log_reps.debug(msg)
             else:
                 log_reps.error(msg)
-            return np.zeros((0, )).astype(np.int), np.zeros((0, )),\
-                   np.zeros((0, )).astype(np.int)
+            return np.zeros((0, )).astype(np.int32), np.zeros((0, )),\
+                   np.zeros((0, )).astype(np.int32)
 
-    nodes = np.array(nodes, dtype=np.int)
-    diameters = np.array(diameters, dtype=np.float)
-    edges = np.array(edges, dtype=np.int)
+    nodes = np.ascontiguousarray(nodes, dtype=np.int32)
+    diameters = np.ascontiguousarray(diameters, dtype=np.float32)
+    edges = np.ascontiguousarray(edges, dtype=np.int32)
 
     return nodes, diameters, edges
 
@@ -350,7 +400,11 @@ def binary_closing(vx, n_iterations=13):
 
     vx = np.pad(vx, [[n_iterations]*2]*3, mode='constant')
 
-    vx = ndimage.morphology.binary_closing(vx, iterations=n_iterations)
+    # single dilation/erosion pass with an iterated structuring element
+    # instead of `n_iterations` sequential passes
+    struct = ndimage.iterate_structure(
+        ndimage.generate_binary_structure(3, 1), n_iterations)
+    vx = ndimage.binary_erosion(ndimage.binary_dilation(vx, struct), struct)
 
     vx = vx[n_iterations: -n_iterations,
             n_iterations: -n_iterations,
@@ -361,20 +415,25 @@ def binary_closing(vx, n_iterations=13):
 
 def sv_view_exists(args):
     ps, woglia = args
-    missing_ids = []
-    for p in ps:
+
+    def scan_dir(p):
         ad = AttributeDict(p + "/attr_dict.pkl", disable_locking=True)
-        obj_ixs = ad.keys()
         view_dc_p = p + "/views_woglia.pkl" if woglia else p + "/views.pkl"
         view_dc = CompressedStorage(view_dc_p, disable_locking=True)
-        for ix in obj_ixs:
-            if ix not in view_dc:
-                missing_ids.append(ix)
+        return set(ad.keys()) - set(view_dc.keys())
+
+    missing_ids = []
+    # storage reads are I/O bound -> overlap them with threads
+    with ThreadPoolExecutor(max_workers=8) as tpe:
+        for missing in tpe.map(scan_dir, ps):
+            missing_ids.extend(missing)
     return missing_ids
 
 
 def find_missing_sv_views(sd, woglia, n_cores=20):
-    multi_params = chunkify(sd.so_dir_paths, 100)
+    # only directories with an attribute dict can report ids
+    dir_paths = [p for p, has_attr, _, _ in _probe_so_dirs(sd) if has_attr]
+    multi_params = chunkify(dir_paths, 100)
     params = [(ps, woglia) for ps in multi_params]
     res = start_multiprocess_imap(sv_view_exists, params, nb_cpus=n_cores,
                                   debug=False)
@@ -393,14 +452,84 @@ def find_missing_sv_skeletons(svs, n_cores=20):
     return [svs[kk].id for kk in range(len(svs)) if res[kk]]
 
 
+_so_dir_probes = {}
+
+
+def _probe_so_dirs(sd: 'SegmentationDataset') -> List[Tuple[str, bool, bool, bool]]:
+    """
+    Records ``(path, has_attr_dict, has_views, has_voxel)`` for every
+    directory in ``sd.so_dir_paths``, cached per storage location
+    (``sd.so_storage_path``) so the missing-view and missing-attribute
+    scans share one directory listing per storage folder. Use
+    :func:`_invalidate_so_dir_probes` after adding or removing object
+    directories.
+    """
+    probes = _so_dir_probes.get(sd.so_storage_path)
+    if probes is not None:
+        return probes
+    probes = []
+    for p in sd.so_dir_paths:
+        try:
+            fnames = set(os.listdir(p))
+        except OSError:
+            fnames = set()
+        probes.append((p, "attr_dict.pkl" in fnames,
+                       "views.pkl" in fnames or "views_woglia.pkl" in fnames,
+                       "voxel.pkl" in fnames))
+    _so_dir_probes[sd.so_storage_path] = probes
+    return probes
+
+
+def _invalidate_so_dir_probes(sd: Optional['SegmentationDataset'] = None):
+    """
+    Drops the cached directory probes of `sd` (or of all datasets if None),
+    e.g. after object directories were created or deleted.
+    """
+    if sd is None:
+        _so_dir_probes.clear()
+    else:
+        _so_dir_probes.pop(sd.so_storage_path, None)
+
+
+def _attr_key_index(p):
+    """
+    Mapping of object ID to its attribute keys for ``p + '/attr_dict.pkl'``.
+    Backed by a small sidecar pickle next to the attribute dict so presence
+    checks do not deserialize the full attribute values; the sidecar is
+    rebuilt whenever it is older than the attribute dict.
+    """
+    ad_p = p + "/attr_dict.pkl"
+    sidecar_p = p + "/attr_dict.keys.pkl"
+    if os.path.isfile(sidecar_p) and \
+            os.path.getmtime(sidecar_p) >= os.path.getmtime(ad_p):
+        try:
+            return load_pkl2obj(sidecar_p)
+        except Exception as e:
+            log_reps.debug("Could not load attribute key index '{}': "
+                           "{}. Rebuilding.".format(sidecar_p, e))
+    ad = AttributeDict(ad_p, disable_locking=True)
+    key_index = {k: tuple(v.keys()) for k, v in ad.items()}
+    try:
+        write_obj2pkl(sidecar_p, key_index)
+    except OSError as e:
+        log_reps.debug("Could not write attribute key index '{}': "
+                       "{}".format(sidecar_p, e))
+    return key_index
+
+
 def sv_attr_exists(args):
     ps, attr_key = args
+
+    def scan_dir(p):
+        key_index = _attr_key_index(p)
+        return [k for k, attr_keys in key_index.items()
+                if attr_key not in attr_keys]
+
     missing_ids = []
-    for p in ps:
-        ad = AttributeDict(p + "/attr_dict.pkl", disable_locking=True)
-        for k, v in ad.items():
-            if attr_key not in v:
-                missing_ids.append(k)
+    # storage reads are I/O bound -> overlap them with threads
+    with ThreadPoolExecutor(max_workers=8) as tpe:
+        for missing in tpe.map(scan_dir, ps):
+            missing_ids.extend(missing)
     return missing_ids
 
 
@@ -417,7 +546,9 @@ def find_missing_sv_attributes(sd, attr_key, n_cores=20):
     -------
 
     """
-    multi_params = chunkify(sd.so_dir_paths, 100)
+    # only directories with an attribute dict can report ids
+    dir_paths = [p for p, has_attr, _, _ in _probe_so_dirs(sd) if has_attr]
+    multi_params = chunkify(dir_paths, 100)
     params = [(ps, attr_key) for ps in multi_params]
     res = start_multiprocess_imap(sv_attr_exists, params, nb_cpus=n_cores,
                                   debug=False)
@@ -12,6 +12,7 @@ from typing import List, Dict, Optional, Union, Tuple, Iterable, Generator
 import os
 import shutil
 from multiprocessing.pool import ThreadPool
+from concurrent.futures import ThreadPoolExecutor
 try:
     import cPickle as pkl
 except ImportError:
@@ -35,6 +36,72 @@ from .. import global_params
 from . import log_reps
 
 
+def _scan_ssv_ids(so_storage_path: str) -> Generator[int, None, None]:
+    """
+    Yields the SSV IDs found in the three-level `so_storage` directory
+    hierarchy. Uses `os.scandir`, which reports the entry type without a
+    per-path stat call, instead of glob pattern matching.
+    """
+    try:
+        lvl1_it = os.scandir(so_storage_path)
+    except OSError:
+        return
+    with lvl1_it:
+        for lvl1 in lvl1_it:
+            if not lvl1.is_dir():
+                continue
+            with os.scandir(lvl1.path) as lvl2_it:
+                for lvl2 in lvl2_it:
+                    if not lvl2.is_dir():
+                        continue
+                    with os.scandir(lvl2.path) as lvl3_it:
+                        for lvl3 in lvl3_it:
+                            if lvl3.is_dir():
+                                yield int(lvl3.name)
+
+
+class MappingDictView(object):
+    """
+    Read-only dict-like view of the supervoxel mapping stored as three
+    sorted numpy arrays (keys, flattened values and value offsets). Loaded
+    memory-mapped, so instantiating a dataset does not deserialize the
+    full mapping into Python objects; lookups use binary search.
+    """
+    def __init__(self, keys: np.ndarray, values_flat: np.ndarray,
+                 value_offsets: np.ndarray):
+        self._keys = keys
+        self._values_flat = values_flat
+        self._value_offsets = value_offsets
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key) -> bool:
+        ix = np.searchsorted(self._keys, key)
+        return ix < len(self._keys) and self._keys[ix] == key
+
+    def __getitem__(self, key) -> np.ndarray:
+        ix = np.searchsorted(self._keys, key)
+        if ix >= len(self._keys) or self._keys[ix] != key:
+            raise KeyError(key)
+        return self._values_flat[self._value_offsets[ix]:
+                                 self._value_offsets[ix + 1]]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def keys(self) -> np.ndarray:
+        return self._keys
+
+    def values(self):
+        for ix in range(len(self._keys)):
+            yield self._values_flat[self._value_offsets[ix]:
+                                    self._value_offsets[ix + 1]]
+
+    def items(self):
+        return zip(self._keys, self.values())
+
+
 class SuperSegmentationDataset(object):
     """
     This class represents a set of agglomerated supervoxels, which themselves are
@@ -174,18 +241,18 @@ class SuperSegmentationDataset(object):
             except:
                 raise Exception("unclear value for version")
         elif version == "new":
-            other_datasets = glob.glob(self.working_dir + "/%s_*" % self.type)
+            version_re = re.compile(r"^{}_(\d+)$".format(re.escape(self.type)))
             max_version = -1
-            for other_dataset in other_datasets:
-                try:
-                    other_version = \
-                        int(re.findall("[\d]+",
-                                       os.path.basename(other_dataset))[-1])
-                    if max_version < other_version:
-                        max_version = other_version
-                # version is not an integer, found version could be e.g. 'tmp'
-                except IndexError:
-                    pass
+            try:
+                with os.scandir(self.working_dir) as dir_it:
+                    for entry in dir_it:
+                        m = version_re.match(entry.name)
+                        # version is not an integer, found version could
+                        # be e.g. 'tmp'
+                        if m is not None:
+                            max_version = max(max_version, int(m.group(1)))
+            except OSError:
+                pass
 
             self._version = max_version + 1
         else:
@@ -274,7 +341,8 @@ class SuperSegmentationDataset(object):
         """
         Checks if the mapping dictionary exists (uper-supervoxel ID to sueprvoxel IDs).
         """
-        return os.path.exists(self.mapping_dict_path)
+        return os.path.exists(self.mapping_dict_path) or \
+            self.mapping_dict_npy_exists
 
     @property
     def mapping_dict_reversed_exists(self) -> bool:
@@ -291,6 +359,22 @@ class SuperSegmentationDataset(object):
         """
         return self.path + "/mapping_dict.pkl"
 
+    @property
+    def mapping_dict_npy_path(self) -> str:
+        """
+        Base path of the numpy representation of the mapping dictionary;
+        '_keys.npy', '_values_flat.npy' and '_value_offsets.npy' are
+        appended for the three arrays.
+        """
+        return self.path + "/mapping_dict"
+
+    @property
+    def mapping_dict_npy_exists(self) -> bool:
+        """
+        Checks if the numpy representation of the mapping dictionary exists.
+        """
+        return os.path.exists(self.mapping_dict_npy_path + "_keys.npy")
+
     @property
     def mapping_dict_reversed_path(self) -> str:
         """
@@ -368,9 +452,17 @@ class SuperSegmentationDataset(object):
                 self.load_mapping_dict()
                 self._ssv_ids = np.array(list(self.mapping_dict.keys()))
             else:
-                paths = glob.glob(self.path + "/so_storage/*/*/*/")
-                self._ssv_ids = np.array([int(os.path.basename(p.strip("/")))
-                                          for p in paths], dtype=np.uint)
+                self._ssv_ids = np.fromiter(
+                    _scan_ssv_ids(self.path + "/so_storage"),
+                    dtype=np.uint)
+                try:
+                    # subsequent cold starts hit the ids.npy fast path;
+                    # save_dataset_deep overwrites this together with all
+                    # other cache arrays, keeping their ordering aligned
+                    np.save(self.path + "/ids.npy", self._ssv_ids)
+                except OSError as e:
+                    log_reps.debug("Could not cache ssv_ids to '{}/ids.npy'"
+                                   ": {}".format(self.path, e))
         return self._ssv_ids
 
     @property
@@ -402,6 +494,52 @@ class SuperSegmentationDataset(object):
         self.load_mapping_dict()
         return np.concatenate(list(self.mapping_dict.values()))
 
+    @property
+    def rep_coords(self) -> np.ndarray:
+        """
+        Returns:
+            Representative coordinates of all SSVs; the ordering corresponds
+            to :py:attr:`~ssv_ids`. Served memory-mapped from the cache
+            array written by :func:`~save_dataset_deep`.
+        """
+        rep_coords = self.load_cached_data("rep_coord")
+        if rep_coords is None:
+            msg = "rep_coords were not cached... Please run save_dataset_deep"
+            log_reps.error(msg)
+            raise ValueError(msg)
+        return rep_coords
+
+    @property
+    def sizes(self) -> np.ndarray:
+        """
+        Returns:
+            Voxel counts of all SSVs; the ordering corresponds to
+            :py:attr:`~ssv_ids`. Served memory-mapped from the cache array
+            written by :func:`~save_dataset_deep`.
+        """
+        sizes = self.load_cached_data("size")
+        if sizes is None:
+            msg = "sizes were not cached... Please run save_dataset_deep"
+            log_reps.error(msg)
+            raise ValueError(msg)
+        return sizes
+
+    @property
+    def bounding_boxes(self) -> np.ndarray:
+        """
+        Returns:
+            Bounding boxes of all SSVs; the ordering corresponds to
+            :py:attr:`~ssv_ids`. Served memory-mapped from the cache array
+            written by :func:`~save_dataset_deep`.
+        """
+        bounding_boxes = self.load_cached_data("bounding_box")
+        if bounding_boxes is None:
+            msg = "bounding_boxes were not cached... Please run " \
+                  "save_dataset_deep"
+            log_reps.error(msg)
+            raise ValueError(msg)
+        return bounding_boxes
+
     @property
     def id_changer(self) -> List[int]:
         """
@@ -428,7 +566,12 @@ class SuperSegmentationDataset(object):
         """
         # TODO: remove 's' concept
         if os.path.exists(self.path + name + "s.npy"):
-            return np.load(self.path + name + "s.npy", allow_pickle=True)
+            try:
+                # numeric caches are memory-mapped: reads become zero-copy
+                # page-cache lookups instead of a full np.load copy
+                return np.load(self.path + name + "s.npy", mmap_mode='r')
+            except ValueError:  # object arrays cannot be memory-mapped
+                return np.load(self.path + name + "s.npy", allow_pickle=True)
 
     def sv_id_to_ssv_id(self, sv_id: int) -> int:
         """
@@ -441,6 +584,20 @@ class SuperSegmentationDataset(object):
         """
         return self.id_changer[sv_id]
 
+    def sv_ids_to_ssv_ids(self, sv_ids: Iterable[int]) -> np.ndarray:
+        """
+        Vectorized variant of :func:`~sv_id_to_ssv_id`; maps many
+        supervoxel IDs with a single indexing operation instead of one
+        Python-level lookup per element.
+
+        Args:
+            sv_ids: Supervoxel IDs.
+
+        Returns:
+            The super-supervoxel ID for every entry of `sv_ids`.
+        """
+        return np.asarray(self.id_changer)[np.asarray(sv_ids)]
+
     def get_segmentationdataset(self, obj_type):
         assert obj_type in self.version_dict
         return SegmentationDataset(obj_type, version=self.version_dict[obj_type],
@@ -454,6 +611,8 @@ class SuperSegmentationDataset(object):
             sv_mapping: Supervoxel agglomeration.
 
         """
+        # cached SSV objects were built on the previous agglomeration
+        self.ssv_dict.clear()
         assemble_from_mergelist(self, sv_mapping)
 
     def get_super_segmentation_object(self, obj_id: Union[int, Iterable[int]],
@@ -485,6 +644,9 @@ class SuperSegmentationDataset(object):
         if caching is None:
             caching = self.sso_caching
         if np.isscalar(obj_id):
+            cache_key = (obj_id, new_mapping, caching, create)
+            if cache_key in self.ssv_dict:
+                return self.ssv_dict[cache_key]
             if new_mapping:
                 sso = SuperSegmentationObject(obj_id,
                                               self.version,
@@ -515,6 +677,10 @@ class SuperSegmentationDataset(object):
                                               enable_locking_so=False,
                                               enable_locking=self.sso_locking)
             sso._dataset = self
+            if len(self.ssv_dict) >= 1024:
+                # bounded cache; cheap full reset instead of LRU bookkeeping
+                self.ssv_dict.clear()
+            self.ssv_dict[cache_key] = sso
         else:
             sso = []
             for ix in obj_id:
@@ -523,6 +689,18 @@ class SuperSegmentationDataset(object):
                            new_mapping=new_mapping, caching=caching))
         return sso
 
+    def _iter_blocks(self, stride: int,
+                     extra: Tuple = ()) -> Generator[Tuple, None, None]:
+        """
+        Yields dispatch tuples ``(ssv_id_block, version, version_dict,
+        working_dir, *extra)`` for the block-parallel worker methods.
+        Blocks are no-copy views into :py:attr:`~ssv_ids`.
+        """
+        ssv_ids = self.ssv_ids
+        for i in range(0, len(ssv_ids), stride):
+            yield (ssv_ids[i:i + stride], self.version, self.version_dict,
+                   self.working_dir) + tuple(extra)
+
     def save_dataset_shallow(self):
         """
         Saves :py:attr:`~version_dict`, :py:attr:`~mapping_dict` and :py:attr:`~id_changer`.
@@ -568,12 +746,7 @@ class SuperSegmentationDataset(object):
         Todo:
             * Check usage and remove code trace if appropriate.
         """
-        multi_params = []
-        for ssv_id_block in [self.ssv_ids[i:i + stride]
-                             for i in
-                             range(0, len(self.ssv_ids), stride)]:
-            multi_params.append([ssv_id_block, self.version, self.version_dict,
-                                 self.working_dir])
+        multi_params = list(self._iter_blocks(stride))
 
         if not qu.batchjob_enabled():
             sm.start_multiprocess(predict_cell_type_skelbased_thread,
@@ -588,7 +761,8 @@ class SuperSegmentationDataset(object):
         Save the version dictionary to a `.pkl` file.
         """
         if len(self.version_dict) > 0:
-            write_obj2pkl(self.version_dict_path, self.version_dict)
+            write_obj2pkl(self.version_dict_path, self.version_dict,
+                          compress=True)
 
     def load_version_dict(self):
         """
@@ -599,10 +773,37 @@ class SuperSegmentationDataset(object):
 
     def save_mapping_dict(self):
         """
-        Save the mapping dictionary to a `.pkl` file.
+        Save the mapping dictionary to a `.pkl` file and as numpy arrays
+        (see :func:`~save_mapping_dict_npy`).
         """
+        if isinstance(self._mapping_dict, MappingDictView):
+            # already persisted as the numpy representation
+            return
         if len(self.mapping_dict) > 0:
-            write_obj2pkl(self.mapping_dict_path, self.mapping_dict)
+            write_obj2pkl(self.mapping_dict_path, self.mapping_dict,
+                          compress=True)
+            self.save_mapping_dict_npy()
+
+    def save_mapping_dict_npy(self):
+        """
+        Save the mapping dictionary as three numpy arrays (sorted keys,
+        flattened supervoxel IDs and value offsets) which can be loaded
+        memory-mapped, see :class:`~MappingDictView`.
+        """
+        if len(self.mapping_dict) == 0 or \
+                isinstance(self._mapping_dict, MappingDictView):
+            return
+        keys = np.sort(np.fromiter(self.mapping_dict.keys(), dtype=np.int64,
+                                   count=len(self.mapping_dict)))
+        value_lst = [np.asarray(self.mapping_dict[k]).reshape(-1)
+                     for k in keys]
+        value_offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(v) for v in value_lst], out=value_offsets[1:])
+        values_flat = np.concatenate(value_lst).astype(np.int64, copy=False)
+        np.save(self.mapping_dict_npy_path + "_keys.npy", keys)
+        np.save(self.mapping_dict_npy_path + "_values_flat.npy", values_flat)
+        np.save(self.mapping_dict_npy_path + "_value_offsets.npy",
+                value_offsets)
 
     def save_mapping_dict_reversed(self):
         """
@@ -610,12 +811,22 @@ class SuperSegmentationDataset(object):
         """
         if len(self.mapping_dict_reversed) > 0:
             write_obj2pkl(self.mapping_dict_reversed_path,
-                          self._mapping_dict_reversed)
+                          self._mapping_dict_reversed, compress=True)
 
     def load_mapping_dict(self):
         """
-        Load the mapping dictionary from the `.pkl` file.
-        """
+        Load the mapping dictionary; prefers the memory-mapped numpy
+        representation and falls back to the `.pkl` file.
+        """
+        if self.mapping_dict_npy_exists:
+            self._mapping_dict = MappingDictView(
+                np.load(self.mapping_dict_npy_path + "_keys.npy",
+                        mmap_mode='r'),
+                np.load(self.mapping_dict_npy_path + "_values_flat.npy",
+                        mmap_mode='r'),
+                np.load(self.mapping_dict_npy_path + "_value_offsets.npy",
+                        mmap_mode='r'))
+            return
         assert self.mapping_dict_exists
         self._mapping_dict = load_pkl2obj(self.mapping_dict_path)
 
@@ -635,10 +846,32 @@ class SuperSegmentationDataset(object):
 
     def load_id_changer(self):
         """
-        Load the ID changer from the `.npy` file.
+        Load the ID changer from the `.npy` file (memory-mapped).
         """
         assert self.id_changer_exists
-        self._id_changer = np.load(self.id_changer_path)
+        self._id_changer = np.load(self.id_changer_path, mmap_mode='r')
+
+
+_worker_ssd_cache = {}
+
+
+def _get_worker_ssd(working_dir, version, version_dict, ssd_type='ssv'):
+    """
+    Process-local memoized dataset for the block workers. With the
+    persistent worker pool each process handles many blocks per dispatch;
+    constructing a new SuperSegmentationDataset (config parsing, cache
+    setup) per block is wasted work. Keyed on working directory, version
+    and type; a request for a different dataset replaces the cache.
+    """
+    key = (working_dir, version, ssd_type)
+    ssd = _worker_ssd_cache.get(key)
+    if ssd is None:
+        _worker_ssd_cache.clear()
+        ssd = SuperSegmentationDataset(working_dir=working_dir,
+                                       version=version, ssd_type=ssd_type,
+                                       version_dict=version_dict)
+        _worker_ssd_cache[key] = ssd
+    return ssd
 
 
 def save_dataset_deep(ssd: SuperSegmentationDataset, extract_only: bool = False,
@@ -693,26 +926,36 @@ def save_dataset_deep(ssd: SuperSegmentationDataset, extract_only: bool = False,
             with open(out_file, 'rb') as f:
                 results.append(pkl.load(f))
         shutil.rmtree(os.path.abspath(path_to_out + "/../"), ignore_errors=True)
-    attr_dict = {}
+    attributes = []
     for this_attr_dict in results:
         for attribute in this_attr_dict.keys():
-            if not attribute in attr_dict:
-                attr_dict[attribute] = []
-
-            attr_dict[attribute] += this_attr_dict[attribute]
+            if attribute not in attributes:
+                attributes.append(attribute)
 
     if not ssd.mapping_dict_exists or len(ssd.mapping_dict) == 0:
         # initialize mapping dict
-        ssd._mapping_dict = dict(zip(attr_dict["id"], attr_dict["sv"]))
+        ids, svs = [], []
+        for this_attr_dict in results:
+            # extend() concatenates array columns; `+=` would dispatch to
+            # ndarray broadcasting
+            ids.extend(this_attr_dict.get("id", []))
+            svs.extend(this_attr_dict.get("sv", []))
+        ssd._mapping_dict = dict(zip(ids, svs))
         ssd.save_dataset_shallow()
 
-    for attribute in attr_dict.keys():
+    # merge and write one attribute column at a time so peak memory is a
+    # single merged column instead of every attribute at once
+    for attribute in attributes:
+        attr_vals = []
+        for this_attr_dict in results:
+            if attribute in this_attr_dict:
+                attr_vals.extend(this_attr_dict[attribute])
         if extract_only:
             np.save(ssd.path + "/%ss_sel.npy" % attribute,  # Why '_sel'?
-                    attr_dict[attribute])
+                    attr_vals)
         else:
-            np.save(ssd.path + "/%ss.npy" % attribute,
-                    attr_dict[attribute])
+            np.save(ssd.path + "/%ss.npy" % attribute, attr_vals)
+        del attr_vals
     log_reps.info('Finished `save_dataset_deep`of {}.'.format(repr(ssd)))
 
 
@@ -726,44 +969,61 @@ def _write_super_segmentation_dataset_thread(args):
     ssd_type = args[6]
     new_mapping = args[7]
 
-    ssd = SuperSegmentationDataset(working_dir=working_dir, version=version,
-                                   ssd_type=ssd_type, version_dict=version_dict)
+    ssd = _get_worker_ssd(working_dir, version, version_dict,
+                          ssd_type=ssd_type)
 
     try:
-        ssd.load_mapping_dict()
+        if ssd._mapping_dict is None:
+            ssd.load_mapping_dict()
         mapping_dict_avail = True
     except:
         mapping_dict_avail = False
 
     attr_dict = dict(id=[])
-
-    for ssv_obj_id in ssv_obj_ids:
+    if not extract_only:
+        # the dense fixed-schema columns are streamed into preallocated
+        # typed arrays (4-8 bytes per entry instead of a boxed Python
+        # object); ragged and optional attributes stay in lists
+        n_ids = len(ssv_obj_ids)
+        attr_dict["id"] = np.empty(n_ids, dtype=np.uint64)
+        attr_dict["size"] = np.empty(n_ids, dtype=np.int64)
+        attr_dict["rep_coord"] = np.empty((n_ids, 3), dtype=np.int64)
+        attr_dict["bounding_box"] = np.empty((n_ids, 2, 3), dtype=np.int64)
+    _typed_attrs = ("id", "size", "rep_coord", "bounding_box")
+
+    for ix, ssv_obj_id in enumerate(ssv_obj_ids):
         ssv_obj = ssd.get_super_segmentation_object(ssv_obj_id,
                                                     new_mapping=new_mapping,
                                                     create=True)
         if ssv_obj.attr_dict_exists:
             ssv_obj.load_attr_dict()
 
+        attr_dict_changed = False
         if not extract_only:
 
             if len(ssv_obj.attr_dict["sv"]) == 0:
                 if mapping_dict_avail:
-                    ssv_obj = ssd.get_super_segmentation_object(ssv_obj_id, True)
-
-                    if ssv_obj.attr_dict_exists:
-                        ssv_obj.load_attr_dict()
+                    # fill the agglomeration directly instead of building a
+                    # second SSV object with `new_mapping=True`
+                    ssv_obj.attr_dict["sv"] = ssd.mapping_dict[ssv_obj_id]
+                    attr_dict_changed = True
                 else:
                     raise Exception("No mapping information found")
         if not extract_only:
             if "rep_coord" not in ssv_obj.attr_dict:
                 ssv_obj.attr_dict["rep_coord"] = ssv_obj.rep_coord
+                attr_dict_changed = True
             if "bounding_box" not in ssv_obj.attr_dict:
                 ssv_obj.attr_dict["bounding_box"] = ssv_obj.bounding_box
+                attr_dict_changed = True
             if "size" not in ssv_obj.attr_dict:
                 ssv_obj.attr_dict["size"] = ssv_obj.size
+                attr_dict_changed = True
 
-        ssv_obj.attr_dict["sv"] = np.array(ssv_obj.attr_dict["sv"],
-                                           dtype=np.int)
+        if not isinstance(ssv_obj.attr_dict["sv"], np.ndarray):
+            ssv_obj.attr_dict["sv"] = np.array(ssv_obj.attr_dict["sv"],
+                                               dtype=np.int)
+            attr_dict_changed = True
         if extract_only:
             ignore = False
             for attribute in attr_keys:
@@ -784,23 +1044,54 @@ def _write_super_segmentation_dataset_thread(args):
                 else:
                     attr_dict[attribute].append(None)
         else:
-            attr_dict["id"].append(ssv_obj_id)
+            attr_dict["id"][ix] = ssv_obj_id
+            attr_dict["size"][ix] = ssv_obj.attr_dict["size"]
+            attr_dict["rep_coord"][ix] = ssv_obj.attr_dict["rep_coord"]
+            attr_dict["bounding_box"][ix] = ssv_obj.attr_dict["bounding_box"]
             for attribute in ssv_obj.attr_dict.keys():
+                if attribute in _typed_attrs:
+                    continue
                 if attribute not in attr_dict:
                     attr_dict[attribute] = []
 
                 attr_dict[attribute].append(ssv_obj.attr_dict[attribute])
 
-            ssv_obj.save_attr_dict()
+            if attr_dict_changed:
+                # skip the pickle write-back when nothing was added
+                ssv_obj.save_attr_dict()
     return attr_dict
 
 
-def export_to_knossosdataset(ssd, kd, stride=1000, nb_cpus=10):
-    multi_params = []
-    for ssv_id_block in [ssd.ssv_ids[i:i + stride]
-                         for i in range(0, len(ssd.ssv_ids), stride)]:
-        multi_params.append([ssv_id_block, ssd.version, ssd.version_dict,
-                             ssd.working_dir, kd.knossos_path, nb_cpus])
+def export_to_knossosdataset(ssd, kd, stride=1000, nb_cpus=10, blocked=True):
+    """
+    If `blocked` is set and representative coordinates are cached, SSV IDs
+    are ordered by the knossos cube their `rep_coord` falls into before
+    being sliced into blocks, so each worker touches few distinct cubes.
+    """
+    ssv_ids = ssd.ssv_ids
+    # drop empty SSVs before dispatch; the cached size column replaces one
+    # object construction plus attribute-dict read per skipped SSV
+    sizes = ssd.load_cached_data("size")
+    if sizes is not None and len(sizes) == len(ssv_ids):
+        ssv_ids = ssv_ids[np.asarray(sizes) > 0]
+    if blocked:
+        rep_coords = ssd.load_cached_data("rep_coord")
+        if rep_coords is not None and len(rep_coords) == len(ssd.ssv_ids):
+            rep_coords = np.asarray(rep_coords)
+            if sizes is not None and len(sizes) == len(ssd.ssv_ids):
+                rep_coords = rep_coords[np.asarray(sizes) > 0]
+            tiles = rep_coords // 128  # knossos cube edge length
+            ssv_ids = ssv_ids[np.lexsort(tiles.T)]
+        else:
+            log_reps.warn("'rep_coord' cache not available; exporting in "
+                          "unordered ID blocks.")
+    # per-SSV runtimes vary by orders of magnitude, so cap the block size
+    # such that every worker processes several blocks and the pool can
+    # rebalance around slow ones
+    stride = max(1, min(stride, len(ssv_ids) // (nb_cpus * 8)))
+    multi_params = [(ssv_ids[i:i + stride], ssd.version, ssd.version_dict,
+                     ssd.working_dir, kd.knossos_path, nb_cpus)
+                    for i in range(0, len(ssv_ids), stride)]
 
     if not qu.batchjob_enabled():
         sm.start_multiprocess(_export_ssv_to_knossosdataset_thread,
@@ -821,21 +1112,52 @@ def _export_ssv_to_knossosdataset_thread(args):
 
     kd = knossosdataset.KnossosDataset().initialize_from_knossos_path(kd_path)
 
-    ssd = SuperSegmentationDataset(working_dir, version, version_dict)
-    ssd.load_mapping_dict()
+    ssd = _get_worker_ssd(working_dir, version, version_dict)
+    if ssd._mapping_dict is None:
+        ssd.load_mapping_dict()
 
     for ssv_obj_id in ssv_obj_ids:
         ssv_obj = ssd.get_super_segmentation_object(ssv_obj_id, True)
 
         offset = ssv_obj.bounding_box[0]
         if not 0 in offset:
+            # fused cast + broadcast; drops the intermediate uint64 copy
+            voxel_ids = np.empty(ssv_obj.voxels.shape, dtype=np.uint64)
+            np.multiply(ssv_obj.voxels, np.uint64(ssv_obj_id),
+                        out=voxel_ids)
             kd.from_matrix_to_cubes(offset,
-                                    data=ssv_obj.voxels.astype(np.uint64) *
-                                         ssv_obj_id,
+                                    data=voxel_ids,
                                     overwrite=False,
                                     nb_threads=nb_threads)
 
 
+def _spread_bits_3(v: np.ndarray) -> np.ndarray:
+    """
+    Spreads the lower 21 bits of each uint64 entry to every third bit
+    (part of the Morton code computation).
+    """
+    v = v.astype(np.uint64)
+    v = (v | (v << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x100f00f00f00f00f)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x10c30c30c30c30c3)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x1249249249249249)
+    return v
+
+
+def _morton_argsort(coords: np.ndarray) -> np.ndarray:
+    """
+    Returns the permutation that orders integer (N, 3) coordinates along
+    the Z-order (Morton) curve, i.e. so that neighbours in the ordering
+    are close in all three dimensions.
+    """
+    coords = np.asarray(coords, dtype=np.uint64)
+    codes = _spread_bits_3(coords[:, 0]) \
+        | (_spread_bits_3(coords[:, 1]) << np.uint64(1)) \
+        | (_spread_bits_3(coords[:, 2]) << np.uint64(2))
+    return np.argsort(codes)
+
+
 def convert_knossosdataset(ssd, sv_kd_path, ssv_kd_path,
                            stride=256, qsub_pe=None, qsub_queue=None,
                            nb_cpus=None):
@@ -849,24 +1171,27 @@ def convert_knossosdataset(ssd, sv_kd_path, ssv_kd_path,
                                        sv_kd.experiment_name, mags=[1])
 
     size = np.ones(3, dtype=np.int) * stride
-    multi_params = []
-    offsets = []
-    for x in range(0, sv_kd.boundary[0], stride):
-        for y in range(0, sv_kd.boundary[1], stride):
-            for z in range(0, sv_kd.boundary[2], stride):
-                offsets.append([x, y, z])
-                if len(offsets) >= 20:
-                    multi_params.append([ssd.version, ssd.version_dict,
-                                         ssd.working_dir, nb_cpus,
-                                         sv_kd_path, ssv_kd_path, offsets,
-                                         size])
-                    offsets = []
-
-    if len(offsets) > 0:
-        multi_params.append([ssd.version, ssd.version_dict,
-                             ssd.working_dir, nb_cpus,
-                             sv_kd_path, ssv_kd_path, offsets,
-                             size])
+    xs = np.arange(0, sv_kd.boundary[0], stride)
+    ys = np.arange(0, sv_kd.boundary[1], stride)
+    zs = np.arange(0, sv_kd.boundary[2], stride)
+    offsets_arr = np.stack(np.meshgrid(xs, ys, zs, indexing='ij'),
+                           axis=-1).reshape(-1, 3)
+
+    # Z-order the offsets so each batch covers a compact 3-D cluster and
+    # adjacent offsets share knossos cubes in the page cache
+    if len(offsets_arr) > 1:
+        offsets_arr = offsets_arr[_morton_argsort(offsets_arr // stride)]
+    offsets = offsets_arr.tolist()
+
+    # keep batches small enough that every worker gets several, so the
+    # pool balances slow batches dynamically instead of idling on a
+    # fixed pre-assignment
+    nb_workers = nb_cpus if nb_cpus is not None else cpu_count()
+    batch_size = max(1, min(20, len(offsets) // (nb_workers * 8)))
+    multi_params = [[ssd.version, ssd.version_dict, ssd.working_dir,
+                     nb_cpus, sv_kd_path, ssv_kd_path,
+                     offsets[i:i + batch_size], size]
+                    for i in range(0, len(offsets), batch_size)]
 
     if (qsub_pe is None and qsub_queue is None) or not qu.batchjob_enabled():
         sm.start_multiprocess(_convert_knossosdataset_thread,
@@ -892,31 +1217,107 @@ def _convert_knossosdataset_thread(args):
     sv_kd = kd_factory(sv_kd_path)
     ssv_kd = kd_factory(ssv_kd_path)
 
-    ssd = SuperSegmentationDataset(working_dir, version, version_dict)
-    ssd.load_id_changer()
-
+    ssd = _get_worker_ssd(working_dir, version, version_dict)
+    # worker-local contiguous uint32 LUT (the dataset attribute is a
+    # read-only memmap), built once per process and reused across blocks
+    id_changer = getattr(ssd, '_id_changer_u32', None)
+    if id_changer is None:
+        id_changer = np.ascontiguousarray(ssd.id_changer, dtype=np.uint32)
+        ssd._id_changer_u32 = id_changer
+    # two remap buffers: one may still be owned by an in-flight write
+    # while the other is filled
+    remap_bufs = [np.empty(int(np.prod(size)), dtype=np.uint32)
+                  for _ in range(2)]
+
+    # knossos_utils spins up a fresh internal thread pool for every
+    # read/write when nb_threads > 1; with the read/write pipeline and
+    # one process per core the extra fan-out only adds startup overhead
+    # and oversubscription, so the innermost calls run single-threaded
+    read_threads = 1
+
+    # coalesce offsets into contiguous x-runs sharing the same (y, z):
+    # one oversized read then replaces K per-cube reads
+    step = int(size[0])
+    by_yz = {}
     for offset in offsets:
-        block = sv_kd.from_overlaycubes_to_matrix(size, offset,
+        by_yz.setdefault((offset[1], offset[2]), []).append(offset[0])
+    runs = []
+    for (y, z), xs in sorted(by_yz.items()):
+        xs.sort()
+        run_start = xs[0]
+        run_len = 1
+        for x in xs[1:]:
+            if x == run_start + run_len * step:
+                run_len += 1
+            else:
+                runs.append(((run_start, y, z), run_len))
+                run_start = x
+                run_len = 1
+        runs.append(((run_start, y, z), run_len))
+
+    def _read_run(run):
+        (x, y, z), k = run
+        read_size = np.array([step * k, size[1], size[2]],
+                             dtype=np.asarray(size).dtype)
+        block = sv_kd.from_overlaycubes_to_matrix(read_size, [x, y, z],
                                                   datatype=np.uint32,
-                                                  nb_threads=nb_threads)
-
-        block = ssd.id_changer[block]
-
-        ssv_kd.from_matrix_to_cubes(offset,
-                                    data=block.astype(np.uint32),
-                                    datatype=np.uint32,
-                                    overwrite=False,
-                                    nb_threads=nb_threads)
-
-        raw = sv_kd.from_raw_cubes_to_matrix(size, offset,
-                                             nb_threads=nb_threads)
-
-        ssv_kd.from_matrix_to_cubes(offset,
-                                    data=raw,
-                                    datatype=np.uint8,
-                                    as_raw=True,
-                                    overwrite=False,
-                                    nb_threads=nb_threads)
+                                                  nb_threads=read_threads)
+        raw = sv_kd.from_raw_cubes_to_matrix(read_size, [x, y, z],
+                                             nb_threads=read_threads)
+        return block, raw
+
+    def _write_pair(offset, block, raw):
+        # cubes at the volume border are commonly all-zero; any()
+        # short-circuits on the first nonzero byte and skipping saves
+        # the whole compress + write
+        if block.any():
+            ssv_kd.from_matrix_to_cubes(offset,
+                                        data=block,
+                                        datatype=np.uint32,
+                                        overwrite=False,
+                                        nb_threads=read_threads)
+        if raw.any():
+            ssv_kd.from_matrix_to_cubes(offset,
+                                        data=raw,
+                                        datatype=np.uint8,
+                                        as_raw=True,
+                                        overwrite=False,
+                                        nb_threads=read_threads)
+
+    # three-stage pipeline: run i + 1 is read while run i is remapped and
+    # the previous sub-cube is still being written
+    with ThreadPoolExecutor(max_workers=2) as read_tpe, \
+            ThreadPoolExecutor(max_workers=1) as write_tpe:
+        pending = None
+        write_futures = [None, None]
+        buf_ix = 0
+        for ix, run in enumerate(runs):
+            if pending is None:
+                run_block, run_raw = _read_run(run)
+            else:
+                run_block, run_raw = pending.result()
+            if ix + 1 < len(runs):
+                pending = read_tpe.submit(_read_run, runs[ix + 1])
+
+            (x0, y, z), k = run
+            for j in range(k):
+                offset = [x0 + j * step, y, z]
+                block = run_block[j * step:(j + 1) * step]
+
+                # reclaim the buffer from the write before last
+                buf_ix = 1 - buf_ix
+                if write_futures[buf_ix] is not None:
+                    write_futures[buf_ix].result()
+                out_flat = remap_bufs[buf_ix][:block.size]
+                np.take(id_changer, block.reshape(-1), out=out_flat)
+                block = out_flat.reshape(block.shape)
+
+                write_futures[buf_ix] = write_tpe.submit(
+                    _write_pair, offset, block,
+                    run_raw[j * step:(j + 1) * step])
+        for fut in write_futures:
+            if fut is not None:
+                fut.result()
 
 
 def load_voxels_downsampled(sso, downsampling=(2, 2, 1), nb_threads=10):
@@ -982,7 +1383,7 @@ def predict_cell_type_skelbased_thread(args):
     version_dict = args[2]
     working_dir = args[3]
 
-    ssd = SuperSegmentationDataset(working_dir, version, version_dict)
+    ssd = _get_worker_ssd(working_dir, version, version_dict)
 
     for ssv_id in ssv_obj_ids:
         ssv = ssd.get_super_segmentation_object(ssv_id)
@@ -1009,8 +1410,9 @@ def export_skeletons_thread(args):
     obj_types = args[4]
     apply_mapping = args[5]
 
-    ssd = SuperSegmentationDataset(working_dir, version, version_dict)
-    ssd.load_mapping_dict()
+    ssd = _get_worker_ssd(working_dir, version, version_dict)
+    if ssd._mapping_dict is None:
+        ssd.load_mapping_dict()
 
     no_skel_cnt = 0
     for ssv_id in ssv_obj_ids:
@@ -1070,9 +1472,11 @@ def export_to_knossosdataset_thread(args):
 
         offset = ssv_obj.bounding_box[0]
         if not 0 in offset:
+            voxel_ids = np.empty(ssv_obj.voxels.shape, dtype=np.uint32)
+            np.multiply(ssv_obj.voxels, np.uint32(ssv_obj_id),
+                        out=voxel_ids)
             kd.from_matrix_to_cubes(ssv_obj.bounding_box,
-                                    data=ssv_obj.voxels.astype(np.uint32) *
-                                         ssv_obj_id,
+                                    data=voxel_ids,
                                     overwrite=False,
                                     nb_threads=nb_threads)
 
@@ -1202,7 +1606,7 @@ def write_super_segmentation_dataset_thread(args: Tuple):
 
                 attr_dict[attribute].append(ssv_obj.attr_dict[attribute])
 
-                ssv_obj.save_attr_dict()
+            ssv_obj.save_attr_dict()
 
     return attr_dict
 
@@ -306,63 +306,80 @@ def calculate_skeleton(sso, size_threshold=1e20, kd=None,
                                                     coord_scaling)
 
 
+@jit(nopython=True, nogil=True, cache=True)
+def _or_into_downsampled(voxels, bx, by, bz, sv_voxels, d0, d1, d2):
+    """
+    Writes the downsampled nonzero voxels of `sv_voxels` into the uint8
+    volume `voxels` at block offset ``(bx, by, bz)``. The strided read
+    happens inside the kernel, so no downsampled temporary is created.
+    Releases the GIL (``nogil``), so pool workers overlap for real.
+    """
+    n0 = (sv_voxels.shape[0] + d0 - 1) // d0
+    n1 = (sv_voxels.shape[1] + d1 - 1) // d1
+    n2 = (sv_voxels.shape[2] + d2 - 1) // d2
+    for i in range(n0):
+        if bx + i >= voxels.shape[0]:
+            break
+        for j in range(n1):
+            if by + j >= voxels.shape[1]:
+                break
+            for k in range(n2):
+                if bz + k >= voxels.shape[2]:
+                    break
+                if sv_voxels[i * d0, j * d1, k * d2]:
+                    voxels[bx + i, by + j, bz + k] = 1
+
+
 def load_voxels_downsampled(sso, downsampling=(2, 2, 1), nb_threads=10):
-    def _load_sv_voxels_thread(args):
-        sv_id = args[0]
-        sv = segmentation.SegmentationObject(sv_id,
-                                             obj_type="sv",
-                                             version=sso.version_dict[
-                                                 "sv"],
-                                             working_dir=sso.working_dir,
-                                             config=sso.config,
-                                             voxel_caching=False)
-        if sv.voxels_exist:
-            box = [np.array(sv.bounding_box[0] - sso.bounding_box[0],
-                            dtype=np.int)]
-
-            box[0] /= downsampling
-            size = np.array(sv.bounding_box[1] -
-                            sv.bounding_box[0], dtype=np.float)
-            size = np.ceil(size.astype(np.float) /
-                           downsampling).astype(np.int)
-
-            box.append(box[0] + size)
-
-            sv_voxels = sv.voxels
-            if not isinstance(sv_voxels, int):
-                sv_voxels = sv_voxels[::downsampling[0],
-                            ::downsampling[1],
-                            ::downsampling[2]]
-
-                voxels[box[0][0]: box[1][0],
-                box[0][1]: box[1][1],
-                box[0][2]: box[1][2]][sv_voxels] = True
-
-    downsampling = np.array(downsampling, dtype=np.int)
+    def _load_sv_voxels_thread(sv_ids):
+        for sv_id in sv_ids:
+            sv = segmentation.SegmentationObject(sv_id,
+                                                 obj_type="sv",
+                                                 version=sso.version_dict[
+                                                     "sv"],
+                                                 working_dir=sso.working_dir,
+                                                 config=sso.config,
+                                                 voxel_caching=False)
+            if sv.voxels_exist:
+                box_offset = (sv.bounding_box[0] - sso.bounding_box[0]) \
+                    // downsampling
+
+                sv_voxels = sv.voxels
+                if not isinstance(sv_voxels, int):
+                    _or_into_downsampled(voxels, int(box_offset[0]),
+                                         int(box_offset[1]),
+                                         int(box_offset[2]),
+                                         sv_voxels, int(downsampling[0]),
+                                         int(downsampling[1]),
+                                         int(downsampling[2]))
+
+    downsampling = np.array(downsampling, dtype=np.int64)
 
     if len(sso.sv_ids) == 0:
         return None
 
     voxel_box_size = sso.bounding_box[1] - sso.bounding_box[0]
-    voxel_box_size = voxel_box_size.astype(np.float)
+    voxel_box_size = np.ceil(
+        voxel_box_size / downsampling).astype(np.int64)
 
-    voxel_box_size = np.ceil(voxel_box_size / downsampling).astype(np.int)
-
-    voxels = np.zeros(voxel_box_size, dtype=np.bool)
-
-    multi_params = []
-    for sv_id in sso.sv_ids:
-        multi_params.append([sv_id])
+    # uint8 keeps the kernel's stores plain byte writes; viewed as bool on
+    # return (free, both are 1 byte per voxel)
+    voxels = np.zeros(tuple(voxel_box_size), dtype=np.uint8)
 
     if nb_threads > 1:
+        # a few batches per thread amortize task dispatch while leaving
+        # room for rebalancing around large SVs
+        batch_size = max(1, len(sso.sv_ids) // (4 * nb_threads))
+        batches = [sso.sv_ids[i:i + batch_size]
+                   for i in range(0, len(sso.sv_ids), batch_size)]
         pool = ThreadPool(nb_threads)
-        pool.map(_load_sv_voxels_thread, multi_params)
+        pool.map(_load_sv_voxels_thread, batches)
         pool.close()
         pool.join()
     else:
-        map(_load_sv_voxels_thread, multi_params)
+        _load_sv_voxels_thread(sso.sv_ids)
 
-    return voxels
+    return voxels.view(np.bool_)
 
 
 def create_new_skeleton(sv_id, sso):
@@ -15,6 +15,7 @@ import shutil
 import time
 import tqdm
 from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from scipy import spatial
 from typing import Optional, Dict, List, Tuple, Any, Union, TYPE_CHECKING, Iterable
 if TYPE_CHECKING:
@@ -1504,22 +1505,35 @@ class SuperSegmentationObject(object):
         """
         assert isinstance(obj_types, list)
 
-        mappings = dict((obj_type, Counter()) for obj_type in obj_types)
-        for sv in self.svs:
-            sv.load_attr_dict()
-
+        mappings = dict((obj_type, ([], [])) for obj_type in obj_types)
+        svs = list(self.svs)
+        # one small pickle read per supervoxel; overlap the random reads
+        with ThreadPoolExecutor(max_workers=16) as tpe:
+            list(tpe.map(lambda sv: sv.load_attr_dict(), svs))
+        for sv in svs:
             for obj_type in obj_types:
                 if "mapping_%s_ids" % obj_type in sv.attr_dict:
-                    keys = sv.attr_dict["mapping_%s_ids" % obj_type]
-                    values = sv.attr_dict["mapping_%s_ratios" % obj_type]
-                    mappings[obj_type] += Counter(dict(zip(keys, values)))
+                    key_arrs, ratio_arrs = mappings[obj_type]
+                    key_arrs.append(np.asarray(
+                        sv.attr_dict["mapping_%s_ids" % obj_type]))
+                    ratio_arrs.append(np.asarray(
+                        sv.attr_dict["mapping_%s_ratios" % obj_type]))
 
         for obj_type in obj_types:
-            if obj_type in mappings:
+            key_arrs, ratio_arrs = mappings[obj_type]
+            if len(key_arrs) > 0:
+                # C-level grouped sum instead of per-SV Counter merges
+                keys = np.concatenate(key_arrs)
+                values = np.concatenate(ratio_arrs)
+                unique_keys, inv = np.unique(keys, return_inverse=True)
+                summed_ratios = np.bincount(inv, weights=values)
                 self.attr_dict["mapping_%s_ids" % obj_type] = \
-                    list(mappings[obj_type].keys())
+                    unique_keys.tolist()
                 self.attr_dict["mapping_%s_ratios" % obj_type] = \
-                    list(mappings[obj_type].values())
+                    summed_ratios.tolist()
+            else:
+                self.attr_dict["mapping_%s_ids" % obj_type] = []
+                self.attr_dict["mapping_%s_ratios" % obj_type] = []
 
         if save:
             self.save_attr_dict()
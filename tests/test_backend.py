@@ -364,6 +364,40 @@ def test_compression_and_decompression_for_voxel_dictL():
         raise AssertionError
 
 
+def test_bitpacked_bool_roundtrip_for_voxel_dictL():
+    # bool masks take the bit-packed storage path; use shapes whose voxel
+    # counts are not multiples of 8 so the padding bits get exercised
+    try:
+        vd = VoxelStorageL(test_p, read_only=False)
+        voxel_masks = [np.random.rand(13, 7, 5) > 0.5,
+                       np.random.rand(3, 9, 11) > 0.5]
+        offsets = np.random.randint(0, 1000, (2, 3))
+        vd[8192734] = [voxel_masks, offsets]
+        vd.push()
+        del vd
+        vd = VoxelStorageL(test_p, read_only=False)
+        read_masks, read_offsets = vd[8192734]
+        for i in range(len(offsets)):
+            assert read_masks[i].dtype == np.bool_
+            assert np.array_equal(read_masks[i], voxel_masks[i])
+        assert np.allclose(read_offsets, offsets)
+        extra_mask = np.random.rand(6, 5, 7) > 0.5
+        extra_offset = np.array([17, 23, 42])
+        vd.append(8192734, extra_mask, extra_offset)
+        vd.push()
+        del vd
+        vd = VoxelStorageL(test_p, read_only=True)
+        read_masks, read_offsets = vd[8192734]
+        assert np.array_equal(read_masks[-1], extra_mask)
+        assert np.allclose(read_offsets[-1], extra_offset)
+        del vd
+        os.remove(test_p)
+        logging.info('PASSED: test_bitpacked_bool_roundtrip_for_voxel_dictL')
+    except Exception as e:
+        logging.warning('FAILED: test_bitpacked_bool_roundtrip_for_voxel_dictL: ' + str(e))
+        raise AssertionError
+
+
 def test_basics_write_txt2kzip():
 
     """
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from sklearn.metrics import log_loss
+from scipy.special import softmax
+
+from syconn.handler.prediction import certainty_estimate
+
+
+def _certainty_reference(inp):
+    """Original `certainty_estimate` based on `sklearn.metrics.log_loss`."""
+    proba = np.sum(inp, axis=0)
+    proba = np.sort(proba)[::-1] / np.sum(proba)
+    if np.max(proba) == 1:
+        return 1
+    y_true = np.zeros_like(proba)
+    y_true[0] = 1
+    loss = log_loss(y_true, proba)
+    loss_worst = log_loss(y_true, np.ones_like(y_true) / len(y_true))
+    return 1 - loss / loss_worst
+
+
+def test_certainty_estimate_matches_log_loss_reference():
+    rng = np.random.RandomState(0)
+    for _ in range(50):
+        inp = rng.rand(rng.randint(1, 20), rng.randint(2, 10))
+        assert certainty_estimate(inp) == pytest.approx(
+            _certainty_reference(inp), abs=1e-12)
+
+
+def test_certainty_estimate_logit_matches_log_loss_reference():
+    rng = np.random.RandomState(1)
+    for _ in range(20):
+        logits = rng.randn(rng.randint(1, 20), rng.randint(2, 10))
+        assert certainty_estimate(logits, is_logit=True) == pytest.approx(
+            _certainty_reference(softmax(logits, axis=1)), abs=1e-12)
+
+
+def test_certainty_estimate_pinned_values():
+    cases = [(1, (4, 3), 0.11184201774243252),
+             (2, (10, 5), 0.0996968195604011),
+             (3, (1, 2), 0.16990636493162947)]
+    for seed, shape, expected in cases:
+        inp = np.random.RandomState(seed).rand(*shape)
+        assert certainty_estimate(inp) == pytest.approx(expected, abs=1e-12)
+
+
+def test_certainty_estimate_one_hot_is_certain():
+    inp = np.zeros((3, 4))
+    inp[:, 2] = 1.
+    assert certainty_estimate(inp) == 1